@@ -3,6 +3,13 @@ from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from config import Config
 from models import db
+from utils.cache import init_cache
+from utils.compression import init_compression
+from utils.json_provider import init_json
+from utils.metrics import init_metrics
+from utils.migrations import init_commands, run_migrations
+from utils.replicas import init_replicas
+from utils.search import ensure_search_index
 
 jwt = JWTManager()
 
@@ -14,6 +21,12 @@ def create_app():
     db.init_app(app)
     jwt.init_app(app)
     CORS(app)
+    init_json(app)
+    init_compression(app)
+    init_cache(app)
+    init_commands(app)
+    init_metrics(app)
+    init_replicas(app)
     
     # Register blueprints - ONLY YOUR ASSIGNED PARTS
     from routes.animal_routes import animal_bp
@@ -26,6 +39,8 @@ def create_app():
     # Create tables
     with app.app_context():
         db.create_all()
+        ensure_search_index()
+        run_migrations()
     
     @app.route('/')
     def index():
@@ -0,0 +1,162 @@
+"""
+ASGI serving mode: read endpoints on asyncio, everything else on the WSGI path.
+
+GET/HEAD requests for the endpoints in ASYNC_ENDPOINTS are dispatched on the
+event loop. The regular Flask view runs unchanged (JWT checks, ETags,
+caches, fieldsets, compression, metrics), but inside an AsyncSession's
+run_sync greenlet with db.session pointed at that session, so every SQL
+round trip awaits aiosqlite/asyncpg instead of pinning a thread. One
+process can then hold thousands of reads in flight, bounded by
+ASYNC_POOL_SIZE connections rather than by threads.
+
+Writes, streamed exports and anything not listed go to the Flask app
+through a2wsgi's thread pool, exactly as under a WSGI server.
+
+    uvicorn asgi:create_asgi_app --factory --port 5000
+    python run.py --asgi
+"""
+import io
+import sys
+
+from a2wsgi import WSGIMiddleware
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from werkzeug.exceptions import HTTPException
+
+from models import db
+from utils.metrics import instrument_engine
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg'
+}
+
+
+def async_database_url(url):
+    """The async-driver equivalent of a sync SQLAlchemy URL"""
+    url = make_url(url)
+    if url.drivername not in ASYNC_DRIVERS:
+        raise ValueError(f'No async driver configured for {url.drivername}')
+    return url.set(drivername=ASYNC_DRIVERS[url.drivername])
+
+
+def build_environ(scope, body=b''):
+    """WSGI environ for an ASGI HTTP scope, enough for a Flask request context"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+            continue
+        key = f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class AsyncReadApp:
+    """ASGI app serving ASYNC_ENDPOINTS on the event loop and the rest via WSGI"""
+    
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        config = flask_app.config
+        self.endpoints = frozenset(config.get('ASYNC_ENDPOINTS', ()))
+        self.wsgi = WSGIMiddleware(flask_app, workers=config.get('ASYNC_WSGI_WORKERS', 10))
+        
+        with flask_app.app_context():
+            url = make_url(config.get('ASYNC_DATABASE_URL') or async_database_url(db.engine.url))
+        options = {}
+        if url.get_backend_name() != 'sqlite' or url.database not in (None, '', ':memory:'):
+            options = {'pool_size': config.get('ASYNC_POOL_SIZE', 20),
+                       'max_overflow': config.get('ASYNC_MAX_OVERFLOW', 10)}
+        self.engine = create_async_engine(url, **options)
+        if flask_app.extensions.get('metrics') is not None:
+            instrument_engine(self.engine.sync_engine)
+        self.url_adapter = flask_app.url_map.bind('localhost')
+    
+    def is_async(self, scope):
+        if scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD'):
+            return False
+        try:
+            endpoint, _ = self.url_adapter.match(scope['path'], method=scope['method'])
+        except HTTPException:
+            return False
+        return endpoint in self.endpoints
+    
+    def _dispatch(self, session, environ):
+        """Run the Flask request with db.session bound to the greenlet-backed session"""
+        app = self.flask_app
+        # A fresh app context per request keys db.session's registry to
+        # this request alone, even when the caller already has one pushed
+        app_ctx = app.app_context()
+        ctx = app.request_context(environ)
+        error = None
+        app_ctx.push()
+        try:
+            ctx.push()
+            db.session.registry.set(session)
+            try:
+                response = app.full_dispatch_request()
+            except Exception as e:
+                error = e
+                response = app.handle_exception(e)
+            body = b'' if environ['REQUEST_METHOD'] == 'HEAD' else response.get_data()
+            headers = [(name.lower().encode('latin1'), value.encode('latin1'))
+                       for name, value in response.headers.to_wsgi_list()]
+            response.close()
+            return response.status_code, headers, body
+        finally:
+            # The AsyncSession owns this session; keep Flask-SQLAlchemy's
+            # teardown from closing it outside the greenlet
+            db.session.registry.clear()
+            ctx.pop(error)
+            app_ctx.pop(error)
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if not self.is_async(scope):
+            return await self.wsgi(scope, receive, send)
+        
+        async with AsyncSession(self.engine, expire_on_commit=False) as session:
+            status, headers, body = await session.run_sync(self._dispatch, build_environ(scope))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+    
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def create_asgi_app(flask_app=None):
+    if flask_app is None:
+        from app import create_app
+        flask_app = create_app()
+    return AsyncReadApp(flask_app)
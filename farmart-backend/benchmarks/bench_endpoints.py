@@ -0,0 +1,257 @@
+"""
+Endpoint latency suite over a synthetic, skewed dataset.
+
+Seeds (or reuses) a database built by benchmarks/dataset.py, then drives
+every read endpoint of both apps, plus checkout, through the WSGI app from
+a thread pool, one endpoint at a time. For each endpoint it reports p50,
+p95 and p99 latency, throughput and SQL statements per request (read from
+the Server-Timing header), and can save the run as JSON and compare it
+against an earlier one.
+
+    python benchmarks/bench_endpoints.py --animals 100000 --orders 500000 --output before.json
+    python benchmarks/bench_endpoints.py --reuse --baseline before.json --output after.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.dataset import add_arguments, configure_database, describe, seed  # noqa: E402
+from benchmarks.bench_login import percentile  # noqa: E402
+
+SERVER_TIMING_DB = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries')
+
+# app is 'app' (auth, animals, orders, users) or 'app_new' (animal_routes,
+# order_routes); role picks the bearer token; path gets (rng, ctx); prepare,
+# if set, runs untimed before each request and returns the JSON body
+Scenario = namedtuple('Scenario', 'name app method path role prepare', defaults=(None, None))
+
+
+def _animal(rng, ctx):
+    return rng.randint(*ctx['animal_ids'])
+
+
+def _order(rng, ctx):
+    return rng.randint(*ctx['order_ids'])
+
+
+def _ids(rng, low_high, count=50):
+    return ','.join(str(rng.randint(*low_high)) for _ in range(count))
+
+
+def _fill_cart(client, rng, ctx, headers):
+    client.post('/api/users/cart', json={'animal_id': rng.choice(ctx['available'])}, headers=headers)
+    return {}
+
+
+SCENARIOS = [
+    Scenario('animals.list', 'app_new', 'GET', lambda rng, ctx: '/api/animals/'),
+    Scenario('animals.list_filtered', 'app_new', 'GET',
+             lambda rng, ctx: f'/api/animals/?type={rng.choice(("cow", "sheep", "goat", "pig"))}'
+                              f'&min_price=200&max_price=2000&sort=price_asc'),
+    Scenario('animals.search', 'app_new', 'GET',
+             lambda rng, ctx: f'/api/animals/?search={rng.choice(("holstein", "vaccinated", "boer", "farm"))}'),
+    Scenario('animals.list_facets', 'app_new', 'GET', lambda rng, ctx: '/api/animals/?type=cow&facets=true'),
+    Scenario('animals.facets', 'app_new', 'GET', lambda rng, ctx: '/api/animals/facets'),
+    Scenario('animals.detail', 'app_new', 'GET', lambda rng, ctx: f'/api/animals/{_animal(rng, ctx)}'),
+    Scenario('animals.batch', 'app_new', 'GET',
+             lambda rng, ctx: f'/api/animals/batch?ids={_ids(rng, ctx["animal_ids"])}'),
+    Scenario('animals.farmer_big', 'app_new', 'GET',
+             lambda rng, ctx: f'/api/animals/farmers/{ctx["biggest_farmer"]}/animals'),
+    Scenario('animals.farmer_random', 'app_new', 'GET',
+             lambda rng, ctx: f'/api/animals/farmers/{rng.randint(*ctx["farmer_ids"])}/animals'),
+    Scenario('orders.list', 'app_new', 'GET', lambda rng, ctx: '/api/orders/?status=pending'),
+    Scenario('orders.detail', 'app_new', 'GET', lambda rng, ctx: f'/api/orders/{_order(rng, ctx)}'),
+    Scenario('orders.items', 'app_new', 'GET', lambda rng, ctx: f'/api/orders/{_order(rng, ctx)}/items'),
+    Scenario('orders.by_animal', 'app_new', 'GET',
+             lambda rng, ctx: f'/api/orders/order_items?animal_id={_animal(rng, ctx)}'),
+    Scenario('orders.user_busy', 'app_new', 'GET',
+             lambda rng, ctx: f'/api/orders/users/{ctx["busiest_customer"]}/orders'),
+    Scenario('orders.farmer_big', 'app_new', 'GET', lambda rng, ctx: '/api/orders/farmer/orders', 'big_farmer'),
+    Scenario('auth.me', 'app', 'GET', lambda rng, ctx: '/api/auth/me', 'customer'),
+    Scenario('catalog.list', 'app', 'GET', lambda rng, ctx: '/api/animals/'),
+    Scenario('catalog.detail', 'app', 'GET', lambda rng, ctx: f'/api/animals/{_animal(rng, ctx)}'),
+    Scenario('catalog.my_animals', 'app', 'GET', lambda rng, ctx: '/api/animals/my-animals', 'big_farmer'),
+    Scenario('cart.get', 'app', 'GET', lambda rng, ctx: '/api/users/cart', 'customer'),
+    Scenario('shop.orders_customer', 'app', 'GET', lambda rng, ctx: '/api/orders/', 'busy_customer'),
+    Scenario('shop.orders_farmer', 'app', 'GET', lambda rng, ctx: '/api/orders/', 'big_farmer'),
+    Scenario('shop.order_detail', 'app', 'GET',
+             lambda rng, ctx: f'/api/orders/{rng.choice(ctx["farmer_orders"])}', 'big_farmer'),
+    Scenario('shop.orders_batch', 'app', 'GET',
+             lambda rng, ctx: f'/api/orders/batch?ids={_ids(rng, ctx["order_ids"])}', 'big_farmer'),
+    Scenario('shop.checkout', 'app', 'POST', lambda rng, ctx: '/api/orders/', 'customer', _fill_cart)
+]
+
+
+def tokens(db, ctx):
+    """Bearer headers per role; 'customer' rotates through the first customers"""
+    from flask_jwt_extended import create_access_token
+    from models import User
+    from utils.identity import identity_claims
+    
+    def headers(user_id):
+        user = db.session.get(User, user_id)
+        token = create_access_token(identity=str(user.id), additional_claims=identity_claims(user))
+        return {'Authorization': f'Bearer {token}'}
+    
+    first, last = ctx['customer_ids']
+    return {
+        'big_farmer': [headers(ctx['biggest_farmer'])],
+        'busy_customer': [headers(ctx['busiest_customer'])],
+        'customer': [headers(user_id) for user_id in range(first, min(last, first + 63) + 1)]
+    }
+
+
+def run_scenario(apps, scenario, ctx, auth, requests, threads, seed_value):
+    app = apps[scenario.app]
+    local = threading.local()
+    
+    def one(i):
+        rng = random.Random(f'{seed_value}:{scenario.name}:{i}')
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        client = local.client
+        headers = rng.choice(auth[scenario.role]) if scenario.role else {}
+        body = scenario.prepare(client, rng, ctx, headers) if scenario.prepare else None
+        path = scenario.path(rng, ctx)
+        started = time.perf_counter()
+        response = client.open(path, method=scenario.method, headers=headers, json=body)
+        response.get_data()
+        elapsed = time.perf_counter() - started
+        match = SERVER_TIMING_DB.search(response.headers.get('Server-Timing', ''))
+        queries, db_ms = (int(match.group(2)), float(match.group(1))) if match else (None, None)
+        return elapsed * 1000, response.status_code, queries, db_ms
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+    
+    latencies = [ms for ms, _, _, _ in results]
+    queries = [q for _, _, q, _ in results if q is not None]
+    db_times = [d for _, _, _, d in results if d is not None]
+    statuses = Counter(str(status) for _, status, _, _ in results)
+    return {
+        'requests': requests,
+        'errors': sum(count for status, count in statuses.items() if int(status) >= 500),
+        'statuses': dict(sorted(statuses.items())),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'max_ms': round(max(latencies), 3),
+        'throughput_rps': round(requests / wall, 2),
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'db_ms_per_request': round(sum(db_times) / len(db_times), 3) if db_times else None
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print per-endpoint deltas against baseline; return the regressed endpoint names"""
+    def delta(new, old):
+        return (new - old) / old * 100 if old else 0.0
+    
+    regressions = []
+    print(f'\n{"endpoint":28} {"p95 ms (old → new)":>19}{"Δ":>8} {"req/s (old → new)":>19}{"Δ":>8} queries')
+    for name, new in results['endpoints'].items():
+        old = baseline.get('endpoints', {}).get(name)
+        if old is None:
+            print(f'{name:28} {"(not in baseline)":>18}')
+            continue
+        p95_delta = delta(new['p95_ms'], old['p95_ms'])
+        rps_delta = delta(new['throughput_rps'], old['throughput_rps'])
+        regressed = p95_delta > threshold or rps_delta < -threshold
+        if regressed:
+            regressions.append(name)
+        print(f'{name:28} {old["p95_ms"]:>8.2f} → {new["p95_ms"]:<8.2f}{p95_delta:>+7.1f}% '
+              f'{old["throughput_rps"]:>8.1f} → {new["throughput_rps"]:<8.1f}{rps_delta:>+7.1f}% '
+              f'{str(old["queries_per_request"]):>5} → {str(new["queries_per_request"]):<5}'
+              f'{"  REGRESSED" if regressed else ""}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    add_arguments(parser)
+    parser.add_argument('--reuse', action='store_true', help='Run against an already seeded --db')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--only', help='Comma-separated substrings of endpoint names to run')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare against results JSON from an earlier run')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='Percent p95 / throughput change counted as a regression')
+    args = parser.parse_args()
+    
+    url = configure_database(args)
+    # Config reads the environment at import time
+    import app as catalog_app
+    import app_new
+    from models import db
+    
+    apps = {'app': catalog_app.create_app(), 'app_new': app_new.create_app()}
+    with apps['app'].app_context():
+        if args.reuse:
+            dataset = describe(db)
+        else:
+            db.drop_all()
+            db.create_all()
+            dataset = seed(db, args.animals, args.orders, args.farmers, args.customers, args.skew, args.seed)
+        from models import Animal, FarmerOrder
+        available = [row[0] for row in db.session.query(Animal.id).filter_by(is_available=True).limit(100000)]
+        farmer_orders = [row[0] for row in db.session.query(FarmerOrder.order_id).filter_by(
+            farmer_id=dataset['biggest_farmer']).limit(10000)]
+        ctx = dict(dataset, available=available, farmer_orders=farmer_orders)
+        auth = tokens(db, ctx)
+    
+    wanted = [part for part in (args.only or '').split(',') if part]
+    scenarios = [s for s in SCENARIOS if not wanted or any(part in s.name for part in wanted)]
+    results = {
+        'created_at': datetime.utcnow().isoformat() + 'Z',
+        'database': url.split('@')[-1],
+        'python': platform.python_version(),
+        'requests_per_endpoint': args.requests,
+        'threads': args.threads,
+        'dataset': dataset,
+        'endpoints': {}
+    }
+    
+    print(f'\n{"endpoint":28} {"p50":>8} {"p95":>8} {"p99":>8} {"req/s":>8} {"queries":>8}  statuses')
+    for scenario in scenarios:
+        # One untimed request warms caches and the connection pool
+        run_scenario(apps, scenario, ctx, auth, 1, 1, 'warmup')
+        stats = results['endpoints'][scenario.name] = run_scenario(
+            apps, scenario, ctx, auth, args.requests, args.threads, args.seed)
+        print(f'{scenario.name:28} {stats["p50_ms"]:>8.2f} {stats["p95_ms"]:>8.2f} {stats["p99_ms"]:>8.2f} '
+              f'{stats["throughput_rps"]:>8.1f} {str(stats["queries_per_request"]):>8}  {stats["statuses"]}',
+              flush=True)
+    
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2)
+        print(f'\nSaved results to {args.output}')
+    
+    if args.baseline:
+        with open(args.baseline) as handle:
+            regressions = compare(results, json.load(handle), args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} endpoint(s) regressed by more than {args.threshold:.0f}%')
+            sys.exit(1)
+    
+    with apps['app'].app_context():
+        from utils.passwords import password_hasher
+        password_hasher().shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Login latency under concurrent load.
+
+Registers a handful of users against a throwaway SQLite database, then
+fires logins from a thread pool and reports p50/p95/p99 latency and the
+share of requests shed with 503. Try different hashing settings with the
+usual environment variables, e.g.
+
+    PASSWORD_HASH_WORKERS=4 python benchmarks/bench_login.py --threads 16
+    PASSWORD_HASH_METHOD=scrypt:16384:8:1 python benchmarks/bench_login.py
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+    
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench_login.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    # Config reads the environment at import time
+    from app import create_app
+    from models import db
+    from utils.passwords import password_hasher
+    app = create_app()
+    
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        for i in range(args.users):
+            client.post('/api/auth/register', content_type='application/json', data=json.dumps({
+                'username': f'bench{i}', 'email': f'bench{i}@example.com',
+                'password': 'password123', 'user_type': 'customer'
+            }))
+    
+    def login(i):
+        body = json.dumps({'username': f'bench{i % args.users}', 'password': 'password123'})
+        started = time.perf_counter()
+        with app.test_client() as client:
+            response = client.post('/api/auth/login', data=body, content_type='application/json')
+        return (time.perf_counter() - started) * 1000, response.status_code
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = list(pool.map(login, range(args.requests)))
+    elapsed = time.perf_counter() - started
+    
+    latencies = [ms for ms, status in results if status == 200]
+    shed = sum(1 for _, status in results if status == 503)
+    print(f'method={app.config["PASSWORD_HASH_METHOD"]} workers={app.config["PASSWORD_HASH_WORKERS"]} '
+          f'threads={args.threads} requests={args.requests}')
+    print(f'throughput={args.requests / elapsed:.1f} req/s  shed(503)={shed}')
+    if latencies:
+        print(f'p50={statistics.median(latencies):.1f}ms  p95={percentile(latencies, 95):.1f}ms  '
+              f'p99={percentile(latencies, 99):.1f}ms')
+    
+    with app.app_context():
+        db.drop_all()
+        password_hasher().shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Response encoding throughput for large listing pages.
+
+Seeds a throwaway SQLite database, then requests full pages of
+/api/animals/ and /api/orders/ under each JSON provider and content
+encoding, reporting wall time and CPU time per request and the rate at
+which response bytes are produced.
+
+    python benchmarks/bench_responses.py --animals 2000 --orders 500 --requests 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def seed(db, animals, orders):
+    from models import Animal, Order, OrderItem, User
+    
+    farmer = User(username='benchfarmer', email='farmer@example.com', user_type='farmer', password_hash='-')
+    customer = User(username='benchcustomer', email='customer@example.com', user_type='customer', password_hash='-')
+    db.session.add_all([farmer, customer])
+    db.session.flush()
+    
+    herd = [Animal(name=f'Animal {i}', type=('cow', 'sheep', 'pig', 'goat')[i % 4], breed='Mixed',
+                   age=6 + i % 60, weight=50 + i % 500, price=100 + i % 5000,
+                   description='Healthy, vaccinated and ready for a new farm. ' * 3,
+                   farmer_id=farmer.id) for i in range(animals)]
+    db.session.add_all(herd)
+    db.session.flush()
+    
+    for i in range(orders):
+        items = [herd[(i * 3 + j) % animals] for j in range(3)]
+        order = Order(customer_id=customer.id, total_amount=sum(a.price for a in items), status='pending')
+        order.order_items = [OrderItem(animal_id=a.id, quantity=1, price=a.price) for a in items]
+        db.session.add(order)
+    db.session.commit()
+
+
+def run(client, url, requests, encoding):
+    headers = {'Accept-Encoding': encoding} if encoding else {}
+    client.get(url, headers=headers)  # warm up
+    total_bytes = 0
+    wall_started, cpu_started = time.perf_counter(), time.process_time()
+    for _ in range(requests):
+        total_bytes += len(client.get(url, headers=headers).data)
+    wall = time.perf_counter() - wall_started
+    cpu = time.process_time() - cpu_started
+    return wall, cpu, total_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--animals', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=100)
+    args = parser.parse_args()
+    
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(tempfile.mkdtemp(), "bench_responses.db")}'
+    # Config reads the environment at import time
+    from flask.json.provider import DefaultJSONProvider
+    from app_new import create_app
+    from models import db
+    from utils.compression import brotli
+    from utils.json_provider import OrjsonProvider, orjson
+    
+    app = create_app()
+    app.config['ENTITY_CACHE_BACKEND'] = 'none'
+    providers = [('stdlib', DefaultJSONProvider)] + ([('orjson', OrjsonProvider)] if orjson else [])
+    encodings = [None, 'gzip'] + (['br'] if brotli else [])
+    
+    with app.app_context():
+        db.create_all()
+        seed(db, args.animals, args.orders)
+        client = app.test_client()
+        
+        print(f'{"url":<30} {"json":<7} {"encoding":<9} {"ms/req":>8} {"cpu ms/req":>11} '
+              f'{"KiB/req":>8} {"MiB/s":>7}')
+        for url in ('/api/animals/?per_page=100', '/api/orders/?per_page=100'):
+            for name, provider in providers:
+                app.json = provider(app)
+                for encoding in encodings:
+                    wall, cpu, total_bytes = run(client, url, args.requests, encoding)
+                    print(f'{url:<30} {name:<7} {encoding or "identity":<9} '
+                          f'{wall / args.requests * 1000:>8.2f} {cpu / args.requests * 1000:>11.2f} '
+                          f'{total_bytes / args.requests / 1024:>8.1f} {total_bytes / wall / 2**20:>7.2f}')
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+WSGI vs ASGI serving mode under many concurrent readers.
+
+Starts the app twice on a seeded database (benchmarks/dataset.py): once
+on Werkzeug's threaded server, as run.py does, and once on uvicorn through
+asgi.py. Each read endpoint is then hit over real HTTP connections by an
+asyncio client at increasing concurrency, reporting p50/p95/p99 latency,
+throughput and failed requests per mode.
+
+    python benchmarks/bench_serving.py --animals 50000 --orders 100000 --concurrency 16,64,256
+    python benchmarks/bench_serving.py --reuse --db-latency 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_login import percentile  # noqa: E402
+from benchmarks.dataset import add_arguments, configure_database, describe, seed  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# --db-latency adds a sleep after every statement, standing in for a database
+# across the network; the WSGI server sleeps in a thread, the ASGI one awaits
+SERVERS = {
+    'wsgi': '''
+import sys, time
+from sqlalchemy import event
+from app import create_app
+from models import db
+from werkzeug.serving import run_simple
+app = create_app()
+latency = float(sys.argv[2]) / 1000
+if latency:
+    with app.app_context():
+        event.listen(db.engine, 'after_cursor_execute', lambda *args: time.sleep(latency))
+run_simple('127.0.0.1', int(sys.argv[1]), app, threaded=True)
+''',
+    'asgi': '''
+import asyncio, sys
+import uvicorn
+from sqlalchemy import event
+from sqlalchemy.util import await_only
+from app import create_app
+from asgi import create_asgi_app
+asgi_app = create_asgi_app(create_app())
+latency = float(sys.argv[2]) / 1000
+if latency:
+    event.listen(asgi_app.engine.sync_engine, 'after_cursor_execute',
+                 lambda *args: await_only(asyncio.sleep(latency)))
+uvicorn.run(asgi_app, host='127.0.0.1', port=int(sys.argv[1]), log_level='warning', backlog=4096)
+'''
+}
+
+
+async def fetch(port, path, headers):
+    """One GET over a fresh connection; returns (ms, status)"""
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        lines = [f'GET {path} HTTP/1.1', 'Host: localhost', 'Connection: close']
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin1'))
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+        writer.close()
+        status = int(status_line.split()[1])
+    except (OSError, IndexError, ValueError):
+        status = 0
+    return (time.perf_counter() - started) * 1000, status
+
+
+async def load(port, paths, headers, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def one(i):
+        async with semaphore:
+            return await fetch(port, paths[i % len(paths)], headers)
+    
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(requests)))
+    wall = time.perf_counter() - started
+    latencies = [ms for ms, status in results if status == 200]
+    return {
+        'p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 2) if latencies else None,
+        'throughput_rps': round(len(latencies) / wall, 1),
+        'failed': len(results) - len(latencies)
+    }
+
+
+def wait_for(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if asyncio.run(fetch(port, '/metrics', {}))[1] == 200:
+            return
+        time.sleep(0.2)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    add_arguments(parser)
+    parser.add_argument('--reuse', action='store_true', help='Run against an already seeded --db')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per endpoint and concurrency level')
+    parser.add_argument('--concurrency', default='16,64,256')
+    parser.add_argument('--db-latency', type=float, default=0, help='Extra milliseconds per SQL statement')
+    parser.add_argument('--port', type=int, default=5077)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+    
+    configure_database(args)
+    from app import create_app
+    from flask_jwt_extended import create_access_token
+    from models import db, User
+    from utils.identity import identity_claims
+    
+    app = create_app()
+    with app.app_context():
+        if args.reuse:
+            dataset = describe(db)
+        else:
+            db.drop_all()
+            db.create_all()
+            dataset = seed(db, args.animals, args.orders, args.farmers, args.customers, args.skew, args.seed)
+        farmer = db.session.get(User, dataset['biggest_farmer'])
+        token = create_access_token(identity=str(farmer.id), additional_claims=identity_claims(farmer))
+    
+    first, last = dataset['animal_ids']
+    step = max(1, (last - first) // 500)
+    endpoints = {
+        'animals.list': (['/api/animals/'], {}),
+        'animals.detail': ([f'/api/animals/{i}' for i in range(first, last + 1, step)], {}),
+        'orders.list': (['/api/orders/'], {'Authorization': f'Bearer {token}'}),
+        'auth.me': (['/api/auth/me'], {'Authorization': f'Bearer {token}'})
+    }
+    levels = [int(level) for level in args.concurrency.split(',')]
+    results = {'dataset': dataset, 'db_latency_ms': args.db_latency, 'modes': {}}
+    
+    print(f'{"mode":6} {"endpoint":16} {"conc":>6} {"p50":>9} {"p95":>9} {"p99":>9} {"req/s":>8} {"failed":>7}')
+    for mode, script in SERVERS.items():
+        server = subprocess.Popen([sys.executable, '-c', script, str(args.port), str(args.db_latency)],
+                                  cwd=ROOT, env=os.environ, stderr=subprocess.DEVNULL)
+        try:
+            wait_for(args.port)
+            for name, (paths, headers) in endpoints.items():
+                for level in levels:
+                    stats = asyncio.run(load(args.port, paths, headers, args.requests, level))
+                    results['modes'].setdefault(mode, {}).setdefault(name, {})[level] = stats
+                    print(f'{mode:6} {name:16} {level:>6} {str(stats["p50_ms"]):>9} {str(stats["p95_ms"]):>9} '
+                          f'{str(stats["p99_ms"]):>9} {stats["throughput_rps"]:>8} {stats["failed"]:>7}',
+                          flush=True)
+        finally:
+            server.terminate()
+            server.wait()
+    
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2)
+        print(f'\nSaved results to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
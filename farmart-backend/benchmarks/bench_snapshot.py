@@ -0,0 +1,75 @@
+"""
+Anonymous catalog browsing: in-memory snapshot vs the SQL path.
+
+Seeds (or reuses) a dataset from benchmarks/dataset.py and drives the
+/api/animals/ listing with typical storefront filters and sorts from a
+thread pool, first with CATALOG_SNAPSHOT off and then on, reporting
+p50/p95/p99 latency, requests/sec and queries per request for each.
+
+    python benchmarks/bench_snapshot.py --animals 200000 --orders 10000 --threads 8
+    python benchmarks/bench_snapshot.py --reuse --requests 2000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_endpoints import Scenario, run_scenario  # noqa: E402
+from benchmarks.dataset import TYPES, add_arguments, configure_database, describe, seed  # noqa: E402
+
+QUERIES = {
+    'newest': lambda rng, ctx: '/api/animals/',
+    'type': lambda rng, ctx: f'/api/animals/?type={rng.choice(list(TYPES))}',
+    'type_price_range': lambda rng, ctx: f'/api/animals/?type={rng.choice(list(TYPES))}'
+                                         f'&min_price={rng.choice((100, 300, 500))}&max_price=2000&sort=price_asc',
+    'age_range': lambda rng, ctx: f'/api/animals/?min_age={rng.randint(1, 60)}&max_age=90&sort=price_desc',
+    'breed_summary': lambda rng, ctx: f'/api/animals/?breed={rng.choice(("jersey", "boer", "duroc"))}'
+                                      f'&view=summary&per_page=50'
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    add_arguments(parser)
+    parser.add_argument('--reuse', action='store_true', help='Run against an already seeded --db')
+    parser.add_argument('--requests', type=int, default=1000, help='Requests per query and mode')
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+    
+    configure_database(args)
+    # Config reads the environment at import time
+    from app_new import create_app
+    from models import db
+    from utils.snapshot import np, snapshot_store
+    
+    if np is None:
+        sys.exit('The catalog snapshot needs numpy: pip install numpy')
+    app = create_app()
+    with app.app_context():
+        if args.reuse:
+            dataset = describe(db)
+        else:
+            db.drop_all()
+            db.create_all()
+            dataset = seed(db, args.animals, args.orders, args.farmers, args.customers, args.skew, args.seed)
+        app.config['CATALOG_SNAPSHOT'] = True
+        started = time.perf_counter()
+        snapshot = snapshot_store().get()
+        print(f'Snapshot of {snapshot.size} available animals built in {time.perf_counter() - started:.2f}s')
+    
+    apps = {'app_new': app}
+    print(f'\n{"query":18} {"mode":9} {"p50":>8} {"p95":>8} {"p99":>8} {"req/s":>9} {"queries":>8}')
+    for name, path in QUERIES.items():
+        scenario = Scenario(f'catalog.{name}', 'app_new', 'GET', path)
+        for mode in ('sql', 'snapshot'):
+            app.config['CATALOG_SNAPSHOT'] = mode == 'snapshot'
+            run_scenario(apps, scenario, dataset, {}, 20, 1, 'warmup')
+            stats = run_scenario(apps, scenario, dataset, {}, args.requests, args.threads, args.seed)
+            print(f'{name:18} {mode:9} {stats["p50_ms"]:>8.2f} {stats["p95_ms"]:>8.2f} {stats["p99_ms"]:>8.2f} '
+                  f'{stats["throughput_rps"]:>9.1f} {str(stats["queries_per_request"]):>8}', flush=True)
+
+
+if __name__ == '__main__':
+    main()
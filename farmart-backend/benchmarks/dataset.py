@@ -0,0 +1,254 @@
+"""
+Synthetic Farmart dataset of configurable size with realistic skew.
+
+Farmers' herd sizes and customers' order counts follow a Zipf-like
+distribution: a few farmers own a large share of all animals and a few
+customers place a large share of the orders, while the long tail holds a
+handful each. Rows are written with Core executemany in batches, then the
+derived tables (facet counts, farmer_orders, collection versions, and the
+FTS index via its triggers) are brought up to date in one pass each.
+
+    python benchmarks/dataset.py --db /tmp/farmart_bench.db --animals 1000000 --orders 5000000
+"""
+import argparse
+import bisect
+import itertools
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TYPES = {
+    'cow': ('Holstein', 'Jersey', 'Angus', 'Hereford', 'Guernsey'),
+    'sheep': ('Merino', 'Suffolk', 'Dorper', 'Texel'),
+    'goat': ('Boer', 'Saanen', 'Nubian', 'Alpine'),
+    'pig': ('Yorkshire', 'Duroc', 'Berkshire', 'Landrace'),
+    'chicken': ('Leghorn', 'Rhode Island Red', 'Kienyeji', 'Sussex')
+}
+# Orders by status; confirmed and completed orders take their animals off the market
+STATUSES = (('pending', 0.35), ('confirmed', 0.30), ('completed', 0.25), ('rejected', 0.10))
+BENCH_PASSWORD = 'bench-password'
+BATCH = 10000
+
+
+class Zipf:
+    """Draw 0..n-1 with P(i) proportional to 1 / (i + 1) ** skew"""
+    
+    def __init__(self, n, skew, rng):
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1 / (i + 1) ** skew for i in range(n)))
+    
+    def draw(self):
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])
+
+
+def _batched(rows, size=BATCH):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _insert(db, table, rows, label):
+    started, count = time.perf_counter(), 0
+    for batch in _batched(rows):
+        db.session.execute(table.insert(), batch)
+        db.session.commit()
+        count += len(batch)
+    elapsed = time.perf_counter() - started
+    print(f'  {label}: {count} rows in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} rows/s)', flush=True)
+    return count
+
+
+def seed(db, animals=10000, orders=20000, farmers=200, customers=2000, skew=1.1, seed_value=42):
+    """
+    Fill an empty schema (inside an app context) and return a summary with
+    the ids benchmarks need: the biggest farmer, the busiest customer and the
+    id ranges
+    """
+    from models import Animal, CartItem, Order, OrderItem, User, bump_collection_versions, sync_farmer_orders
+    from models.facet_model import rebuild_facet_counts
+    from utils.passwords import password_hasher
+    
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+    start = now - timedelta(days=365)
+    print(f'Seeding {farmers} farmers, {customers} customers, {animals} animals, {orders} orders', flush=True)
+    
+    # Benchmark users share one real hash so login can be exercised too
+    password_hash = password_hasher().hash(BENCH_PASSWORD)
+    users = [{'username': f'farmer{i}', 'email': f'farmer{i}@bench.test', 'user_type': 'farmer',
+              'password_hash': password_hash, 'created_at': start, 'updated_at': start}
+             for i in range(farmers)]
+    users += [{'username': f'customer{i}', 'email': f'customer{i}@bench.test', 'user_type': 'customer',
+               'password_hash': password_hash, 'created_at': start, 'updated_at': start}
+              for i in range(customers)]
+    _insert(db, User.__table__, users, 'users')
+    farmer_ids = [row[0] for row in db.session.query(User.id).filter_by(user_type='farmer').order_by(User.id)]
+    customer_ids = [row[0] for row in db.session.query(User.id).filter_by(user_type='customer').order_by(User.id)]
+    
+    herd_owner = Zipf(farmers, skew, rng)
+    types = list(TYPES)
+    
+    def animal_rows():
+        for i in range(animals):
+            animal_type = rng.choice(types)
+            created = start + timedelta(seconds=rng.randrange(365 * 86400))
+            yield {
+                'name': f'{animal_type.title()} {i}',
+                'type': animal_type,
+                'breed': rng.choice(TYPES[animal_type]),
+                'age': rng.randrange(1, 120),
+                'weight': round(rng.uniform(2, 900), 1),
+                'price': round(rng.lognormvariate(6.5, 1.0), 2),
+                'description': f'{rng.choice(("Healthy", "Vaccinated", "Pasture raised", "Prize winning"))} '
+                               f'{animal_type} from a {rng.choice(("small", "family", "large"))} farm',
+                'is_available': True,
+                'version': 1,
+                'farmer_id': farmer_ids[herd_owner.draw()],
+                'created_at': created,
+                'updated_at': created
+            }
+    
+    _insert(db, Animal.__table__, animal_rows(), 'animals')
+    first_animal, last_animal = db.session.query(db.func.min(Animal.id), db.func.max(Animal.id)).one()
+    
+    buyer = Zipf(customers, skew, rng)
+    statuses, weights = zip(*STATUSES)
+    sold = set()
+    first_order = (db.session.query(db.func.max(Order.id)).scalar() or 0) + 1
+    order_rows, item_rows = [], []
+    
+    def flush_orders():
+        db.session.execute(Order.__table__.insert(), order_rows)
+        db.session.execute(OrderItem.__table__.insert(), item_rows)
+        db.session.commit()
+        order_rows.clear()
+        item_rows.clear()
+    
+    started = time.perf_counter()
+    for offset in range(orders):
+        order_id = first_order + offset
+        created = start + timedelta(seconds=rng.randrange(365 * 86400))
+        status = rng.choices(statuses, weights)[0]
+        total = 0
+        for _ in range(rng.choice((1, 1, 1, 2, 2, 3))):
+            animal_id = rng.randint(first_animal, last_animal)
+            price = round(rng.lognormvariate(6.5, 1.0), 2)
+            total += price
+            item_rows.append({'order_id': order_id, 'animal_id': animal_id, 'quantity': 1, 'price': price})
+            if status in ('confirmed', 'completed'):
+                sold.add(animal_id)
+        order_rows.append({'id': order_id, 'customer_id': customer_ids[buyer.draw()], 'status': status,
+                           'total_amount': round(total, 2), 'created_at': created, 'updated_at': created})
+        if len(order_rows) >= BATCH:
+            flush_orders()
+    if order_rows:
+        flush_orders()
+    elapsed = time.perf_counter() - started
+    print(f'  orders + items: {orders} orders in {elapsed:.1f}s ({orders / max(elapsed, 1e-9):.0f} orders/s)',
+          flush=True)
+    
+    print('  marking sold animals, rebuilding facet counts and farmer_orders', flush=True)
+    sold = sorted(sold)
+    for batch in _batched(sold):
+        db.session.execute(Animal.__table__.update().where(Animal.id.in_(batch)).values(is_available=False))
+    connection = db.session.connection()
+    rebuild_facet_counts(connection)
+    sync_farmer_orders(connection)
+    bump_collection_versions(connection, 'animals', 'orders')
+    db.session.execute(CartItem.__table__.delete())
+    db.session.commit()
+    
+    biggest_farmer = db.session.query(Animal.farmer_id).group_by(Animal.farmer_id).order_by(
+        db.func.count().desc()).limit(1).scalar()
+    busiest_customer = db.session.query(Order.customer_id).group_by(Order.customer_id).order_by(
+        db.func.count().desc()).limit(1).scalar()
+    return {
+        'farmers': farmers,
+        'customers': customers,
+        'animals': animals,
+        'orders': orders,
+        'skew': skew,
+        'seed': seed_value,
+        'animal_ids': [first_animal, last_animal],
+        'order_ids': [first_order, first_order + orders - 1],
+        'farmer_ids': [farmer_ids[0], farmer_ids[-1]],
+        'customer_ids': [customer_ids[0], customer_ids[-1]],
+        'biggest_farmer': biggest_farmer,
+        'busiest_customer': busiest_customer
+    }
+
+
+def describe(db):
+    """Summary of an already seeded database, in the shape seed() returns"""
+    from models import Animal, Order, User
+    
+    def id_range(model, **filters):
+        query = db.session.query(db.func.min(model.id), db.func.max(model.id), db.func.count(model.id))
+        return query.filter_by(**filters).one()
+    
+    first_animal, last_animal, animals = id_range(Animal)
+    first_order, last_order, orders = id_range(Order)
+    first_farmer, last_farmer, farmers = id_range(User, user_type='farmer')
+    first_customer, last_customer, customers = id_range(User, user_type='customer')
+    return {
+        'farmers': farmers,
+        'customers': customers,
+        'animals': animals,
+        'orders': orders,
+        'animal_ids': [first_animal, last_animal],
+        'order_ids': [first_order, last_order],
+        'farmer_ids': [first_farmer, last_farmer],
+        'customer_ids': [first_customer, last_customer],
+        'biggest_farmer': db.session.query(Animal.farmer_id).group_by(Animal.farmer_id).order_by(
+            db.func.count().desc()).limit(1).scalar(),
+        'busiest_customer': db.session.query(Order.customer_id).group_by(Order.customer_id).order_by(
+            db.func.count().desc()).limit(1).scalar()
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench.db'),
+                        help='SQLite file to seed (ignored when DATABASE_URL is set)')
+    parser.add_argument('--animals', type=int, default=10000)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--farmers', type=int, default=200)
+    parser.add_argument('--customers', type=int, default=2000)
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent for herd and order skew')
+    parser.add_argument('--seed', type=int, default=42)
+
+
+def configure_database(args):
+    """Point Config at the benchmark database; call before importing the app"""
+    if not os.environ.get('DATABASE_URL'):
+        os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(args.db)}'
+    return os.environ['DATABASE_URL']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    add_arguments(parser)
+    args = parser.parse_args()
+    url = configure_database(args)
+    
+    from app import create_app
+    from models import db
+    
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        summary = seed(db, args.animals, args.orders, args.farmers, args.customers, args.skew, args.seed)
+    print(f'Seeded {url}: {summary}')
+
+
+if __name__ == '__main__':
+    main()
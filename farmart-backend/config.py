@@ -8,3 +8,97 @@ class Config:
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'jwt-secret-string'
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
+    MAX_PER_PAGE = 100
+    
+    # Entity cache for animal/order/user detail payloads: 'memory', 'file' or 'none'
+    ENTITY_CACHE_BACKEND = os.environ.get('ENTITY_CACHE_BACKEND') or 'memory'
+    ENTITY_CACHE_TTL = int(os.environ.get('ENTITY_CACHE_TTL') or 30)
+    ENTITY_CACHE_MAX_ENTRIES = int(os.environ.get('ENTITY_CACHE_MAX_ENTRIES') or 10000)
+    ENTITY_CACHE_PATH = os.environ.get('ENTITY_CACHE_PATH')
+    
+    # Catalog listing pages by normalized filter set, dropped when the animals version
+    # moves; fresh for QUERY_CACHE_TTL, then served stale while one request recomputes
+    QUERY_CACHE = (os.environ.get('QUERY_CACHE') or 'true').lower() in ('1', 'true', 'yes')
+    QUERY_CACHE_TTL = 30
+    QUERY_CACHE_STALE_SECONDS = 30
+    QUERY_CACHE_MAX_ENTRIES = 1000
+    QUERY_CACHE_WAIT_SECONDS = 5
+    
+    # Bulk animal import: rows per INSERT/COPY batch and error rows reported
+    IMPORT_BATCH_SIZE = 1000
+    IMPORT_MAX_ERRORS = 1000
+    
+    # Response encoding: JSON_PROVIDER is auto (orjson if installed), orjson or stdlib;
+    # bodies of at least COMPRESS_MIN_SIZE bytes are sent brotli/gzip compressed
+    JSON_PROVIDER = os.environ.get('JSON_PROVIDER') or 'auto'
+    COMPRESS_MIN_SIZE = 1024
+    COMPRESS_LEVEL = 6
+    
+    # Per-request SQL timing: Server-Timing header and Prometheus text at /metrics
+    METRICS_ENABLED = True
+    SERVER_TIMING = True
+    
+    # Anonymous /api/animals/ pages from an in-memory NumPy snapshot (needs numpy),
+    # refreshed after CATALOG_SNAPSHOT_MAX_AGE seconds and rebuilt every REBUILD seconds
+    CATALOG_SNAPSHOT = (os.environ.get('CATALOG_SNAPSHOT') or 'false').lower() in ('1', 'true', 'yes')
+    CATALOG_SNAPSHOT_MAX_AGE = 2
+    CATALOG_SNAPSHOT_REBUILD_SECONDS = 300
+    
+    # Delta sync (/api/animals/changes): rows younger than CHANGES_SETTLE_SECONDS wait for the
+    # next call; watermarks older than the deletion log's retention must resync from scratch.
+    # updated_at is stamped by each app server's clock at flush, so the window must exceed
+    # clock skew between servers + the longest write transaction + replica lag
+    CHANGES_PER_PAGE = 500
+    CHANGES_MAX_PER_PAGE = 1000
+    CHANGES_SETTLE_SECONDS = int(os.environ.get('CHANGES_SETTLE_SECONDS') or 60)
+    ANIMAL_DELETIONS_RETENTION_DAYS = 90
+    
+    # Farmer dashboard order events (SSE): 'memory' pub/sub or the import path of a broker
+    # factory; streams close after STREAM_SECONDS and clients resume with Last-Event-ID
+    ORDER_EVENTS_BROKER = os.environ.get('ORDER_EVENTS_BROKER') or 'memory'
+    ORDER_EVENTS_HISTORY = 1000
+    ORDER_EVENTS_HEARTBEAT = 15
+    ORDER_EVENTS_STREAM_SECONDS = 300
+    ORDER_EVENTS_RETRY_MS = 3000
+    # Streams served at once per process, well below ASYNC_WSGI_WORKERS: each holds a thread
+    ORDER_EVENTS_MAX_STREAMS = 4
+    
+    # Pending orders hold their animals off the market; `flask expire-pending-orders`
+    # rejects those older than this and releases them
+    ORDER_RESERVATION_HOURS = 72
+    
+    # Read replicas (comma-separated DATABASE_REPLICA_URLS): GET/HEAD requests read from
+    # them unless the client wrote within the last REPLICA_STICKY_SECONDS
+    SQLALCHEMY_REPLICA_URIS = [uri for uri in (os.environ.get('DATABASE_REPLICA_URLS') or '').split(',') if uri]
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS') or 5)
+    
+    # ASGI mode (asgi.py): endpoints served on the event loop with async SQLAlchemy,
+    # its connection pool, and the threads left for the WSGI path (writes, exports)
+    ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL')
+    ASYNC_ENDPOINTS = (
+        'auth.get_current_user', 'users.get_cart',
+        'animals.get_all_animals', 'animals.get_animal', 'animals.get_animal_by_id',
+        'animals.get_animals_batch', 'animals.get_animal_facets', 'animals.get_farmer_animals',
+        'orders.get_orders', 'orders.get_all_orders', 'orders.get_order', 'orders.get_order_by_id',
+        'orders.get_orders_batch', 'orders.get_user_orders', 'orders.get_order_items',
+        'orders.get_order_items_by_animal', 'orders.get_farmer_orders'
+    )
+    ASYNC_POOL_SIZE = int(os.environ.get('ASYNC_POOL_SIZE') or 20)
+    ASYNC_MAX_OVERFLOW = 10
+    ASYNC_WSGI_WORKERS = 10
+    
+    # Most ids accepted by the /batch endpoints in one request
+    BATCH_MAX_IDS = 200
+    
+    # Most orders accepted by the bulk status endpoint in one request
+    BULK_STATUS_MAX_ORDERS = 500
+    
+    # Password hashing: Werkzeug method string and the bounded hashing pool
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'pbkdf2:sha256:600000'
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 2)
+    PASSWORD_HASH_MAX_PENDING = 32
+    PASSWORD_HASH_TIMEOUT = 10
+    
+    # Role lookups for tokens issued without a user_type claim
+    IDENTITY_CACHE_TTL = 60
+    IDENTITY_CACHE_MAX_ENTRIES = 10000
@@ -1,12 +1,21 @@
 from flask_sqlalchemy import SQLAlchemy
+from .session import ReadOnlySessionError, RoutingSession
 
 # Initialize SQLAlchemy instance
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # Import all models
 from .user_model import User
 from .animal_model import Animal
 from .order_model import Order, OrderItem
+from .cart_model import CartItem
+from .version_model import CollectionVersion, bump_after_commit, bump_collection_versions
+from .facet_model import FacetCount, apply_facet_deltas, facet_deltas_after_commit
+from .farmer_order_model import FarmerOrder, sync_farmer_orders
+from .deletion_model import AnimalDeletion, log_animal_deletions
 
 # Export all models for easy import
-__all__ = ['db', 'User', 'Animal', 'Order', 'OrderItem']
+__all__ = ['db', 'User', 'Animal', 'Order', 'OrderItem', 'CartItem',
+           'CollectionVersion', 'bump_after_commit', 'bump_collection_versions', 'FacetCount',
+           'apply_facet_deltas', 'facet_deltas_after_commit', 'FarmerOrder', 'sync_farmer_orders',
+           'AnimalDeletion', 'log_animal_deletions', 'ReadOnlySessionError', 'RoutingSession']
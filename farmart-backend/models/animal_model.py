@@ -1,10 +1,14 @@
-from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from sqlalchemy import text
+from . import db
 
-db = SQLAlchemy()
+# Partial-index predicate; SQLite only uses the index when the query's
+# WHERE repeats this exact term, which is how Query renders is_available=True
+AVAILABLE = {'sqlite_where': text('is_available = 1'), 'postgresql_where': text('is_available')}
 
 class Animal(db.Model):
     __tablename__ = 'animals'
+    __collection__ = 'animals'
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -17,12 +21,29 @@ class Animal(db.Model):
     description = db.Column(db.Text)
     image_url = db.Column(db.String(255))
     is_available = db.Column(db.Boolean, default=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # Optimistic locking
     farmer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Every ORM UPDATE checks and bumps version, so a write based on a stale
+    # read fails with StaleDataError instead of silently overwriting
+    __mapper_args__ = {'version_id_col': version}
+    
+    __table_args__ = (
+        # Catalog listing: newest first and price sorts / ranges
+        db.Index('ix_animals_available_created', 'created_at', 'id', **AVAILABLE),
+        db.Index('ix_animals_available_price', 'price', 'id', **AVAILABLE),
+        db.Index('ix_animals_available_type_price', 'type', 'price', **AVAILABLE),
+        # Farmer dashboards and the farmer-orders join
+        db.Index('ix_animals_farmer_created', 'farmer_id', 'created_at', 'id'),
+        # Delta sync: everything created or updated after a watermark
+        db.Index('ix_animals_updated', 'updated_at', 'id'),
+    )
+    
     # Relationships
     order_items = db.relationship('OrderItem', backref='animal', lazy=True)
+    cart_items = db.relationship('CartItem', backref='animal', lazy=True)
     
     def to_dict(self):
         """Convert animal to dictionary for JSON response"""
@@ -0,0 +1,26 @@
+from datetime import datetime
+from . import db
+
+class CartItem(db.Model):
+    __tablename__ = 'cart_items'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    animal_id = db.Column(db.Integer, db.ForeignKey('animals.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=1)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_cart_items_user_animal', 'user_id', 'animal_id'),
+    )
+    
+    def to_dict(self):
+        """Convert cart item to dictionary"""
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'animal_id': self.animal_id,
+            'animal': self.animal.to_dict() if self.animal else None,
+            'quantity': self.quantity,
+            'created_at': self.created_at.isoformat()
+        }
@@ -0,0 +1,41 @@
+from datetime import datetime
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+from . import db
+from .animal_model import Animal
+
+class AnimalDeletion(db.Model):
+    """
+    Tombstone log of deleted animals for delta sync clients, which cannot
+    learn about a delete from the animals table itself
+    """
+    __tablename__ = 'animal_deletions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    animal_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # Delta sync reads the log in (deleted_at, id) order after a watermark
+        db.Index('ix_animal_deletions_deleted', 'deleted_at', 'id'),
+    )
+
+
+def log_animal_deletions(connection, animal_ids):
+    """
+    Record deleted animal ids inside the caller's transaction. Bulk
+    statements that delete animals without the ORM must call this.
+    """
+    animal_ids = sorted(set(animal_ids))
+    if not animal_ids:
+        return
+    now = datetime.utcnow()
+    connection.execute(insert(AnimalDeletion.__table__), [
+        {'animal_id': animal_id, 'deleted_at': now} for animal_id in animal_ids
+    ])
+
+
+@event.listens_for(Session, 'after_flush')
+def _log_on_flush(session, flush_context):
+    log_animal_deletions(session.connection(),
+                         [obj.id for obj in session.deleted if isinstance(obj, Animal)])
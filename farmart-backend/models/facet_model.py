@@ -0,0 +1,188 @@
+from collections import Counter
+from sqlalchemy import case, event, func, insert, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from . import db
+from .animal_model import Animal
+
+# Bucket edges for the range facets: (label, lower bound inclusive, upper bound exclusive)
+AGE_BUCKETS = (
+    ('0-6', 0, 6),
+    ('6-12', 6, 12),
+    ('12-24', 12, 24),
+    ('24-60', 24, 60),
+    ('60+', 60, None)
+)
+PRICE_BUCKETS = (
+    ('0-100', 0, 100),
+    ('100-500', 100, 500),
+    ('500-1000', 500, 1000),
+    ('1000-5000', 1000, 5000),
+    ('5000+', 5000, None)
+)
+FACETS = ('type', 'breed', 'age', 'price')
+
+class FacetCount(db.Model):
+    """Number of available animals per facet value, kept current on every write"""
+    __tablename__ = 'facet_counts'
+    
+    facet = db.Column(db.String(20), primary_key=True)
+    value = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+def _bucket(buckets, value):
+    if value is None:
+        return None
+    for label, low, high in buckets:
+        if value >= low and (high is None or value < high):
+            return label
+    return None
+
+
+def bucket_expression(buckets, column):
+    """SQL CASE that maps column onto the same labels as _bucket"""
+    whens = []
+    for label, low, high in buckets:
+        condition = column >= low if high is None else (column >= low) & (column < high)
+        whens.append((condition, label))
+    return case(*whens, else_=None)
+
+
+def animal_facets(values):
+    """(facet, value) pairs an available animal contributes, from a mapping of its columns"""
+    pairs = [
+        ('type', values.get('type')),
+        ('breed', values.get('breed')),
+        ('age', _bucket(AGE_BUCKETS, values.get('age'))),
+        ('price', _bucket(PRICE_BUCKETS, values.get('price')))
+    ]
+    return [(facet, value) for facet, value in pairs if value is not None]
+
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE
+UPSERT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def apply_facet_deltas(connection, deltas):
+    """
+    Add each delta in a {(facet, value): n} mapping to the counters inside
+    the caller's transaction. Only for short standalone transactions; writers
+    use facet_deltas_after_commit.
+    """
+    table = FacetCount.__table__
+    upsert = UPSERT_INSERTS.get(connection.dialect.name)
+    for (facet, value), delta in sorted(deltas.items()):
+        if not delta:
+            continue
+        if upsert is not None:
+            # One statement, so two writers adding the first animal of a new
+            # breed cannot both try to insert its counter
+            stmt = upsert(table).values(facet=facet, value=value, count=delta)
+            connection.execute(stmt.on_conflict_do_update(
+                index_elements=[table.c.facet, table.c.value],
+                set_={'count': table.c.count + stmt.excluded.count}
+            ))
+            continue
+        result = connection.execute(
+            update(table).where(table.c.facet == facet, table.c.value == value)
+            .values(count=table.c.count + delta)
+        )
+        if result.rowcount == 0:
+            connection.execute(insert(table).values(facet=facet, value=value, count=delta))
+
+
+def facet_deltas_after_commit(session, deltas):
+    """
+    Apply deltas once session commits, in a short transaction of its own.
+    Every cow checkout touches the type=cow counter; updating it inside the
+    writer's transaction would hold that row lock until commit and serialize
+    them all. Bulk statements that bypass the ORM must call this alongside
+    bump_after_commit.
+    """
+    session.info.setdefault('facet_deltas', Counter()).update(deltas)
+
+
+def rebuild_facet_counts(connection):
+    """Recompute every counter from the animals table"""
+    table = FacetCount.__table__
+    animals = Animal.__table__
+    connection.execute(table.delete())
+    columns = {
+        'type': animals.c.type,
+        'breed': animals.c.breed,
+        'age': bucket_expression(AGE_BUCKETS, animals.c.age),
+        'price': bucket_expression(PRICE_BUCKETS, animals.c.price)
+    }
+    for facet, column in columns.items():
+        rows = connection.execute(
+            select(column, func.count()).where(animals.c.is_available.is_(True))
+            .group_by(column)
+        ).all()
+        rows = [{'facet': facet, 'value': value, 'count': count} for value, count in rows if value is not None]
+        if rows:
+            connection.execute(insert(table), rows)
+
+
+@event.listens_for(FacetCount.__table__, 'after_create')
+def _seed_counts(target, connection, **kw):
+    # Existing databases already hold animals when the counters table is added
+    if inspect(connection).has_table(Animal.__tablename__):
+        rebuild_facet_counts(connection)
+
+
+def _state_facets(animal, committed):
+    """Facets of animal before (committed=True) or after the pending flush"""
+    state = inspect(animal)
+    values = {}
+    for key in ('type', 'breed', 'age', 'price', 'is_available'):
+        history = state.attrs[key].history
+        if committed and history.deleted:
+            values[key] = history.deleted[0]
+        else:
+            values[key] = getattr(animal, key)
+    if values['is_available'] is False:
+        return []
+    return animal_facets(values)
+
+
+def _load_previous_value(target, value, oldvalue, initiator):
+    return value
+
+
+# Load the old value before a facet column is overwritten, so the flush
+# knows which counters to decrement even if the attribute had expired
+for _key in ('type', 'breed', 'age', 'price', 'is_available'):
+    event.listen(getattr(Animal, _key), 'set', _load_previous_value, active_history=True, retval=True)
+
+
+@event.listens_for(Session, 'after_flush')
+def _count_on_flush(session, flush_context):
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, Animal):
+            deltas.update(_state_facets(obj, committed=False))
+    for obj in session.deleted:
+        if isinstance(obj, Animal):
+            deltas.subtract(_state_facets(obj, committed=True))
+    for obj in session.dirty:
+        if isinstance(obj, Animal) and session.is_modified(obj, include_collections=False):
+            deltas.subtract(_state_facets(obj, committed=True))
+            deltas.update(_state_facets(obj, committed=False))
+    if deltas:
+        facet_deltas_after_commit(session, deltas)
+
+
+# insert=True: runs before the collection version bump, so a reader that sees
+# the new version never caches the old counts under it
+@event.listens_for(Session, 'after_commit', insert=True)
+def _count_committed(session):
+    deltas = session.info.pop('facet_deltas', None)
+    if deltas and any(deltas.values()):
+        with session.get_bind(mapper=FacetCount.__mapper__).begin() as connection:
+            apply_facet_deltas(connection, deltas)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_deltas(session):
+    session.info.pop('facet_deltas', None)
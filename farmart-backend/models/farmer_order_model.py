@@ -0,0 +1,77 @@
+from sqlalchemy import delete, event, insert, select
+from sqlalchemy.orm import Session
+from . import db
+from .animal_model import Animal
+from .order_model import Order, OrderItem
+
+class FarmerOrder(db.Model):
+    """
+    One row per (farmer, order) for every order holding at least one of the
+    farmer's animals. Denormalizes the Order -> OrderItem -> Animal join so
+    the farmer dashboard and farmer access checks are single index lookups.
+    """
+    __tablename__ = 'farmer_orders'
+    
+    farmer_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='CASCADE'), primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_farmer_orders_farmer_created', 'farmer_id', 'created_at', 'order_id'),
+    )
+    
+    @staticmethod
+    def exists(farmer_id, order_id):
+        """True if the order holds one of the farmer's animals"""
+        return db.session.query(FarmerOrder.order_id).filter_by(
+            farmer_id=farmer_id, order_id=order_id
+        ).first() is not None
+
+
+def sync_farmer_orders(connection, order_ids=None):
+    """
+    Rewrite the farmer_orders rows of the given orders (all orders when
+    order_ids is None) from the orders, order_items and animals tables,
+    inside the caller's transaction. Bulk statements that bypass the ORM
+    must call this for the orders they touch.
+    """
+    table = FarmerOrder.__table__
+    source = select(
+        Animal.farmer_id, Order.id, Order.created_at, Order.status
+    ).select_from(Order).join(
+        OrderItem, OrderItem.order_id == Order.id
+    ).join(
+        Animal, Animal.id == OrderItem.animal_id
+    ).distinct()
+    
+    clear = delete(table)
+    if order_ids is not None:
+        order_ids = sorted(set(order_ids))
+        if not order_ids:
+            return
+        clear = clear.where(table.c.order_id.in_(order_ids))
+        source = source.where(Order.id.in_(order_ids))
+    
+    connection.execute(clear)
+    connection.execute(insert(table).from_select(
+        ['farmer_id', 'order_id', 'created_at', 'status'], source
+    ))
+
+
+def _order_id_of(obj):
+    if isinstance(obj, Order):
+        return obj.id
+    if isinstance(obj, OrderItem):
+        return obj.order_id
+    return None
+
+
+@event.listens_for(Session, 'after_flush')
+def _sync_on_flush(session, flush_context):
+    changed = [obj for obj in session.new] + [obj for obj in session.deleted]
+    changed += [obj for obj in session.dirty if session.is_modified(obj, include_collections=False)]
+    order_ids = {_order_id_of(obj) for obj in changed}
+    order_ids.discard(None)
+    if order_ids:
+        sync_farmer_orders(session.connection(), order_ids)
@@ -1,10 +1,9 @@
-from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-
-db = SQLAlchemy()
+from . import db
 
 class Order(db.Model):
     __tablename__ = 'orders'
+    __collection__ = 'orders'
     
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -17,6 +16,13 @@ class Order(db.Model):
     # Relationships
     order_items = db.relationship('OrderItem', backref='order', lazy=True, cascade='all, delete-orphan')
     
+    __table_args__ = (
+        # Keyset listings ordered by (created_at, id), scanned backwards for newest first
+        db.Index('ix_orders_created', 'created_at', 'id'),
+        db.Index('ix_orders_customer_created', 'customer_id', 'created_at', 'id'),
+        db.Index('ix_orders_status_created', 'status', 'created_at', 'id'),
+    )
+    
     def to_dict(self):
         """Convert order to dictionary for JSON response"""
         return {
@@ -54,6 +60,7 @@ class Order(db.Model):
 
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
+    __collection__ = 'orders'
     
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
@@ -61,6 +68,11 @@ class OrderItem(db.Model):
     quantity = db.Column(db.Integer, nullable=False, default=1)
     price = db.Column(db.Float, nullable=False)  # Price at time of order
     
+    __table_args__ = (
+        db.Index('ix_order_items_order_id', 'order_id'),
+        db.Index('ix_order_items_animal_order', 'animal_id', 'order_id'),
+    )
+    
     def to_dict(self):
         """Convert order item to dictionary"""
         return {
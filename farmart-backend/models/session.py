@@ -0,0 +1,34 @@
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+
+class ReadOnlySessionError(RuntimeError):
+    """A read-only (GET) session was asked to flush changes"""
+
+
+class RoutingSession(Session):
+    """
+    db.session's class. While session.info['replica'] holds an engine (set
+    for GET requests by utils.replicas), every statement without an explicit
+    bind runs on that replica instead of the primary.
+    """
+    
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            replica = self.info.get('replica')
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _refuse_read_only_flush(session, flush_context, instances):
+    if session.info.get('read_only') and (session.new or session.dirty or session.deleted):
+        raise ReadOnlySessionError('Read-only session: writes belong in POST, PUT, PATCH or DELETE handlers')
+
+
+@event.listens_for(RoutingSession, 'after_begin')
+def _read_only_transaction(session, transaction, connection):
+    # Replicas are read-only per connection; this covers GETs on the primary
+    if session.info.get('read_only') and connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql('SET TRANSACTION READ ONLY')
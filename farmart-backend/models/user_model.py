@@ -1,8 +1,6 @@
-from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
-
-db = SQLAlchemy()
+from . import db
+from utils.passwords import password_hasher
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -17,12 +15,17 @@ class User(db.Model):
     # Relationships
     animals = db.relationship('Animal', backref='farmer', lazy=True)
     orders = db.relationship('Order', backref='customer', lazy=True)
+    cart_items = db.relationship('CartItem', backref='user', lazy=True)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher().hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher().verify(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        """True if the stored hash uses outdated algorithm or cost parameters"""
+        return password_hasher().needs_rehash(self.password_hash)
     
     def to_dict(self):
         return {
@@ -0,0 +1,79 @@
+from datetime import datetime
+from sqlalchemy import event, insert, update
+from sqlalchemy.orm import Session
+from . import db
+
+# Collections whose version is bumped whenever a row in them changes
+COLLECTIONS = ('animals', 'orders')
+
+class CollectionVersion(db.Model):
+    __tablename__ = 'collection_versions'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+@event.listens_for(CollectionVersion.__table__, 'after_create')
+def _seed_versions(target, connection, **kw):
+    now = datetime.utcnow()
+    connection.execute(insert(target), [
+        {'name': name, 'version': 0, 'updated_at': now} for name in COLLECTIONS
+    ])
+
+
+def bump_collection_versions(connection, *names):
+    """
+    Advance the version of each named collection inside the caller's
+    transaction. Only for short standalone transactions (scripts, seeding);
+    request handlers use bump_after_commit.
+    """
+    table = CollectionVersion.__table__
+    for name in sorted(set(names)):
+        connection.execute(
+            update(table).where(table.c.name == name)
+            .values(version=table.c.version + 1, updated_at=datetime.utcnow())
+        )
+
+
+def bump_after_commit(session, *names):
+    """
+    Advance the version of each named collection once session commits, in a
+    short transaction of its own. Bumping inside the writer's transaction
+    would hold the collection's single row lock until commit, serializing
+    every catalog write and checkout behind it. Bulk statements that bypass
+    the ORM must call this.
+    
+    Readers between the commit and the bump see the new rows under the old
+    version. That is harmless: whatever they cache under it is dropped by the
+    bump a moment later.
+    """
+    session.info.setdefault('collection_bumps', set()).update(names)
+
+
+def _collection_of(instance):
+    return getattr(type(instance), '__collection__', None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_on_flush(session, flush_context):
+    names = {_collection_of(obj) for obj in session.new}
+    names |= {_collection_of(obj) for obj in session.deleted}
+    names |= {_collection_of(obj) for obj in session.dirty
+              if session.is_modified(obj, include_collections=False)}
+    names.discard(None)
+    if names:
+        bump_after_commit(session, *names)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_committed(session):
+    names = session.info.pop('collection_bumps', None)
+    if names:
+        with session.get_bind(mapper=CollectionVersion.__mapper__).begin() as connection:
+            bump_collection_versions(connection, *names)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_bumps(session):
+    session.info.pop('collection_bumps', None)
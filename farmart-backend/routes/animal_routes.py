@@ -1,13 +1,73 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
 from models import db, Animal, User
-from sqlalchemy import or_, and_
+from utils.batch import BatchError, keyed, parse_ids
+from utils.cache import cached_entities, cached_entity, invalidate_animals
+from utils.changes import ResyncRequired, catalog_changes, changes_limit
+from utils.conditional import collection_validators, entity_validators, not_modified, set_validators
+from utils.facets import catalog_facets
+from utils.fieldsets import FieldsetError, field_view
+from utils.identity import current_identity, current_user_type
+from utils.pagination import PaginationError, animal_ordering, keyset_paginate, page_params
+from utils.query_cache import cached_catalog_page, catalog_generation, catalog_key
+from utils.search import apply_search
+from utils.snapshot import catalog_snapshot
 
 # Blueprint for animal routes
 animal_bp = Blueprint('animals', __name__)
 
 # ===== YOUR PERSON 2 RESPONSIBILITIES =====
 
+def _catalog_filters():
+    """The catalog filters in the query string, by snapshot filter name"""
+    return {
+        'animal_type': request.args.get('type'),  # e.g., type=sheep
+        'breed': request.args.get('breed'),
+        'min_age': request.args.get('min_age', type=int),
+        'max_age': request.args.get('max_age', type=int),
+        'min_price': request.args.get('min_price', type=float),  # e.g., min_price=100
+        'max_price': request.args.get('max_price', type=float)
+    }
+
+
+def _catalog_query():
+    """
+    Available animals matching the catalog filters in the query string.
+    Returns (query, rank, filtered) where rank is the search relevance
+    expression (or None) and filtered says whether any filter applied.
+    """
+    # Get query parameters for filtering and searching
+    filters = _catalog_filters()
+    animal_type, breed = filters['animal_type'], filters['breed']
+    min_age, max_age = filters['min_age'], filters['max_age']
+    min_price, max_price = filters['min_price'], filters['max_price']
+    search = request.args.get('search')
+    
+    # Build query
+    query = Animal.query.filter_by(is_available=True)
+    
+    # Apply filters - FETCH /animals?type=sheep&min_price=100
+    if animal_type:
+        query = query.filter(Animal.type.ilike(f'%{animal_type}%'))
+    if breed:
+        query = query.filter(Animal.breed.ilike(f'%{breed}%'))
+    if min_age:
+        query = query.filter(Animal.age >= min_age)
+    if max_age:
+        query = query.filter(Animal.age <= max_age)
+    if min_price:
+        query = query.filter(Animal.price >= min_price)
+    if max_price:
+        query = query.filter(Animal.price <= max_price)
+    rank = None
+    if search:
+        # Full-text index lookup, ranked by relevance
+        query, rank = apply_search(query, search)
+    
+    filtered = any(value for value in (animal_type, breed, min_age, max_age, min_price, max_price, search))
+    return query, rank, filtered
+
+
 @animal_bp.route('/', methods=['GET'])
 def get_all_animals():
     """
@@ -15,61 +75,146 @@ def get_all_animals():
     Your Person 2 responsibility
     """
     try:
-        # Get query parameters for filtering and searching
-        animal_type = request.args.get('type')  # e.g., type=sheep
-        breed = request.args.get('breed')
-        min_age = request.args.get('min_age', type=int)
-        max_age = request.args.get('max_age', type=int)
-        min_price = request.args.get('min_price', type=float)  # e.g., min_price=100
-        max_price = request.args.get('max_price', type=float)
+        # Anonymous browsing can be answered from the in-memory catalog snapshot
+        snapshot = catalog_snapshot()
+        
+        # Conditional GET against the collection version, which is also the
+        # query cache's generation
+        generation = None if snapshot else catalog_generation()
+        validators = snapshot.validators() if snapshot else collection_validators('animals', versions=[generation])
+        not_modified_response = not_modified(*validators)
+        if not_modified_response:
+            return not_modified_response
+        
         search = request.args.get('search')
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
-        
-        # Build query
-        query = Animal.query.filter_by(is_available=True)
-        
-        # Apply filters - FETCH /animals?type=sheep&min_price=100
-        if animal_type:
-            query = query.filter(Animal.type.ilike(f'%{animal_type}%'))
-        if breed:
-            query = query.filter(Animal.breed.ilike(f'%{breed}%'))
-        if min_age:
-            query = query.filter(Animal.age >= min_age)
-        if max_age:
-            query = query.filter(Animal.age <= max_age)
-        if min_price:
-            query = query.filter(Animal.price >= min_price)
-        if max_price:
-            query = query.filter(Animal.price <= max_price)
-        if search:
-            query = query.filter(or_(
-                Animal.name.ilike(f'%{search}%'),
-                Animal.type.ilike(f'%{search}%'),
-                Animal.breed.ilike(f'%{search}%'),
-                Animal.description.ilike(f'%{search}%')
-            ))
-        
-        # Paginate results
-        animals = query.paginate(
-            page=page, 
-            per_page=per_page, 
-            error_out=False
-        )
+        sort = request.args.get('sort') or ('relevance' if search else 'newest')
+        cursor, per_page, include_total = page_params()
+        view = field_view('animal')
+        
+        if snapshot:
+            animals = snapshot.page(view, sort, cursor, per_page, include_total, **_catalog_filters())
+            response = jsonify({
+                'success': True,
+                'animals': animals.items,
+                'pagination': animals.to_dict()
+            })
+            return set_validators(response, *validators), 200
+        
+        facets = request.args.get('facets', '').lower() in ('1', 'true', 'yes')
         
+        def load():
+            catalog, rank, filtered = _catalog_query()
+            query = view.apply(catalog)
+            
+            # Keyset pagination - ?cursor=<next_cursor from the previous page>
+            keys, descending = animal_ordering(sort, rank)
+            animals = keyset_paginate(query, keys, sort, cursor, per_page,
+                                      descending=descending, include_total=include_total)
+            
+            payload = {
+                'success': True,
+                'animals': [view.dump(animal) for animal in animals.items],
+                'pagination': animals.to_dict()
+            }
+            # ?facets=true - counts for the same filters next to the results
+            if facets:
+                payload['facets'] = catalog_facets(catalog if filtered else None)
+            return payload
+        
+        # Popular filter combinations are served from the query cache
+        key = catalog_key(_catalog_filters(), view, sort, cursor, per_page, include_total, search, facets=facets)
+        response = jsonify(cached_catalog_page(generation, key, load))
+        return set_validators(response, *validators), 200
+        
+    except (PaginationError, FieldsetError) as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
         return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@animal_bp.route('/facets', methods=['GET'])
+def get_animal_facets():
+    """
+    GET /animals/facets - Counts per type, breed, age bucket and price bucket
+    Accepts the same filters as GET /animals
+    """
+    try:
+        validators = collection_validators('animals')
+        not_modified_response = not_modified(*validators)
+        if not_modified_response:
+            return not_modified_response
+        
+        query, _, filtered = _catalog_query()
+        response = jsonify({
             'success': True,
-            'animals': [animal.to_dict() for animal in animals.items],
-            'pagination': {
-                'total': animals.total,
-                'pages': animals.pages,
-                'current_page': page,
-                'per_page': per_page,
-                'has_next': animals.has_next,
-                'has_prev': animals.has_prev
-            }
+            'facets': catalog_facets(query if filtered else None)
+        })
+        return set_validators(response, *validators), 200
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@animal_bp.route('/changes', methods=['GET'])
+def get_animal_changes():
+    """
+    GET /animals/changes?since=<token> - Delta sync for offline catalog copies
+    Animals created or updated after the watermark plus tombstones for deleted and
+    unavailable ones; call again with next_since while has_more is true
+    """
+    try:
+        view = field_view('animal')
+        changes = catalog_changes(view, request.args.get('since'), changes_limit())
+        return jsonify({'success': True, **changes}), 200
+        
+    except ResyncRequired as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 410
+    except (PaginationError, FieldsetError) as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@animal_bp.route('/batch', methods=['GET'])
+def get_animals_batch():
+    """
+    GET /animals/batch?ids=1,2,3 - Get many animals in one request
+    Results are keyed by id; unknown ids map to null and are listed in not_found
+    """
+    try:
+        ids = parse_ids(request.args.get('ids'))
+        view = field_view('animal')
+        
+        animals, not_found = keyed(cached_entities('animal', ids), view)
+        return jsonify({
+            'success': True,
+            'animals': animals,
+            'not_found': not_found
         }), 200
         
+    except (BatchError, FieldsetError) as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -84,18 +229,37 @@ def get_animal_by_id(animal_id):
     Your Person 2 responsibility
     """
     try:
-        animal = Animal.query.get(animal_id)
+        view = field_view('animal')
+        validators = entity_validators('animal', animal_id)
+        if not validators:
+            return jsonify({
+                'success': False,
+                'error': 'Animal not found'
+            }), 404
+        
+        # 304 without loading or serializing the animal
+        not_modified_response = not_modified(*validators)
+        if not_modified_response:
+            return not_modified_response
+        
+        animal = cached_entity('animal', animal_id)
         if not animal:
             return jsonify({
                 'success': False,
                 'error': 'Animal not found'
             }), 404
         
-        return jsonify({
+        response = jsonify({
             'success': True,
-            'animal': animal.to_dict()
-        }), 200
+            'animal': view.project(animal)
+        })
+        return set_validators(response, *validators), 200
         
+    except FieldsetError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -118,33 +282,38 @@ def get_farmer_animals(farmer_id):
                 'error': 'Farmer not found'
             }), 404
         
-        # Get pagination parameters
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        # Conditional GET against the collection version
+        validators = collection_validators('animals')
+        not_modified_response = not_modified(*validators)
+        if not_modified_response:
+            return not_modified_response
         
-        # Get farmer's animals
-        animals = Animal.query.filter_by(farmer_id=farmer_id).paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        cursor, per_page, include_total = page_params()
         
-        return jsonify({
+        # Get farmer's animals, newest first
+        keys, descending = animal_ordering('newest')
+        view = field_view('animal')
+        animals = keyset_paginate(view.apply(Animal.query).filter_by(farmer_id=farmer_id), keys, 'newest',
+                                  cursor, per_page, descending=descending,
+                                  include_total=include_total)
+        
+        response = jsonify({
             'success': True,
             'farmer': {
                 'id': farmer.id,
                 'username': farmer.username,
                 'email': farmer.email
             },
-            'animals': [animal.to_dict() for animal in animals.items],
-            'pagination': {
-                'total': animals.total,
-                'pages': animals.pages,
-                'current_page': page,
-                'per_page': per_page
-            }
-        }), 200
+            'animals': [view.dump(animal) for animal in animals.items],
+            'pagination': animals.to_dict()
+        })
+        return set_validators(response, *validators), 200
         
+    except (PaginationError, FieldsetError) as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -161,10 +330,10 @@ def delete_animal(animal_id):
     DELETE /animals/{id} - Delete animal (Farmer Dashboard responsibility)
     """
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        current_user_id = current_identity()
+        user_type = current_user_type()
         
-        if not user or user.user_type != 'farmer':
+        if user_type != 'farmer':
             return jsonify({
                 'success': False,
                 'error': 'Only farmers can delete animals'
@@ -185,6 +354,7 @@ def delete_animal(animal_id):
         
         db.session.delete(animal)
         db.session.commit()
+        invalidate_animals(animal_id)
         
         return jsonify({
             'success': True,
@@ -1,71 +1,179 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, Animal, User
-from sqlalchemy import or_, and_
+from flask import Blueprint, current_app, request, jsonify
+from flask_jwt_extended import jwt_required
+from models import db, Animal
+from utils.batch import BatchError, keyed, parse_ids
+from utils.bulk_import import detect_format, import_animals
+from utils.cache import cache_entity, cached_entities, cached_entity, invalidate_animals
+from utils.changes import ResyncRequired, catalog_changes, changes_limit
+from utils.conditional import collection_validators, entity_validators, not_modified, set_validators
+from utils.facets import catalog_facets
+from utils.fieldsets import FieldsetError, field_view
+from utils.identity import current_identity, current_user_type
+from utils.pagination import PaginationError, animal_ordering, keyset_paginate, page_params
+from utils.query_cache import cached_catalog_page, catalog_generation, catalog_key
+from utils.search import apply_search
+from utils.snapshot import catalog_snapshot
 
 animals_bp = Blueprint('animals', __name__)
 
+def _catalog_query():
+    """
+    Available animals matching the catalog filters in the query string, as
+    (query, rank, filtered): rank is the search relevance expression or None
+    """
+    # Get query parameters for filtering and searching
+    animal_type = request.args.get('type')
+    breed = request.args.get('breed')
+    min_age = request.args.get('min_age', type=int)
+    max_age = request.args.get('max_age', type=int)
+    search = request.args.get('search')
+    
+    # Build query
+    query = Animal.query.filter_by(is_available=True)
+    
+    # Apply filters
+    if animal_type:
+        query = query.filter(Animal.type.ilike(f'%{animal_type}%'))
+    if breed:
+        query = query.filter(Animal.breed.ilike(f'%{breed}%'))
+    if min_age:
+        query = query.filter(Animal.age >= min_age)
+    if max_age:
+        query = query.filter(Animal.age <= max_age)
+    rank = None
+    if search:
+        # Full-text index lookup, ranked by relevance
+        query, rank = apply_search(query, search)
+    
+    filtered = any(value for value in (animal_type, breed, min_age, max_age, search))
+    return query, rank, filtered
+
 @animals_bp.route('/', methods=['GET'])
 def get_all_animals():
     try:
-        # Get query parameters for filtering and searching
+        # Anonymous browsing can be answered from the in-memory catalog snapshot
+        snapshot = catalog_snapshot()
+        
+        # Conditional GET against the collection version, which is also the
+        # query cache's generation
+        generation = None if snapshot else catalog_generation()
+        validators = snapshot.validators() if snapshot else collection_validators('animals', versions=[generation])
+        not_modified_response = not_modified(*validators)
+        if not_modified_response:
+            return not_modified_response
+        
         animal_type = request.args.get('type')
         breed = request.args.get('breed')
         min_age = request.args.get('min_age', type=int)
         max_age = request.args.get('max_age', type=int)
         search = request.args.get('search')
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
-        
-        # Build query
-        query = Animal.query.filter_by(is_available=True)
-        
-        # Apply filters
-        if animal_type:
-            query = query.filter(Animal.type.ilike(f'%{animal_type}%'))
-        if breed:
-            query = query.filter(Animal.breed.ilike(f'%{breed}%'))
-        if min_age:
-            query = query.filter(Animal.age >= min_age)
-        if max_age:
-            query = query.filter(Animal.age <= max_age)
-        if search:
-            query = query.filter(or_(
-                Animal.name.ilike(f'%{search}%'),
-                Animal.type.ilike(f'%{search}%'),
-                Animal.breed.ilike(f'%{search}%'),
-                Animal.description.ilike(f'%{search}%')
-            ))
-        
-        # Paginate results
-        animals = query.paginate(
-            page=page, 
-            per_page=per_page, 
-            error_out=False
-        )
+        sort = request.args.get('sort') or ('relevance' if search else 'newest')
+        cursor, per_page, include_total = page_params()
+        view = field_view('animal')
+        
+        if snapshot:
+            animals = snapshot.page(view, sort, cursor, per_page, include_total, animal_type=animal_type,
+                                    breed=breed, min_age=min_age, max_age=max_age)
+            response = jsonify({'animals': animals.items, 'pagination': animals.to_dict()})
+            return set_validators(response, *validators), 200
+        
+        facets = request.args.get('facets', '').lower() in ('1', 'true', 'yes')
+        
+        def load():
+            catalog, rank, filtered = _catalog_query()
+            query = view.apply(catalog)
+            
+            # Keyset pagination
+            keys, descending = animal_ordering(sort, rank)
+            animals = keyset_paginate(query, keys, sort, cursor, per_page,
+                                      descending=descending, include_total=include_total)
+            payload = {
+                'animals': [view.dump(animal) for animal in animals.items],
+                'pagination': animals.to_dict()
+            }
+            # ?facets=true - counts for the same filters next to the results
+            if facets:
+                payload['facets'] = catalog_facets(catalog if filtered else None)
+            return payload
+        
+        # Popular filter combinations are served from the query cache
+        filters = {'type': animal_type, 'breed': breed, 'min_age': min_age, 'max_age': max_age}
+        key = catalog_key(filters, view, sort, cursor, per_page, include_total, search, facets=facets)
+        response = jsonify(cached_catalog_page(generation, key, load))
+        return set_validators(response, *validators), 200
+        
+    except (PaginationError, FieldsetError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@animals_bp.route('/facets', methods=['GET'])
+def get_animal_facets():
+    """GET /api/animals/facets - counts per type, breed, age and price bucket for the catalog filters"""
+    try:
+        validators = collection_validators('animals')
+        not_modified_response = not_modified(*validators)
+        if not_modified_response:
+            return not_modified_response
         
-        return jsonify({
-            'animals': [animal.to_dict() for animal in animals.items],
-            'total': animals.total,
-            'pages': animals.pages,
-            'current_page': page,
-            'per_page': per_page,
-            'has_next': animals.has_next,
-            'has_prev': animals.has_prev
-        }), 200
+        query, _, filtered = _catalog_query()
+        response = jsonify({'facets': catalog_facets(query if filtered else None)})
+        return set_validators(response, *validators), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@animals_bp.route('/changes', methods=['GET'])
+def get_animal_changes():
+    """GET /api/animals/changes?since=<token> - animals changed after the watermark, plus tombstones"""
+    try:
+        view = field_view('animal')
+        return jsonify(catalog_changes(view, request.args.get('since'), changes_limit())), 200
+        
+    except ResyncRequired as e:
+        return jsonify({'error': str(e)}), 410
+    except (PaginationError, FieldsetError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@animals_bp.route('/batch', methods=['GET'])
+def get_animals_batch():
+    """GET /api/animals/batch?ids=1,2,3 - many animals in one request, keyed by id"""
+    try:
+        ids = parse_ids(request.args.get('ids'))
+        view = field_view('animal')
+        
+        animals, not_found = keyed(cached_entities('animal', ids), view)
+        return jsonify({'animals': animals, 'not_found': not_found}), 200
         
+    except (BatchError, FieldsetError) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @animals_bp.route('/<int:animal_id>', methods=['GET'])
 def get_animal(animal_id):
     try:
-        animal = Animal.query.get(animal_id)
+        view = field_view('animal')
+        validators = entity_validators('animal', animal_id)
+        if not validators:
+            return jsonify({'error': 'Animal not found'}), 404
+        
+        # 304 without loading or serializing the animal
+        not_modified_response = not_modified(*validators)
+        if not_modified_response:
+            return not_modified_response
+        
+        animal = cached_entity('animal', animal_id)
         if not animal:
             return jsonify({'error': 'Animal not found'}), 404
         
-        return jsonify({'animal': animal.to_dict()}), 200
+        response = jsonify({'animal': view.project(animal)})
+        return set_validators(response, *validators), 200
         
+    except FieldsetError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -73,10 +181,10 @@ def get_animal(animal_id):
 @jwt_required()
 def create_animal():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        current_user_id = current_identity()
+        user_type = current_user_type()
         
-        if not user or user.user_type != 'farmer':
+        if user_type != 'farmer':
             return jsonify({'error': 'Only farmers can add animals'}), 403
         
         data = request.get_json()
@@ -103,23 +211,65 @@ def create_animal():
         db.session.add(animal)
         db.session.commit()
         
+        payload = animal.to_dict()
+        cache_entity('animal', animal.id, payload)
+        
         return jsonify({
             'message': 'Animal added successfully',
-            'animal': animal.to_dict()
+            'animal': payload
         }), 201
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@animals_bp.route('/import', methods=['POST'])
+@jwt_required()
+def bulk_import_animals():
+    """
+    POST /animals/import - Stream a CSV or NDJSON upload of animals, either as
+    the raw request body or as a multipart 'file' field
+    """
+    try:
+        current_user_id = current_identity()
+        user_type = current_user_type()
+        
+        if user_type != 'farmer':
+            return jsonify({'error': 'Only farmers can import animals'}), 403
+        
+        upload = request.files.get('file')
+        fmt = detect_format(request.args.get('format'),
+                            upload.mimetype if upload else request.mimetype,
+                            upload.filename if upload else None)
+        if not fmt:
+            return jsonify({'error': 'Upload must be CSV or NDJSON (set ?format=csv|ndjson)'}), 400
+        
+        report = import_animals(
+            upload.stream if upload else request.stream,
+            fmt,
+            current_user_id,
+            batch_size=current_app.config.get('IMPORT_BATCH_SIZE', 1000),
+            max_errors=current_app.config.get('IMPORT_MAX_ERRORS', 1000)
+        )
+        
+        status = 201 if report['inserted'] else 400
+        return jsonify({
+            'message': f"Imported {report['inserted']} animals, {report['failed']} rows failed",
+            **report
+        }), status
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @animals_bp.route('/<int:animal_id>', methods=['PUT'])
 @jwt_required()
 def update_animal(animal_id):
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        current_user_id = current_identity()
+        user_type = current_user_type()
         
-        if not user or user.user_type != 'farmer':
+        if user_type != 'farmer':
             return jsonify({'error': 'Only farmers can update animals'}), 403
         
         animal = Animal.query.get(animal_id)
@@ -153,9 +303,14 @@ def update_animal(animal_id):
         
         db.session.commit()
         
+        # Orders embed an animal summary, so they go stale too
+        invalidate_animals(animal.id)
+        payload = animal.to_dict()
+        cache_entity('animal', animal.id, payload)
+        
         return jsonify({
             'message': 'Animal updated successfully',
-            'animal': animal.to_dict()
+            'animal': payload
         }), 200
         
     except Exception as e:
@@ -166,10 +321,10 @@ def update_animal(animal_id):
 @jwt_required()
 def delete_animal(animal_id):
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        current_user_id = current_identity()
+        user_type = current_user_type()
         
-        if not user or user.user_type != 'farmer':
+        if user_type != 'farmer':
             return jsonify({'error': 'Only farmers can delete animals'}), 403
         
         animal = Animal.query.get(animal_id)
@@ -181,6 +336,7 @@ def delete_animal(animal_id):
         
         db.session.delete(animal)
         db.session.commit()
+        invalidate_animals(animal_id)
         
         return jsonify({'message': 'Animal deleted successfully'}), 200
         
@@ -192,17 +348,32 @@ def delete_animal(animal_id):
 @jwt_required()
 def get_farmer_animals():
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        current_user_id = current_identity()
+        user_type = current_user_type()
         
-        if not user or user.user_type != 'farmer':
+        if user_type != 'farmer':
             return jsonify({'error': 'Only farmers can access this endpoint'}), 403
         
-        animals = Animal.query.filter_by(farmer_id=current_user_id).all()
-        
-        return jsonify({
-            'animals': [animal.to_dict() for animal in animals]
-        }), 200
-        
+        # Conditional GET against the collection version
+        validators = collection_validators('animals', identity=current_user_id)
+        not_modified_response = not_modified(*validators)
+        if not_modified_response:
+            return not_modified_response
+        
+        cursor, per_page, include_total = page_params()
+        keys, descending = animal_ordering('newest')
+        view = field_view('animal')
+        animals = keyset_paginate(view.apply(Animal.query).filter_by(farmer_id=current_user_id), keys, 'newest',
+                                  cursor, per_page, descending=descending,
+                                  include_total=include_total)
+        
+        response = jsonify({
+            'animals': [view.dump(animal) for animal in animals.items],
+            'pagination': animals.to_dict()
+        })
+        return set_validators(response, *validators), 200
+        
+    except (PaginationError, FieldsetError) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
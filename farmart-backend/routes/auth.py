@@ -1,6 +1,9 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity
 from models import db, User
+from utils.cache import cached_entity
+from utils.identity import identity_claims
+from utils.passwords import HasherBusy
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -38,7 +41,7 @@ def register():
         db.session.commit()
         
         # Create tokens
-        access_token = create_access_token(identity=str(user.id))
+        access_token = create_access_token(identity=str(user.id), additional_claims=identity_claims(user))
         refresh_token = create_refresh_token(identity=str(user.id))
         
         return jsonify({
@@ -48,6 +51,9 @@ def register():
             'refresh_token': refresh_token
         }), 201
         
+    except HasherBusy as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -67,8 +73,13 @@ def login():
         if not user or not user.check_password(data['password']):
             return jsonify({'error': 'Invalid username or password'}), 401
         
+        # Upgrade hashes made with an older algorithm or cost
+        if user.password_needs_rehash():
+            user.set_password(data['password'])
+            db.session.commit()
+        
         # Create tokens
-        access_token = create_access_token(identity=str(user.id))
+        access_token = create_access_token(identity=str(user.id), additional_claims=identity_claims(user))
         refresh_token = create_refresh_token(identity=str(user.id))
         
         return jsonify({
@@ -78,6 +89,9 @@ def login():
             'refresh_token': refresh_token
         }), 200
         
+    except HasherBusy as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -91,7 +105,7 @@ def refresh():
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        new_token = create_access_token(identity=current_user_id)
+        new_token = create_access_token(identity=current_user_id, additional_claims=identity_claims(user))
         
         return jsonify({
             'access_token': new_token,
@@ -105,13 +119,12 @@ def refresh():
 @jwt_required()
 def get_current_user():
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        user = cached_entity('user', int(get_jwt_identity()))
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        return jsonify({'user': user.to_dict()}), 200
+        return jsonify({'user': user}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
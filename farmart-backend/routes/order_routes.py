@@ -1,7 +1,18 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, Order, OrderItem, Animal, User
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from flask_jwt_extended import jwt_required
+from models import db, Order, OrderItem, Animal, User, FarmerOrder
 from datetime import datetime
+from utils.cache import cache_entity, cached_entity, invalidate_animals
+from utils.conditional import collection_validators, entity_validators, not_modified, set_validators
+from utils.events import StreamLimitReached, farmer_event_stream, publish_order_event, publish_order_events
+from utils.export import EXPORT_FORMATS, export_chunks, farmer_export_query, parse_date
+from utils.fieldsets import FieldsetError, field_view
+from utils.identity import current_identity, current_user, current_user_type
+from utils.order_status import BulkStatusError, bulk_update_order_status
+from utils.pagination import (FARMER_ORDER_KEYS, ORDER_ITEM_KEYS, ORDER_KEYS, PaginationError, keyset_paginate,
+                              page_params)
+from utils.reservations import ReservationConflict, move_reservations
+from utils.serialization import load_plan
 
 # Blueprint for order routes
 order_bp = Blueprint('orders', __name__)
@@ -15,14 +26,20 @@ def get_all_orders():
     Your Person 2 responsibility
     """
     try:
+        # Conditional GET against the collection version
+        validators = collection_validators('orders', 'animals')
+        not_modified_response = not_modified(*validators)
+        if not_modified_response:
+            return not_modified_response
+        
         # Get query parameters for filtering
         status = request.args.get('status')  # FETCH /orders?status=confirmed
         customer_id = request.args.get('customer_id', type=int)
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        cursor, per_page, include_total = page_params()
+        view = field_view('order')
         
         # Build query
-        query = Order.query
+        query = view.apply(Order.query)
         
         # Apply filters
         if status:
@@ -30,29 +47,22 @@ def get_all_orders():
         if customer_id:
             query = query.filter(Order.customer_id == customer_id)
         
-        # Order by most recent first
-        query = query.order_by(Order.created_at.desc())
-        
-        # Paginate results
-        orders = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        # Most recent first, keyset paginated
+        orders = keyset_paginate(query, ORDER_KEYS, 'newest', cursor, per_page,
+                                 include_total=include_total)
         
-        return jsonify({
+        response = jsonify({
             'success': True,
-            'orders': [order.to_dict() for order in orders.items],
-            'pagination': {
-                'total': orders.total,
-                'pages': orders.pages,
-                'current_page': page,
-                'per_page': per_page,
-                'has_next': orders.has_next,
-                'has_prev': orders.has_prev
-            }
-        }), 200
+            'orders': [view.dump(order) for order in orders.items],
+            'pagination': orders.to_dict()
+        })
+        return set_validators(response, *validators), 200
         
+    except (PaginationError, FieldsetError) as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -67,18 +77,37 @@ def get_order_by_id(order_id):
     Your Person 2 responsibility
     """
     try:
-        order = Order.query.get(order_id)
+        view = field_view('order')
+        validators = entity_validators('order', order_id)
+        if not validators:
+            return jsonify({
+                'success': False,
+                'error': 'Order not found'
+            }), 404
+        
+        # 304 without loading or serializing the order
+        not_modified_response = not_modified(*validators)
+        if not_modified_response:
+            return not_modified_response
+        
+        order = cached_entity('order', order_id)
         if not order:
             return jsonify({
                 'success': False,
                 'error': 'Order not found'
             }), 404
         
-        return jsonify({
+        response = jsonify({
             'success': True,
-            'order': order.to_dict()
-        }), 200
+            'order': view.project(order)
+        })
+        return set_validators(response, *validators), 200
         
+    except FieldsetError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -101,28 +130,27 @@ def get_user_orders(user_id):
                 'error': 'User not found'
             }), 404
         
-        # Get pagination parameters
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        # Conditional GET against the collection version
+        validators = collection_validators('orders', 'animals')
+        not_modified_response = not_modified(*validators)
+        if not_modified_response:
+            return not_modified_response
+        
+        cursor, per_page, include_total = page_params()
         status = request.args.get('status')
         
         # Build query
-        query = Order.query.filter_by(customer_id=user_id)
+        view = field_view('order')
+        query = view.apply(Order.query).filter_by(customer_id=user_id)
         
         if status:
             query = query.filter(Order.status == status)
         
-        # Order by most recent first
-        query = query.order_by(Order.created_at.desc())
-        
-        # Paginate
-        orders = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        # Most recent first, keyset paginated
+        orders = keyset_paginate(query, ORDER_KEYS, 'newest', cursor, per_page,
+                                 include_total=include_total)
         
-        return jsonify({
+        response = jsonify({
             'success': True,
             'user': {
                 'id': user.id,
@@ -130,15 +158,16 @@ def get_user_orders(user_id):
                 'email': user.email,
                 'user_type': user.user_type
             },
-            'orders': [order.to_dict() for order in orders.items],
-            'pagination': {
-                'total': orders.total,
-                'pages': orders.pages,
-                'current_page': page,
-                'per_page': per_page
-            }
-        }), 200
+            'orders': [view.dump(order) for order in orders.items],
+            'pagination': orders.to_dict()
+        })
+        return set_validators(response, *validators), 200
         
+    except (PaginationError, FieldsetError) as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -153,20 +182,32 @@ def get_order_items(order_id):
     Your Person 2 responsibility
     """
     try:
-        order = Order.query.get(order_id)
+        validators = entity_validators('order', order_id)
+        if not validators:
+            return jsonify({
+                'success': False,
+                'error': 'Order not found'
+            }), 404
+        
+        not_modified_response = not_modified(*validators)
+        if not_modified_response:
+            return not_modified_response
+        
+        order = load_plan(Order.query, 'order').filter_by(id=order_id).first()
         if not order:
             return jsonify({
                 'success': False,
                 'error': 'Order not found'
             }), 404
         
-        return jsonify({
+        response = jsonify({
             'success': True,
             'order_id': order_id,
             'items': [item.to_dict() for item in order.order_items],
             'items_count': len(order.order_items),
             'total_amount': order.total_amount
-        }), 200
+        })
+        return set_validators(response, *validators), 200
         
     except Exception as e:
         return jsonify({
@@ -198,16 +239,31 @@ def get_order_items_by_animal():
                 'error': 'Animal not found'
             }), 404
         
-        # Get order items for this animal
-        order_items = OrderItem.query.filter_by(animal_id=animal_id).all()
+        # Conditional GET against the collection version
+        validators = collection_validators('orders', 'animals')
+        not_modified_response = not_modified(*validators)
+        if not_modified_response:
+            return not_modified_response
         
-        return jsonify({
+        # Get order items for this animal, newest first
+        cursor, per_page, include_total = page_params()
+        order_items = keyset_paginate(load_plan(OrderItem.query, 'order_item').filter_by(animal_id=animal_id),
+                                      ORDER_ITEM_KEYS, 'newest', cursor, per_page,
+                                      include_total=include_total)
+        
+        response = jsonify({
             'success': True,
             'animal': animal.to_summary_dict(),
-            'order_items': [item.to_dict() for item in order_items],
-            'total_items': len(order_items)
-        }), 200
+            'order_items': [item.to_dict() for item in order_items.items],
+            'pagination': order_items.to_dict()
+        })
+        return set_validators(response, *validators), 200
         
+    except PaginationError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -224,28 +280,206 @@ def get_farmer_orders():
     GET /farmer/orders - Get orders for current farmer (Farmer Dashboard)
     """
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        current_user_id = current_identity()
+        user_type = current_user_type()
+        
+        if user_type != 'farmer':
+            return jsonify({
+                'success': False,
+                'error': 'Only farmers can access this endpoint'
+            }), 403
+        
+        # Conditional GET against the collection version
+        validators = collection_validators('orders', 'animals', identity=current_user_id)
+        not_modified_response = not_modified(*validators)
+        if not_modified_response:
+            return not_modified_response
+        
+        # Get orders containing this farmer's animals, most recent first
+        cursor, per_page, include_total = page_params()
+        view = field_view('order')
+        query = view.apply(Order.query).join(
+            FarmerOrder, FarmerOrder.order_id == Order.id
+        ).filter(FarmerOrder.farmer_id == current_user_id)
+        orders = keyset_paginate(query, FARMER_ORDER_KEYS, 'newest', cursor, per_page,
+                                 include_total=include_total)
+        
+        response = jsonify({
+            'success': True,
+            'farmer': current_user().to_dict(),
+            'orders': [view.dump(order) for order in orders.items],
+            'pagination': orders.to_dict()
+        })
+        return set_validators(response, *validators), 200
+        
+    except (PaginationError, FieldsetError) as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@order_bp.route('/farmer/orders/export', methods=['GET'])
+@jwt_required()
+def export_farmer_orders():
+    """
+    GET /farmer/orders/export - Stream all of the farmer's orders (Farmer Dashboard)
+    ?format=ndjson|csv, optional status, since and until filters
+    """
+    try:
+        current_user_id = current_identity()
+        user_type = current_user_type()
+        
+        if user_type != 'farmer':
+            return jsonify({
+                'success': False,
+                'error': 'Only farmers can access this endpoint'
+            }), 403
+        
+        fmt = request.args.get('format', 'ndjson').lower()
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({
+                'success': False,
+                'error': 'Invalid format. Must be: ndjson or csv'
+            }), 400
+        
+        status = request.args.get('status')
+        if status and status not in ['pending', 'confirmed', 'rejected', 'completed']:
+            return jsonify({
+                'success': False,
+                'error': 'Invalid status. Must be: pending, confirmed, rejected, or completed'
+            }), 400
+        
+        stmt = farmer_export_query(
+            current_user_id,
+            status=status,
+            since=parse_date(request.args.get('since'), 'since'),
+            until=parse_date(request.args.get('until'), 'until')
+        )
+        
+        return Response(
+            stream_with_context(export_chunks(stmt, fmt)),
+            mimetype=EXPORT_FORMATS[fmt],
+            headers={'Content-Disposition': f'attachment; filename=orders-farmer-{current_user_id}.{fmt}'}
+        )
+        
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@order_bp.route('/farmer/events', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def stream_farmer_order_events():
+    """
+    GET /farmer/events - Server-Sent Events feed of new and updated orders (Farmer Dashboard)
+    Pushes order.created and order.status_changed events as they happen. EventSource
+    cannot send headers, so the token may also be passed as ?jwt=<token>; reconnects
+    send Last-Event-ID and receive the events they missed.
+    """
+    try:
+        current_user_id = current_identity()
+        user_type = current_user_type()
         
-        if not user or user.user_type != 'farmer':
+        if user_type != 'farmer':
             return jsonify({
                 'success': False,
                 'error': 'Only farmers can access this endpoint'
             }), 403
         
-        # Get orders containing this farmer's animals
-        orders = db.session.query(Order).join(OrderItem).join(Animal).filter(
-            Animal.farmer_id == current_user_id
-        ).distinct().order_by(Order.created_at.desc()).all()
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        return Response(
+            stream_with_context(farmer_event_stream(current_user_id, last_event_id)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        
+    except StreamLimitReached as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 503, {'Retry-After': str(e.retry_after)}
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@order_bp.route('/status', methods=['PATCH'])
+@jwt_required()
+def bulk_update_order_status_route():
+    """
+    PATCH /orders/status - Accept or deny many orders at once (Farmer Dashboard)
+    Body: {"orders": [{"order_id": 1, "status": "confirmed", "farmer_notes": "..."}, ...]}
+    """
+    try:
+        current_user_id = current_identity()
+        user_type = current_user_type()
+        
+        if user_type != 'farmer':
+            return jsonify({
+                'success': False,
+                'error': 'Only farmers can update order status'
+            }), 403
+        
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({
+                'success': False,
+                'error': 'Body must be a JSON object: {"orders": [...]}'
+            }), 400
+        try:
+            results, applied, changed_animal_ids = bulk_update_order_status(current_user_id, data.get('orders'))
+        except BulkStatusError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except ReservationConflict as e:
+            db.session.rollback()
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 409
         
+        db.session.commit()
+        
+        invalidate_animals(*changed_animal_ids)
+        previous = dict(applied)
+        orders = load_plan(Order.query, 'order').filter(Order.id.in_(previous)).populate_existing().all()
+        changes = []
+        for order in orders:
+            payload = order.to_dict()
+            cache_entity('order', order.id, payload)
+            changes.append((payload, {'previous_status': previous[order.id]}))
+        publish_order_events('order.status_changed', changes)
+        
+        # A well-formed request is answered 200; each order's own outcome,
+        # including 403 and 404, is in results
+        failed = len(results) - len(applied)
         return jsonify({
             'success': True,
-            'farmer': user.to_dict(),
-            'orders': [order.to_dict() for order in orders],
-            'total_orders': len(orders)
+            'message': f'Updated {len(applied)} orders, {failed} failed',
+            'updated': len(applied),
+            'failed': failed,
+            'results': results
         }), 200
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({
             'success': False,
             'error': str(e)
@@ -259,10 +493,10 @@ def update_order_status(order_id):
     PATCH /orders/{id}/status - Accept or deny order (Farmer Dashboard)
     """
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        current_user_id = current_identity()
+        user_type = current_user_type()
         
-        if not user or user.user_type != 'farmer':
+        if user_type != 'farmer':
             return jsonify({
                 'success': False,
                 'error': 'Only farmers can update order status'
@@ -276,12 +510,7 @@ def update_order_status(order_id):
             }), 404
         
         # Check if farmer has animals in this order
-        farmer_animals = db.session.query(OrderItem).join(Animal).filter(
-            OrderItem.order_id == order_id,
-            Animal.farmer_id == current_user_id
-        ).first()
-        
-        if not farmer_animals:
+        if not FarmerOrder.exists(current_user_id, order_id):
             return jsonify({
                 'success': False,
                 'error': 'You can only update orders containing your animals'
@@ -301,8 +530,19 @@ def update_order_status(order_id):
                 'error': 'Invalid status. Must be: pending, confirmed, rejected, or completed'
             }), 400
         
-        # Update order
+        # Move the order's reservation first: it expires the session, which
+        # would discard unflushed changes to the order
         old_status = order.status
+        try:
+            changed_animal_ids = move_reservations({order_id: (old_status, new_status)})
+        except ReservationConflict as e:
+            db.session.rollback()
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 409
+        
+        # Update order
         order.status = new_status
         order.updated_at = datetime.utcnow()
         
@@ -310,27 +550,22 @@ def update_order_status(order_id):
         if 'farmer_notes' in data:
             order.farmer_notes = data['farmer_notes']
         
-        # If order is confirmed, mark farmer's animals as unavailable
-        if new_status == 'confirmed':
-            for item in order.order_items:
-                if item.animal.farmer_id == current_user_id:
-                    item.animal.is_available = False
-        
-        # If order is rejected, make sure animals remain available
-        elif new_status == 'rejected':
-            for item in order.order_items:
-                if item.animal.farmer_id == current_user_id:
-                    item.animal.is_available = True
-        
         # Recalculate total amount (Bonus feature)
         order.calculate_total_amount()
         
         db.session.commit()
         
+        # Drop the animals (and every order embedding them), then write
+        # this order through
+        invalidate_animals(*changed_animal_ids)
+        payload = order.to_dict()
+        cache_entity('order', order.id, payload)
+        publish_order_event('order.status_changed', payload, previous_status=old_status)
+        
         return jsonify({
             'success': True,
             'message': f'Order status updated from "{old_status}" to "{new_status}"',
-            'order': order.to_dict()
+            'order': payload
         }), 200
         
     except Exception as e:
@@ -1,7 +1,18 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, Order, OrderItem, Animal, User, CartItem
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from flask_jwt_extended import jwt_required
+from models import db, Order, FarmerOrder
 from datetime import datetime
+from utils.batch import BatchError, keyed, parse_ids
+from utils.cache import cache_entity, cached_entities, cached_entity, invalidate_animals
+from utils.checkout import CheckoutConflict, CheckoutError, checkout
+from utils.conditional import collection_validators, entity_validators, not_modified, set_validators
+from utils.events import StreamLimitReached, farmer_event_stream, publish_order_event, publish_order_events
+from utils.fieldsets import FieldsetError, field_view
+from utils.identity import current_identity, current_user_type
+from utils.order_status import BulkStatusError, bulk_update_order_status
+from utils.pagination import FARMER_ORDER_KEYS, ORDER_KEYS, PaginationError, keyset_paginate, page_params
+from utils.reservations import ReservationConflict, move_reservations
+from utils.serialization import load_plan
 
 orders_bp = Blueprint('orders', __name__)
 
@@ -9,66 +20,33 @@ orders_bp = Blueprint('orders', __name__)
 @jwt_required()
 def create_order():
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        current_user_id = current_identity()
+        user_type = current_user_type()
         
-        if not user or user.user_type != 'customer':
+        if user_type != 'customer':
             return jsonify({'error': 'Only customers can create orders'}), 403
         
-        # Get cart items for the user
-        cart_items = CartItem.query.filter_by(user_id=current_user_id).all()
-        
-        if not cart_items:
-            return jsonify({'error': 'Cart is empty'}), 400
-        
-        # Calculate total amount
-        total_amount = 0
-        order_items_data = []
-        
-        for cart_item in cart_items:
-            animal = cart_item.animal
-            if not animal or not animal.is_available:
-                return jsonify({'error': f'Animal {animal.name if animal else "Unknown"} is no longer available'}), 400
-            
-            item_total = animal.price * cart_item.quantity
-            total_amount += item_total
-            
-            order_items_data.append({
-                'animal_id': animal.id,
-                'quantity': cart_item.quantity,
-                'price': animal.price
-            })
-        
-        # Create order
-        order = Order(
-            customer_id=current_user_id,
-            total_amount=total_amount,
-            status='pending'
-        )
-        
-        db.session.add(order)
-        db.session.flush()  # Get order ID
-        
-        # Create order items
-        for item_data in order_items_data:
-            order_item = OrderItem(
-                order_id=order.id,
-                animal_id=item_data['animal_id'],
-                quantity=item_data['quantity'],
-                price=item_data['price']
-            )
-            db.session.add(order_item)
-        
-        # Clear cart
-        CartItem.query.filter_by(user_id=current_user_id).delete()
-        
+        # Reserve the cart's animals and write the order in one transaction
+        order_id, animal_ids = checkout(current_user_id)
         db.session.commit()
         
+        invalidate_animals(*animal_ids)
+        order = load_plan(Order.query, 'order').filter_by(id=order_id).one()
+        payload = order.to_dict()
+        cache_entity('order', order.id, payload)
+        publish_order_event('order.created', payload)
+        
         return jsonify({
             'message': 'Order created successfully',
-            'order': order.to_dict()
+            'order': payload
         }), 201
         
+    except CheckoutConflict as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 409
+    except CheckoutError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -77,23 +55,82 @@ def create_order():
 @jwt_required()
 def get_orders():
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        current_user_id = current_identity()
+        user_type = current_user_type()
+        
+        # Conditional GET against the collection version
+        validators = collection_validators('orders', 'animals', identity=current_user_id)
+        not_modified_response = not_modified(*validators)
+        if not_modified_response:
+            return not_modified_response
+        
+        cursor, per_page, include_total = page_params()
+        view = field_view('order')
         
-        if user.user_type == 'customer':
-            orders = Order.query.filter_by(customer_id=current_user_id).order_by(Order.created_at.desc()).all()
-        elif user.user_type == 'farmer':
+        if user_type == 'customer':
+            query = view.apply(Order.query).filter_by(customer_id=current_user_id)
+        elif user_type == 'farmer':
             # Get orders that contain the farmer's animals
-            orders = db.session.query(Order).join(OrderItem).join(Animal).filter(
-                Animal.farmer_id == current_user_id
-            ).distinct().order_by(Order.created_at.desc()).all()
+            query = view.apply(Order.query).join(
+                FarmerOrder, FarmerOrder.order_id == Order.id
+            ).filter(FarmerOrder.farmer_id == current_user_id)
         else:
             return jsonify({'error': 'Invalid user type'}), 400
         
+        keys = FARMER_ORDER_KEYS if user_type == 'farmer' else ORDER_KEYS
+        orders = keyset_paginate(query, keys, 'newest', cursor, per_page,
+                                 include_total=include_total)
+        
+        response = jsonify({
+            'orders': [view.dump(order) for order in orders.items],
+            'pagination': orders.to_dict()
+        })
+        return set_validators(response, *validators), 200
+        
+    except (PaginationError, FieldsetError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@orders_bp.route('/batch', methods=['GET'])
+@jwt_required()
+def get_orders_batch():
+    """GET /api/orders/batch?ids=1,2,3 - many orders in one request, keyed by id"""
+    try:
+        current_user_id = current_identity()
+        user_type = current_user_type()
+        ids = parse_ids(request.args.get('ids'))
+        view = field_view('order')
+        
+        payloads = cached_entities('order', ids)
+        
+        # Same rules as get_order: customers see their own orders, farmers
+        # the orders holding their animals (one lookup for the whole batch)
+        if user_type == 'farmer':
+            visible = {row[0] for row in db.session.query(FarmerOrder.order_id).filter(
+                FarmerOrder.farmer_id == current_user_id,
+                FarmerOrder.order_id.in_(ids)
+            )}
+        elif user_type == 'customer':
+            visible = {order_id for order_id, payload in payloads.items()
+                       if payload and payload['customer_id'] == current_user_id}
+        else:
+            visible = set()
+        
+        forbidden = [order_id for order_id, payload in payloads.items()
+                     if payload is not None and order_id not in visible]
+        for order_id in forbidden:
+            payloads[order_id] = None
+        
+        orders, missing = keyed(payloads, view)
         return jsonify({
-            'orders': [order.to_dict() for order in orders]
+            'orders': orders,
+            'not_found': [order_id for order_id in missing if order_id not in forbidden],
+            'forbidden': forbidden
         }), 200
         
+    except (BatchError, FieldsetError) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -101,42 +138,123 @@ def get_orders():
 @jwt_required()
 def get_order(order_id):
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        current_user_id = current_identity()
+        user_type = current_user_type()
+        view = field_view('order')
         
-        order = Order.query.get(order_id)
+        order = cached_entity('order', order_id)
         if not order:
             return jsonify({'error': 'Order not found'}), 404
         
         # Check if user has access to this order
         has_access = False
-        if user.user_type == 'customer' and order.customer_id == current_user_id:
+        if user_type == 'customer' and order['customer_id'] == current_user_id:
             has_access = True
-        elif user.user_type == 'farmer':
+        elif user_type == 'farmer':
             # Check if any item in the order belongs to this farmer
-            farmer_animals = db.session.query(OrderItem).join(Animal).filter(
-                OrderItem.order_id == order_id,
-                Animal.farmer_id == current_user_id
-            ).first()
-            if farmer_animals:
-                has_access = True
+            has_access = FarmerOrder.exists(current_user_id, order_id)
         
         if not has_access:
             return jsonify({'error': 'Access denied'}), 403
         
-        return jsonify({'order': order.to_dict()}), 200
+        validators = entity_validators('order', order_id)
+        not_modified_response = not_modified(*validators)
+        if not_modified_response:
+            return not_modified_response
+        
+        response = jsonify({'order': view.project(order)})
+        return set_validators(response, *validators), 200
+        
+    except FieldsetError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@orders_bp.route('/farmer/events', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def stream_farmer_order_events():
+    """
+    GET /api/orders/farmer/events - Server-Sent Events feed of the farmer's new and
+    updated orders; ?jwt=<token> for EventSource, Last-Event-ID to resume
+    """
+    try:
+        current_user_id = current_identity()
+        user_type = current_user_type()
+        
+        if user_type != 'farmer':
+            return jsonify({'error': 'Only farmers can access this endpoint'}), 403
+        
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        return Response(
+            stream_with_context(farmer_event_stream(current_user_id, last_event_id)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        
+    except StreamLimitReached as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@orders_bp.route('/status', methods=['PUT'])
+@jwt_required()
+def bulk_update_order_status_route():
+    """
+    PUT /orders/status - Update many orders in one transaction, body
+    {"orders": [{"order_id", "status", "farmer_notes"}, ...]}; reports a result per order
+    """
+    try:
+        current_user_id = current_identity()
+        user_type = current_user_type()
+        
+        if user_type != 'farmer':
+            return jsonify({'error': 'Only farmers can update order status'}), 403
+        
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Body must be a JSON object: {"orders": [...]}'}), 400
+        try:
+            results, applied, changed_animal_ids = bulk_update_order_status(current_user_id, data.get('orders'))
+        except BulkStatusError as e:
+            return jsonify({'error': str(e)}), 400
+        except ReservationConflict as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 409
+        
+        db.session.commit()
+        
+        invalidate_animals(*changed_animal_ids)
+        previous = dict(applied)
+        orders = load_plan(Order.query, 'order').filter(Order.id.in_(previous)).populate_existing().all()
+        changes = []
+        for order in orders:
+            payload = order.to_dict()
+            cache_entity('order', order.id, payload)
+            changes.append((payload, {'previous_status': previous[order.id]}))
+        publish_order_events('order.status_changed', changes)
+        
+        # A well-formed request is answered 200; each order's own outcome,
+        # including 403 and 404, is in results
+        failed = len(results) - len(applied)
+        return jsonify({
+            'message': f'Updated {len(applied)} orders, {failed} failed',
+            'updated': len(applied),
+            'failed': failed,
+            'results': results
+        }), 200
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @orders_bp.route('/<int:order_id>/status', methods=['PUT'])
 @jwt_required()
 def update_order_status(order_id):
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        current_user_id = current_identity()
+        user_type = current_user_type()
         
-        if user.user_type != 'farmer':
+        if user_type != 'farmer':
             return jsonify({'error': 'Only farmers can update order status'}), 403
         
         order = Order.query.get(order_id)
@@ -144,12 +262,7 @@ def update_order_status(order_id):
             return jsonify({'error': 'Order not found'}), 404
         
         # Check if farmer has animals in this order
-        farmer_animals = db.session.query(OrderItem).join(Animal).filter(
-            OrderItem.order_id == order_id,
-            Animal.farmer_id == current_user_id
-        ).first()
-        
-        if not farmer_animals:
+        if not FarmerOrder.exists(current_user_id, order_id):
             return jsonify({'error': 'You can only update orders containing your animals'}), 403
         
         data = request.get_json()
@@ -159,20 +272,28 @@ def update_order_status(order_id):
         if data['status'] not in ['pending', 'confirmed', 'rejected', 'completed']:
             return jsonify({'error': 'Invalid status'}), 400
         
+        # Move the order's reservation first: it expires the session, which
+        # would discard an unflushed status change
+        previous_status = order.status
+        try:
+            changed_animal_ids = move_reservations({order_id: (previous_status, data['status'])})
+        except ReservationConflict as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 409
+        
         order.status = data['status']
         order.updated_at = datetime.utcnow()
         
-        # If order is confirmed, mark animals as unavailable
-        if data['status'] == 'confirmed':
-            for item in order.order_items:
-                if item.animal.farmer_id == current_user_id:
-                    item.animal.is_available = False
-        
         db.session.commit()
         
+        invalidate_animals(*changed_animal_ids)
+        payload = order.to_dict()
+        cache_entity('order', order.id, payload)
+        publish_order_event('order.status_changed', payload, previous_status=previous_status)
+        
         return jsonify({
             'message': 'Order status updated successfully',
-            'order': order.to_dict()
+            'order': payload
         }), 200
         
     except Exception as e:
@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, User, CartItem, Animal
+from flask_jwt_extended import jwt_required
+from models import db, CartItem, Animal
+from utils.identity import current_identity, current_user_type
+from utils.serialization import load_plan
 
 users_bp = Blueprint('users', __name__)
 
@@ -8,13 +10,13 @@ users_bp = Blueprint('users', __name__)
 @jwt_required()
 def get_cart():
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        current_user_id = current_identity()
+        user_type = current_user_type()
         
-        if not user or user.user_type != 'customer':
+        if user_type != 'customer':
             return jsonify({'error': 'Only customers can access cart'}), 403
         
-        cart_items = CartItem.query.filter_by(user_id=current_user_id).all()
+        cart_items = load_plan(CartItem.query, 'cart_item').filter_by(user_id=current_user_id).all()
         
         total_amount = sum(item.animal.price * item.quantity for item in cart_items if item.animal)
         
@@ -31,10 +33,10 @@ def get_cart():
 @jwt_required()
 def add_to_cart():
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        current_user_id = current_identity()
+        user_type = current_user_type()
         
-        if not user or user.user_type != 'customer':
+        if user_type != 'customer':
             return jsonify({'error': 'Only customers can add items to cart'}), 403
         
         data = request.get_json()
@@ -81,10 +83,10 @@ def add_to_cart():
 @jwt_required()
 def update_cart_item(cart_item_id):
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        current_user_id = current_identity()
+        user_type = current_user_type()
         
-        if not user or user.user_type != 'customer':
+        if user_type != 'customer':
             return jsonify({'error': 'Only customers can update cart items'}), 403
         
         cart_item = CartItem.query.get(cart_item_id)
@@ -116,10 +118,10 @@ def update_cart_item(cart_item_id):
 @jwt_required()
 def remove_from_cart(cart_item_id):
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        current_user_id = current_identity()
+        user_type = current_user_type()
         
-        if not user or user.user_type != 'customer':
+        if user_type != 'customer':
             return jsonify({'error': 'Only customers can remove cart items'}), 403
         
         cart_item = CartItem.query.get(cart_item_id)
@@ -142,10 +144,10 @@ def remove_from_cart(cart_item_id):
 @jwt_required()
 def clear_cart():
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        current_user_id = current_identity()
+        user_type = current_user_type()
         
-        if not user or user.user_type != 'customer':
+        if user_type != 'customer':
             return jsonify({'error': 'Only customers can clear cart'}), 403
         
         CartItem.query.filter_by(user_id=current_user_id).delete()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 from app import create_app
 
 if __name__ == '__main__':
@@ -10,5 +11,11 @@ if __name__ == '__main__':
         from dotenv import load_dotenv
         load_dotenv(env_file)
     
-    app = create_app()
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    if '--asgi' in sys.argv:
+        # Reads on asyncio, writes on the WSGI thread pool (see asgi.py)
+        import uvicorn
+        from asgi import create_asgi_app
+        uvicorn.run(create_asgi_app(create_app()), host='0.0.0.0', port=5000)
+    else:
+        app = create_app()
+        app.run(debug=True, host='0.0.0.0', port=5000)
@@ -1,7 +1,23 @@
 import pytest
+import asyncio
 import json
+import random
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from flask_jwt_extended import create_access_token, decode_token
+from sqlalchemy import event
 from app import create_app
-from models import db, User, Animal
+from models import db, User, Animal, CartItem, OrderItem, ReadOnlySessionError
+from utils import bulk_import
+from utils.cache import entity_cache
+from utils.events import order_events
+from utils.passwords import HasherBusy, PasswordHasher
+from utils.replicas import ReplicaSet, replica_engine
+
+try:
+    import asgi
+except ImportError:  # a2wsgi, aiosqlite and greenlet are only needed for ASGI mode
+    asgi = None
 
 @pytest.fixture
 def app():
@@ -150,6 +166,22 @@ def test_get_animals(client, auth_headers):
     data = json.loads(response.data)
     assert len(data['animals']) > 0
 
+def test_catalog_facets(client, auth_headers):
+    """Test facet counts on their own route and next to filtered results"""
+    for name, animal_type, breed in (('Bessie', 'cow', 'Holstein'), ('Daisy', 'cow', 'Jersey'),
+                                     ('Woolly', 'sheep', 'Merino')):
+        client.post('/api/animals/', headers=auth_headers['farmer'], json={
+            'name': name, 'type': animal_type, 'breed': breed, 'age': 24, 'weight': 100, 'price': 300
+        })
+    
+    facets = json.loads(client.get('/api/animals/facets').data)['facets']
+    assert facets['type'] == [{'value': 'cow', 'count': 2}, {'value': 'sheep', 'count': 1}]
+    
+    data = json.loads(client.get('/api/animals/?type=cow&facets=true').data)
+    assert len(data['animals']) == 2
+    assert [entry['value'] for entry in data['facets']['breed']] == ['Holstein', 'Jersey']
+    assert 'facets' not in json.loads(client.get('/api/animals/?type=cow').data)
+
 def test_add_to_cart(client, auth_headers):
     """Test adding animal to cart"""
     # First create an animal
@@ -182,5 +214,410 @@ def test_add_to_cart(client, auth_headers):
     
     assert response.status_code == 201
 
+def test_bulk_import_csv(client, auth_headers):
+    """Test streaming CSV import with a per-row error report"""
+    csv_body = (
+        'name,type,breed,age,weight,price,description\n'
+        'Bessie,cow,Holstein,24,500,1500,Dairy cow\n'
+        'Nameless,cow,Jersey,,400,1200,\n'
+        'Woolly,sheep,Merino,18,80,200,\n'
+        'Porky,pig,Yorkshire,twelve,100,800,\n'
+    )
+    response = client.post('/api/animals/import',
+                          data=csv_body,
+                          content_type='text/csv',
+                          headers=auth_headers['farmer'])
+    
+    assert response.status_code == 201
+    data = json.loads(response.data)
+    assert data['inserted'] == 2
+    assert data['failed'] == 2
+    assert data['errors'] == [
+        {'row': 2, 'error': 'age is required'},
+        {'row': 4, 'error': 'age must be a number'}
+    ]
+    
+    response = client.get('/api/animals/?search=merino')
+    assert [a['name'] for a in json.loads(response.data)['animals']] == ['Woolly']
+
+def test_bulk_import_ndjson_in_batches(client, auth_headers, app):
+    """Test NDJSON import spanning several insert batches"""
+    app.config['IMPORT_BATCH_SIZE'] = 7
+    lines = [json.dumps({'name': f'Hen {i}', 'type': 'chicken', 'breed': 'Leghorn',
+                         'age': 6, 'weight': 2.1, 'price': 15}) for i in range(50)]
+    lines.insert(10, '{not json')
+    
+    response = client.post('/api/animals/import?format=ndjson',
+                          data='\n'.join(lines),
+                          headers=auth_headers['farmer'])
+    
+    data = json.loads(response.data)
+    assert data['inserted'] == 50
+    assert data['errors'][0]['row'] == 11
+    
+    response = client.get('/api/animals/my-animals?include_total=true', headers=auth_headers['farmer'])
+    assert json.loads(response.data)['pagination']['total'] == 50
+
+def test_bulk_import_rejects_non_finite_and_fractional_values(client, auth_headers, monkeypatch):
+    """Test that bad numbers fail their own row and a refused batch only reports the rows at fault"""
+    lines = [
+        {'name': 'Bessie', 'type': 'cow', 'breed': 'Holstein', 'age': 24, 'weight': 500, 'price': 'nan'},
+        {'name': 'Daisy', 'type': 'cow', 'breed': 'Jersey', 'age': 24, 'weight': 400, 'price': 'inf'},
+        {'name': 'Woolly', 'type': 'sheep', 'breed': 'Merino', 'age': 18.5, 'weight': 80, 'price': 200},
+        {'name': 'Dolly', 'type': 'sheep', 'breed': 'Merino', 'age': True, 'weight': 80, 'price': 200},
+        {'name': 'Porky', 'type': 'pig', 'breed': 'Yorkshire', 'age': 12, 'weight': 100, 'price': 800,
+         'description': {'x': 1}},
+        {'name': 'Hammy', 'type': 'pig', 'breed': 'Yorkshire', 'age': 12.0, 'weight': 100, 'price': 800},
+        {'name': 'Boom', 'type': 'pig', 'breed': 'Yorkshire', 'age': 12, 'weight': 100, 'price': 800}
+    ]
+    # The database refuses Boom; Hammy shares its batch and must still be inserted
+    insert_batch = bulk_import.insert_batch
+    def refuse_boom(rows):
+        if any(row['name'] == 'Boom' for row in rows):
+            raise RuntimeError('constraint failed')
+        insert_batch(rows)
+    monkeypatch.setattr(bulk_import, 'insert_batch', refuse_boom)
+    
+    response = client.post('/api/animals/import?format=ndjson',
+                          data='\n'.join(json.dumps(line) for line in lines),
+                          headers=auth_headers['farmer'])
+    
+    data = json.loads(response.data)
+    assert data['inserted'] == 1
+    assert data['errors'] == [
+        {'row': 1, 'error': 'price must be a finite number'},
+        {'row': 2, 'error': 'price must be a finite number'},
+        {'row': 3, 'error': 'age must be a whole number'},
+        {'row': 4, 'error': 'age must be a number'},
+        {'row': 5, 'error': 'description must be a string'},
+        {'row': 7, 'error': 'Insert failed: constraint failed'}
+    ]
+    response = client.get('/api/animals/my-animals', headers=auth_headers['farmer'])
+    assert [(a['name'], a['age']) for a in json.loads(response.data)['animals']] == [('Hammy', 12)]
+
+def test_bulk_import_requires_farmer(client, auth_headers):
+    """Test that customers cannot import animals"""
+    response = client.post('/api/animals/import?format=csv',
+                          data='name,type,breed,age,weight,price\n',
+                          headers=auth_headers['customer'])
+    assert response.status_code == 403
+
+def test_token_carries_user_type(app, auth_headers):
+    """Test that issued access tokens embed the user's role"""
+    token = auth_headers['farmer']['Authorization'].split()[1]
+    assert decode_token(token)['user_type'] == 'farmer'
+
+def test_role_check_does_not_load_user(app, client, auth_headers):
+    """Test that authorization reads the role claim instead of the users table"""
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+    
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get('/api/animals/my-animals', headers=auth_headers['farmer'])
+        assert response.status_code == 200
+        response = client.get('/api/users/cart', headers=auth_headers['farmer'])
+        assert response.status_code == 403
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    
+    assert not [s for s in statements if 'FROM users' in s]
+
+def test_token_without_role_claim_still_works(app, client, auth_headers):
+    """Test that tokens issued before the user_type claim fall back to a lookup"""
+    farmer = User.query.filter_by(username='testfarmer').first()
+    headers = {'Authorization': f'Bearer {create_access_token(identity=str(farmer.id))}'}
+    
+    response = client.get('/api/animals/my-animals', headers=headers)
+    assert response.status_code == 200
+    assert app.extensions['identity_cache'].get(farmer.id) == 'farmer'
+
+def test_login_upgrades_outdated_hash(app, client):
+    """Test that login rehashes passwords stored with older cost parameters"""
+    app.extensions['password_hasher'] = PasswordHasher(method='pbkdf2:sha256:1000')
+    client.post('/api/auth/register',
+               data=json.dumps({'username': 'olduser', 'email': 'old@test.com',
+                                'password': 'password123', 'user_type': 'customer'}),
+               content_type='application/json')
+    assert User.query.filter_by(username='olduser').first().password_hash.startswith('pbkdf2:sha256:1000$')
+    
+    app.extensions['password_hasher'] = PasswordHasher(method='pbkdf2:sha256:2000')
+    response = client.post('/api/auth/login',
+                          data=json.dumps({'username': 'olduser', 'password': 'password123'}),
+                          content_type='application/json')
+    assert response.status_code == 200
+    
+    user = User.query.filter_by(username='olduser').first()
+    assert user.password_hash.startswith('pbkdf2:sha256:2000$')
+    assert user.check_password('password123')
+
+def test_login_returns_503_when_hasher_busy(app, client, auth_headers):
+    """Test that a saturated hashing pool sheds load instead of queueing forever"""
+    class BusyHasher(PasswordHasher):
+        def verify(self, stored_hash, password):
+            raise HasherBusy('Too many password operations in progress')
+    
+    app.extensions['password_hasher'] = BusyHasher()
+    response = client.post('/api/auth/login',
+                          data=json.dumps({'username': 'testfarmer', 'password': 'password123'}),
+                          content_type='application/json')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+def test_checkout_reserves_animals(client, auth_headers):
+    """Test that checkout takes animals off the market and rejects a second buyer"""
+    response = client.post('/api/animals/', headers=auth_headers['farmer'], json={
+        'name': 'Bessie', 'type': 'cow', 'breed': 'Holstein', 'age': 24, 'weight': 500, 'price': 1500
+    })
+    animal_id = json.loads(response.data)['animal']['id']
+    
+    client.post('/api/users/cart', headers=auth_headers['customer'], json={'animal_id': animal_id})
+    response = client.post('/api/orders/', headers=auth_headers['customer'])
+    assert response.status_code == 201
+    order = json.loads(response.data)['order']
+    assert order['total_amount'] == 1500
+    assert [item['animal_id'] for item in order['items']] == [animal_id]
+    assert json.loads(client.get(f'/api/animals/{animal_id}').data)['animal']['is_available'] == False
+    
+    # Cart is empty now
+    assert client.post('/api/orders/', headers=auth_headers['customer']).status_code == 400
+
+def test_checkout_publishes_order_created_event(app, client, auth_headers):
+    """Test that a new order is pushed to the farmer whose animal it holds"""
+    response = client.post('/api/animals/', headers=auth_headers['farmer'], json={
+        'name': 'Bessie', 'type': 'cow', 'breed': 'Holstein', 'age': 24, 'weight': 500, 'price': 1500
+    })
+    farmer_id = json.loads(response.data)['animal']['farmer_id']
+    client.post('/api/users/cart', headers=auth_headers['customer'],
+                json={'animal_id': json.loads(response.data)['animal']['id']})
+    order_id = json.loads(client.post('/api/orders/', headers=auth_headers['customer']).data)['order']['id']
+    
+    broker = order_events()
+    events = broker.since(f'farmer:{farmer_id}', f'{broker.epoch}:0')
+    assert [(event.type, event.data['order']['id']) for event in events] == [('order.created', order_id)]
+
+def test_rejected_order_cannot_release_or_reclaim_a_resold_animal(client, auth_headers):
+    """Test that an old rejected order does not touch an animal another order now holds"""
+    response = client.post('/api/animals/', headers=auth_headers['farmer'], json={
+        'name': 'Bessie', 'type': 'cow', 'breed': 'Holstein', 'age': 24, 'weight': 500, 'price': 1500
+    })
+    animal_id = json.loads(response.data)['animal']['id']
+    
+    def order_bessie():
+        client.post('/api/users/cart', headers=auth_headers['customer'], json={'animal_id': animal_id})
+        return json.loads(client.post('/api/orders/', headers=auth_headers['customer']).data)['order']['id']
+    
+    def is_available():
+        return json.loads(client.get(f'/api/animals/{animal_id}').data)['animal']['is_available']
+    
+    first = order_bessie()
+    assert client.put(f'/api/orders/{first}/status', headers=auth_headers['farmer'],
+                      json={'status': 'rejected'}).status_code == 200
+    assert is_available() == True
+    
+    order_bessie()
+    assert is_available() == False
+    assert client.put(f'/api/orders/{first}/status', headers=auth_headers['farmer'],
+                      json={'status': 'rejected'}).status_code == 200
+    assert is_available() == False
+    assert client.put(f'/api/orders/{first}/status', headers=auth_headers['farmer'],
+                      json={'status': 'confirmed'}).status_code == 409
+    assert json.loads(client.get(f'/api/orders/{first}', headers=auth_headers['customer']).data)['order']['status'] \
+        == 'rejected'
+
+def test_bulk_order_status_rejects_and_releases(client, auth_headers):
+    """Test that rejecting orders in bulk puts their animals back on the market"""
+    order_ids = []
+    for name in ('Bessie', 'Daisy'):
+        response = client.post('/api/animals/', headers=auth_headers['farmer'], json={
+            'name': name, 'type': 'cow', 'breed': 'Holstein', 'age': 24, 'weight': 500, 'price': 1500
+        })
+        client.post('/api/users/cart', headers=auth_headers['customer'],
+                    json={'animal_id': json.loads(response.data)['animal']['id']})
+        order_ids.append(json.loads(client.post('/api/orders/', headers=auth_headers['customer']).data)['order']['id'])
+    
+    body = {'orders': [{'order_id': order_id, 'status': 'rejected'} for order_id in order_ids]}
+    assert client.put('/api/orders/status', headers=auth_headers['customer'], json=body).status_code == 403
+    response = client.put('/api/orders/status', headers=auth_headers['farmer'], json=body)
+    assert response.status_code == 200
+    assert json.loads(response.data)['updated'] == 2
+    animals = json.loads(client.get('/api/animals/').data)['animals']
+    assert sorted(animal['name'] for animal in animals) == ['Bessie', 'Daisy']
+
+def test_concurrent_checkouts_never_oversell(app):
+    """Test that hundreds of concurrent checkouts sell each animal at most once"""
+    farmer = User(username='stockfarmer', email='stock@test.com', user_type='farmer', password_hash='-')
+    customers = [User(username=f'buyer{i}', email=f'buyer{i}@test.com', user_type='customer',
+                      password_hash='-') for i in range(300)]
+    db.session.add_all([farmer] + customers)
+    db.session.flush()
+    animals = [Animal(name=f'Lot {i}', type='sheep', breed='Merino', age=12, weight=60,
+                      price=100 + i, farmer_id=farmer.id) for i in range(20)]
+    db.session.add_all(animals)
+    db.session.flush()
+    
+    rng = random.Random(42)
+    for customer in customers:
+        for animal in rng.sample(animals, 2):
+            db.session.add(CartItem(user_id=customer.id, animal_id=animal.id))
+    db.session.commit()
+    
+    tokens = [create_access_token(identity=str(customer.id), additional_claims={'user_type': 'customer'})
+              for customer in customers]
+    
+    def place_order(token):
+        return app.test_client().post('/api/orders/', headers={'Authorization': f'Bearer {token}'}).status_code
+    
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        statuses = list(pool.map(place_order, tokens))
+    
+    assert set(statuses) <= {201, 409}
+    assert statuses.count(201) > 0
+    db.session.expire_all()
+    sold = [animal_id for (animal_id,) in db.session.query(OrderItem.animal_id)]
+    assert len(sold) == len(set(sold))
+    assert len(sold) == 2 * statuses.count(201)
+    assert Animal.query.filter_by(is_available=False).count() == len(sold)
+
+def test_orders_batch_enforces_access(client, auth_headers):
+    """Test that the orders batch returns own orders and marks the rest"""
+    response = client.post('/api/animals/', headers=auth_headers['farmer'], json={
+        'name': 'Bessie', 'type': 'cow', 'breed': 'Holstein', 'age': 24, 'weight': 500, 'price': 1500
+    })
+    animal_id = json.loads(response.data)['animal']['id']
+    client.post('/api/users/cart', headers=auth_headers['customer'], json={'animal_id': animal_id})
+    order_id = json.loads(client.post('/api/orders/', headers=auth_headers['customer']).data)['order']['id']
+    
+    url = f'/api/orders/batch?ids={order_id},999'
+    data = json.loads(client.get(url, headers=auth_headers['customer']).data)
+    assert data['orders'][str(order_id)]['total_amount'] == 1500
+    assert data['orders']['999'] is None
+    assert data['not_found'] == [999] and data['forbidden'] == []
+    
+    # The farmer whose animal is in the order sees it too
+    data = json.loads(client.get(url + '&fields=id,status', headers=auth_headers['farmer']).data)
+    assert data['orders'][str(order_id)] == {'id': order_id, 'status': 'pending'}
+    
+    stranger = User(username='stranger', email='stranger@test.com', user_type='customer', password_hash='-')
+    db.session.add(stranger)
+    db.session.commit()
+    headers = {'Authorization': f'Bearer {create_access_token(identity=str(stranger.id), additional_claims={"user_type": "customer"})}'}
+    data = json.loads(client.get(url, headers=headers).data)
+    assert data['orders'][str(order_id)] is None
+    assert data['forbidden'] == [order_id]
+
+def asgi_scope(method, path, headers=None):
+    path, _, query = path.partition('?')
+    headers = dict(headers or {}, Host='localhost')
+    return {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+            'method': method, 'path': path, 'root_path': '', 'query_string': query.encode(),
+            'headers': [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+            'client': ('127.0.0.1', 50000), 'server': ('localhost', 80)}
+
+async def asgi_request(asgi_app, method, path, headers=None, body=b''):
+    messages = []
+    
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+    
+    async def send(message):
+        messages.append(message)
+    
+    headers = dict(headers or {}, **({'Content-Length': str(len(body))} if body else {}))
+    await asgi_app(asgi_scope(method, path, headers), receive, send)
+    status = next(m['status'] for m in messages if m['type'] == 'http.response.start')
+    return status, b''.join(m.get('body', b'') for m in messages if m['type'] == 'http.response.body')
+
+@pytest.mark.skipif(asgi is None, reason='ASGI extras not installed')
+def test_asgi_mode_serves_reads_async_and_writes_via_wsgi(app, auth_headers):
+    """Test that ASGI mode answers reads on the event loop and writes through WSGI"""
+    asgi_app = asgi.create_asgi_app(app)
+    assert asgi_app.is_async(asgi_scope('GET', '/api/auth/me'))
+    assert asgi_app.is_async(asgi_scope('GET', '/api/animals/'))
+    assert not asgi_app.is_async(asgi_scope('POST', '/api/animals/'))
+    
+    animal_data = {'name': 'Bessie', 'type': 'cow', 'breed': 'Holstein', 'age': 24,
+                   'weight': 500.0, 'price': 1500.0, 'description': 'Healthy dairy cow'}
+    
+    async def scenario():
+        try:
+            created = await asgi_request(asgi_app, 'POST', '/api/animals/',
+                                         dict(auth_headers['farmer'], **{'Content-Type': 'application/json'}),
+                                         json.dumps(animal_data).encode())
+            reads = await asyncio.gather(
+                *[asgi_request(asgi_app, 'GET', '/api/auth/me', auth_headers['farmer']) for _ in range(20)],
+                asgi_request(asgi_app, 'GET', '/api/animals/?type=cow')
+            )
+            return created, reads
+        finally:
+            await asgi_app.engine.dispose()
+    
+    (created_status, _), reads = asyncio.run(scenario())
+    assert created_status == 201
+    for status, body in reads[:-1]:
+        assert status == 200
+        assert json.loads(body)['user']['username'] == 'testfarmer'
+    status, body = reads[-1]
+    assert status == 200
+    assert [animal['name'] for animal in json.loads(body)['animals']] == ['Bessie']
+
+def test_get_requests_read_from_replica_unless_client_just_wrote(app, client, auth_headers, tmp_path):
+    """Test replica routing for GETs with read-your-writes stickiness"""
+    animal = {'name': 'Bessie', 'type': 'cow', 'breed': 'Holstein', 'age': 24,
+              'weight': 500.0, 'price': 1500.0, 'description': 'Healthy dairy cow'}
+    assert client.post('/api/animals/', json=animal, headers=auth_headers['farmer']).status_code == 201
+    
+    # A copy of the primary stands in for a replica that stops replicating here
+    replica_path = tmp_path / 'replica.db'
+    primary = sqlite3.connect(db.engine.url.database)
+    with sqlite3.connect(replica_path) as replica:
+        primary.backup(replica)
+    primary.close()
+    app.extensions['replicas'] = ReplicaSet([replica_engine(f'sqlite:///{replica_path}', app)], sticky_seconds=60)
+    
+    response = client.post('/api/animals/', json=dict(animal, name='Daisy'), headers=auth_headers['farmer'])
+    assert response.status_code == 201
+    
+    # The writer reads its own write from the primary; other clients see the replica
+    mine = json.loads(client.get('/api/animals/my-animals', headers=auth_headers['farmer']).data)
+    assert sorted(a['name'] for a in mine['animals']) == ['Bessie', 'Daisy']
+    listed = json.loads(client.get('/api/animals/', headers=auth_headers['customer']).data)
+    assert [a['name'] for a in listed['animals']] == ['Bessie']
+    
+    # A lagging replica's copy is not cached for everyone, the writer included
+    bessie = listed['animals'][0]['id']
+    response = client.put(f'/api/animals/{bessie}', json={'price': 1400}, headers=auth_headers['farmer'])
+    assert response.status_code == 200
+    url = f'/api/animals/{bessie}'
+    entity_cache().invalidate('animal', bessie)  # as writes that drop rather than write through do
+    assert json.loads(client.get(url, headers=auth_headers['customer']).data)['animal']['price'] == 1500
+    assert json.loads(client.get(url, headers=auth_headers['farmer']).data)['animal']['price'] == 1400
+    
+    # Once the window has passed the writer reads from the replica too
+    app.extensions['replicas'].sticky_seconds = 0
+    app.extensions['replicas']._sticky.clear()
+    mine = json.loads(client.get('/api/animals/my-animals', headers=auth_headers['farmer']).data)
+    assert [a['name'] for a in mine['animals']] == ['Bessie']
+    
+    # Replica connections refuse writes even outside the ORM
+    with app.extensions['replicas'].engines[0].connect() as connection:
+        with pytest.raises(Exception, match='readonly'):
+            connection.exec_driver_sql("UPDATE animals SET price = 1")
+    app.extensions['replicas'].engines[0].dispose()
+
+def test_get_requests_use_read_only_sessions(app):
+    """Test that GET handlers cannot flush and do not autoflush or expire on commit"""
+    with app.test_request_context('/api/animals/', method='GET'):
+        app.preprocess_request()
+        session = db.session()
+        assert session.autoflush is False and session.expire_on_commit is False
+        session.add(User(username='sneaky', email='sneaky@test.com', user_type='customer', password_hash='-'))
+        with pytest.raises(ReadOnlySessionError):
+            session.flush()
+        session.rollback()
+        app.do_teardown_request()
+    assert db.session().autoflush is True
+
 if __name__ == '__main__':
     pytest.main([__file__])
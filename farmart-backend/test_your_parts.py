@@ -1,7 +1,24 @@
 import pytest
+import gzip
 import json
+import re
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import create_engine, event, inspect, text
+from flask_jwt_extended import create_access_token
 from app_new import create_app
-from models import db, User, Animal, Order, OrderItem
+from models import db, User, Animal, CollectionVersion, FarmerOrder, Order, OrderItem
+from models.facet_model import rebuild_facet_counts
+from utils.cache import FileCache, LRUCache
+from utils.events import farmer_event_stream
+from flask.json.provider import DefaultJSONProvider
+from utils.json_provider import OrjsonProvider, orjson
+from utils.migrations import MIGRATIONS, backfill_farmer_orders_command, run_migrations
+from utils.pagination import encode_cursor
+from utils.query_cache import QueryCache
+from utils.reservations import expire_pending_orders_command
+from utils.snapshot import np, snapshot_store
 
 @pytest.fixture
 def app():
@@ -161,8 +178,590 @@ def test_get_order_items_by_animal(client):
     assert len(data['order_items']) == 1
     assert data['animal']['name'] == 'Bessie'
 
+def test_search_animals_full_text(client):
+    """Test GET /animals?search= uses the full-text index"""
+    response = client.get('/api/animals/?search=holst')
+    assert response.status_code == 200
+    
+    data = json.loads(response.data)
+    assert data['success'] == True
+    assert [a['name'] for a in data['animals']] == ['Bessie']
+
+def test_search_animals_ranked_by_relevance(app, client):
+    """Test that name matches rank above description matches"""
+    with app.app_context():
+        db.session.add(Animal(name='Daisy', type='goat', breed='Alpine', age=10, weight=40,
+                              price=300, description='Friendly, grazes with the merino flock', farmer_id=1))
+        db.session.commit()
+    
+    response = client.get('/api/animals/?search=merino')
+    data = json.loads(response.data)
+    assert [a['name'] for a in data['animals']] == ['Woolly', 'Daisy']
+
+def test_search_index_follows_updates_and_deletes(app, client):
+    """Test that the search index stays in sync with the animals table"""
+    with app.app_context():
+        animal = db.session.get(Animal, 3)
+        animal.breed = 'Berkshire'
+        db.session.commit()
+    
+    assert json.loads(client.get('/api/animals/?search=yorkshire').data)['animals'] == []
+    assert len(json.loads(client.get('/api/animals/?search=berkshire').data)['animals']) == 1
+    
+    with app.app_context():
+        db.session.delete(db.session.get(Animal, 3))
+        db.session.commit()
+    
+    assert json.loads(client.get('/api/animals/?search=berkshire').data)['animals'] == []
+
+def test_animals_keyset_pagination(client):
+    """Test walking the animal listing with cursors"""
+    seen = []
+    url = '/api/animals/?sort=price_asc&per_page=2'
+    while url:
+        data = json.loads(client.get(url).data)
+        seen.extend(a['price'] for a in data['animals'])
+        cursor = data['pagination']['next_cursor']
+        url = f'/api/animals/?sort=price_asc&per_page=2&cursor={cursor}' if cursor else None
+    
+    assert seen == [200, 800, 1500]
+
+def test_pagination_total_is_opt_in(client):
+    """Test that the exact total is only counted on request"""
+    data = json.loads(client.get('/api/animals/').data)
+    assert 'total' not in data['pagination']
+    
+    data = json.loads(client.get('/api/animals/?include_total=true').data)
+    assert data['pagination']['total'] == 3
+
+def test_pagination_rejects_bad_cursor_and_caps_page_size(client):
+    """Test cursor validation and the hard page-size cap"""
+    response = client.get('/api/animals/?cursor=not-a-cursor')
+    assert response.status_code == 400
+    
+    first = json.loads(client.get('/api/animals/?per_page=1').data)
+    response = client.get(f"/api/animals/?sort=price_asc&cursor={first['pagination']['next_cursor']}")
+    assert response.status_code == 400
+    
+    data = json.loads(client.get('/api/animals/?per_page=100000').data)
+    assert data['pagination']['per_page'] == 100
+
+def count_queries(app, url, client):
+    """Return the number of SQL statements issued while serving url"""
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+    
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        assert client.get(url).status_code == 200
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return len(statements)
+
+def test_order_listing_query_count_is_fixed(app, client):
+    """Test that order serialization does not issue a query per order or item"""
+    before = count_queries(app, '/api/orders/', client)
+    
+    with app.app_context():
+        for _ in range(10):
+            order = Order(customer_id=2, total_amount=2500, status='pending')
+            db.session.add(order)
+            db.session.flush()
+            for animal_id, price in ((1, 1500), (2, 200), (3, 800)):
+                db.session.add(OrderItem(order_id=order.id, animal_id=animal_id, quantity=1, price=price))
+        db.session.commit()
+    
+    for url in ('/api/orders/', '/api/orders/users/2/orders', '/api/orders/1'):
+        assert count_queries(app, url, client) <= before + 1
+    assert count_queries(app, '/api/orders/', client) == before
+
+@pytest.fixture
+def farmer_headers(app):
+    with app.app_context():
+        return {'Authorization': f'Bearer {create_access_token(identity="1")}'}
+
+def test_entity_cache_counts_hits_and_misses(client):
+    """Test that detail reads are served from the entity cache"""
+    client.get('/api/animals/1')
+    client.get('/api/animals/1')
+    client.get('/api/orders/1')
+    
+    stats = json.loads(client.get('/api/cache/stats').data)
+    assert stats['kinds']['animal']['misses'] == 1
+    assert stats['kinds']['animal']['hits'] == 1
+    assert stats['kinds']['order']['misses'] == 1
+
+def test_entity_cache_invalidated_by_order_status_change(client, farmer_headers):
+    """Test that confirming an order refreshes the cached order and its animals"""
+    assert json.loads(client.get('/api/animals/1').data)['animal']['is_available'] == True
+    assert json.loads(client.get('/api/orders/1').data)['order']['status'] == 'pending'
+    
+    response = client.patch('/api/orders/1/status', json={'status': 'confirmed'},
+                            headers=farmer_headers)
+    assert response.status_code == 200
+    
+    assert json.loads(client.get('/api/animals/1').data)['animal']['is_available'] == False
+    order = json.loads(client.get('/api/orders/1').data)['order']
+    assert order['status'] == 'confirmed'
+    assert order['items'][0]['animal']['is_available'] == False
+
+def test_entity_cache_dropped_on_delete(client, farmer_headers):
+    """Test that deleting an animal drops its cached payload"""
+    assert client.get('/api/animals/3').status_code == 200
+    assert client.delete('/api/animals/3', headers=farmer_headers).status_code == 200
+    assert client.get('/api/animals/3').status_code == 404
+
+def test_lru_cache_bounds():
+    """Test LRU eviction and TTL expiry"""
+    cache = LRUCache(max_entries=2, ttl=30)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    
+    expired = LRUCache(max_entries=2, ttl=-1)
+    expired.set('a', 1)
+    assert expired.get('a') is None
+
+def test_file_cache_is_shared(tmp_path):
+    """Test that two FileCache instances (two workers) see each other's writes"""
+    path = str(tmp_path / 'cache.sqlite3')
+    worker_a, worker_b = FileCache(path), FileCache(path)
+    worker_a.set('animal:1', {'id': 1})
+    assert worker_b.get('animal:1') == {'id': 1}
+    worker_b.delete('animal:1')
+    assert worker_a.get('animal:1') is None
+
+def test_conditional_get_animal(client, farmer_headers):
+    """Test ETag revalidation on an animal detail"""
+    response = client.get('/api/animals/1')
+    etag = response.headers['ETag']
+    
+    response = client.get('/api/animals/1', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    
+    client.patch('/api/orders/1/status', json={'status': 'confirmed'}, headers=farmer_headers)
+    response = client.get('/api/animals/1', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_conditional_get_order_follows_its_animals(app, client):
+    """Test that an order's ETag changes when an animal it embeds changes"""
+    etag = client.get('/api/orders/1').headers['ETag']
+    assert client.get('/api/orders/1', headers={'If-None-Match': etag}).status_code == 304
+    
+    with app.app_context():
+        db.session.get(Animal, 2).price = 250
+        db.session.commit()
+    
+    assert client.get('/api/orders/1', headers={'If-None-Match': etag}).status_code == 200
+
+def test_conditional_get_listing(app, client):
+    """Test ETag and Last-Modified revalidation on the animal listing"""
+    response = client.get('/api/animals/?type=cow')
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+    
+    assert client.get('/api/animals/?type=cow', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/api/animals/?type=cow', headers={'If-Modified-Since': last_modified}).status_code == 304
+    # A different query string is a different representation
+    assert client.get('/api/animals/?type=pig', headers={'If-None-Match': etag}).status_code == 200
+    
+    with app.app_context():
+        db.session.add(Animal(name='Clover', type='cow', breed='Jersey', age=30, weight=420,
+                              price=1200, farmer_id=1))
+        db.session.commit()
+    
+    assert client.get('/api/animals/?type=cow', headers={'If-None-Match': etag}).status_code == 200
+
+def test_collection_version_bumped_after_commit(app):
+    """Test that writes leave the collection_versions and facet_counts rows alone until they commit"""
+    def version():
+        return db.session.query(CollectionVersion.version).filter_by(name='animals').scalar()
+    
+    before = version()
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+    
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        db.session.get(Animal, 1).price = 1400
+        db.session.flush()
+        assert not [s for s in statements if 'collection_versions' in s or 'facet_counts' in s]
+        db.session.commit()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    assert version() == before + 1
+    
+    # A rolled back write leaves no bump behind
+    db.session.get(Animal, 1).price = 1300
+    db.session.flush()
+    db.session.rollback()
+    db.session.commit()
+    assert version() == before + 1
+
+def test_export_farmer_orders_ndjson(client, farmer_headers):
+    """Test streaming the farmer's orders as NDJSON"""
+    response = client.get('/api/orders/farmer/orders/export', headers=farmer_headers)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    
+    orders = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert len(orders) == 1
+    assert orders[0]['id'] == 1
+    assert [item['animal_name'] for item in orders[0]['items']] == ['Bessie', 'Woolly']
+
+def test_export_farmer_orders_csv_with_filters(client, farmer_headers):
+    """Test CSV export and the status/date filters"""
+    response = client.get('/api/orders/farmer/orders/export?format=csv&status=pending',
+                          headers=farmer_headers)
+    lines = response.data.decode().splitlines()
+    assert lines[0].startswith('order_id,order_created_at')
+    assert len(lines) == 3
+    
+    response = client.get('/api/orders/farmer/orders/export?format=csv&status=confirmed',
+                          headers=farmer_headers)
+    assert len(response.data.decode().splitlines()) == 1
+    
+    response = client.get('/api/orders/farmer/orders/export?since=2000-01-01&until=2000-02-01',
+                          headers=farmer_headers)
+    assert response.data == b''
+    
+    response = client.get('/api/orders/farmer/orders/export?since=yesterday', headers=farmer_headers)
+    assert response.status_code == 400
+
 # ===== TEST FARMER DASHBOARD RESPONSIBILITIES =====
 
+def facet_counts(facets, name):
+    return {entry['value']: entry['count'] for entry in facets[name]}
+
+def test_catalog_facets_from_counters(app, client):
+    """Test that unfiltered facets are read from the counters table"""
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+    
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get('/api/animals/facets')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    
+    assert response.status_code == 200
+    facets = json.loads(response.data)['facets']
+    assert facet_counts(facets, 'type') == {'cow': 1, 'sheep': 1, 'pig': 1}
+    assert facet_counts(facets, 'age') == {'12-24': 2, '24-60': 1}
+    assert facet_counts(facets, 'price') == {'100-500': 1, '500-1000': 1, '1000-5000': 1}
+    assert not [s for s in statements if 'GROUP BY' in s]
+
+def test_catalog_facets_follow_filters(client):
+    """Test that facets=true returns counts for the current filters"""
+    data = json.loads(client.get('/api/animals/?max_price=1000&facets=true').data)
+    assert len(data['animals']) == 2
+    assert facet_counts(data['facets'], 'type') == {'sheep': 1, 'pig': 1}
+    assert facet_counts(data['facets'], 'breed') == {'Merino': 1, 'Yorkshire': 1}
+
+def test_catalog_facet_counters_follow_writes(app, client, farmer_headers):
+    """Test that counters track create, update, delete and order confirmation"""
+    db.session.add(Animal(name='Daisy', type='cow', breed='Jersey', age=70, weight=400,
+                          price=6000, farmer_id=1))
+    db.session.get(Animal, 3).price = 450
+    db.session.commit()
+    client.patch('/api/orders/1/status', headers=farmer_headers, json={'status': 'confirmed'})
+    
+    facets = json.loads(client.get('/api/animals/facets').data)['facets']
+    assert facet_counts(facets, 'type') == {'cow': 1, 'pig': 1}
+    assert facet_counts(facets, 'price') == {'100-500': 1, '5000+': 1}
+    
+    client.delete('/api/animals/3', headers=farmer_headers)
+    expected = json.loads(client.get('/api/animals/facets').data)['facets']
+    assert facet_counts(expected, 'type') == {'cow': 1}
+    
+    # Incremental counters agree with a full recount
+    with db.engine.begin() as connection:
+        rebuild_facet_counts(connection)
+    assert json.loads(client.get('/api/animals/facets').data)['facets'] == expected
+
+# Routes whose queries must be served by an index, never a full table scan
+INDEXED_ROUTES = [
+    '/api/animals/',
+    '/api/animals/?sort=price_asc&min_price=100',
+    '/api/animals/?search=holstein',
+    '/api/animals/1',
+    '/api/animals/farmers/1/animals',
+    '/api/orders/',
+    '/api/orders/?status=pending',
+    '/api/orders/1',
+    '/api/orders/users/2/orders',
+    '/api/orders/1/items',
+    '/api/orders/order_items?animal_id=1',
+    '/api/orders/farmer/orders',
+    '/api/animals/changes',
+    '/api/orders/farmer/orders/export'
+]
+FULL_SCAN = re.compile(r'^SCAN (animals|animal_deletions|orders|order_items|cart_items)( AS \w+)?$')
+
+def test_route_queries_use_indexes(app, client, farmer_headers):
+    """Test with EXPLAIN QUERY PLAN that no route query scans a hot table"""
+    for url in INDEXED_ROUTES:
+        statements = []
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+        
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = client.get(url, headers=farmer_headers)
+            response.get_data()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        assert response.status_code == 200, url
+        
+        with db.engine.connect() as connection:
+            for statement, parameters in statements:
+                if not statement.lstrip().upper().startswith('SELECT'):
+                    continue
+                plan = [row[3] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)]
+                assert not [step for step in plan if FULL_SCAN.match(step)], (url, statement, plan)
+
+def test_migrations_upgrade_existing_database(tmp_path):
+    """Test that migrations add the version column and indexes to an old schema, once"""
+    engine = create_engine(f'sqlite:///{tmp_path}/old.db')
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for table in ('animals', 'orders', 'order_items', 'cart_items'):
+            for index in inspect(connection).get_indexes(table):
+                connection.execute(text(f'DROP INDEX {index["name"]}'))
+        connection.execute(text('ALTER TABLE animals DROP COLUMN version'))
+    
+    # Workers booting together apply each version exactly once
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(run_migrations(engine))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 4
+    assert sorted(version for applied in results for version in applied) == [version for version, _, _ in MIGRATIONS]
+    assert run_migrations(engine) == []
+    
+    inspector = inspect(engine)
+    assert 'version' in {column['name'] for column in inspector.get_columns('animals')}
+    assert 'ix_orders_customer_created' in {index['name'] for index in inspector.get_indexes('orders')}
+    assert 'ix_animals_available_created' in {index['name'] for index in inspector.get_indexes('animals')}
+    engine.dispose()
+
+def test_farmer_orders_table_follows_orders(client, farmer_headers):
+    """Test that farmer_orders is written with the order and follows status changes"""
+    row = FarmerOrder.query.filter_by(farmer_id=1, order_id=1).one()
+    assert row.status == 'pending'
+    
+    client.patch('/api/orders/1/status', json={'status': 'rejected'}, headers=farmer_headers)
+    db.session.expire_all()
+    assert FarmerOrder.query.filter_by(farmer_id=1, order_id=1).one().status == 'rejected'
+    
+    # Another farmer gets no access and no dashboard rows
+    other = {'Authorization': f'Bearer {create_access_token(identity="2", additional_claims={"user_type": "farmer"})}'}
+    assert client.patch('/api/orders/1/status', json={'status': 'confirmed'}, headers=other).status_code == 403
+    assert json.loads(client.get('/api/orders/farmer/orders', headers=other).data)['orders'] == []
+
+def test_backfill_farmer_orders_command(app):
+    """Test that the backfill command rebuilds farmer_orders from the join"""
+    FarmerOrder.query.delete()
+    db.session.commit()
+    
+    result = app.test_cli_runner().invoke(backfill_farmer_orders_command)
+    assert 'farmer_orders rebuilt: 1 rows' in result.output
+    assert [(row.farmer_id, row.order_id) for row in FarmerOrder.query] == [(1, 1)]
+
+def test_order_status_moves_reservation(app, client, farmer_headers):
+    """Test that rejecting releases every animal once, reopening re-claims them and stale orders expire"""
+    other_farmer = User(username='otherfarmer', email='other@test.com', user_type='farmer')
+    other_farmer.set_password('password123')
+    db.session.add(other_farmer)
+    db.session.flush()
+    goat = Animal(name='Billy', type='goat', breed='Boer', age=10, weight=60, price=300, farmer_id=other_farmer.id,
+                  is_available=False)
+    db.session.add(goat)
+    db.session.flush()
+    db.session.add(OrderItem(order_id=1, animal_id=goat.id, quantity=1, price=300))
+    for animal_id in (1, 2):
+        db.session.get(Animal, animal_id).is_available = False  # reserved at checkout
+    db.session.commit()
+    
+    def available():
+        db.session.expire_all()
+        return [db.session.get(Animal, i).is_available for i in (1, 2, goat.id)]
+    
+    # Rejecting releases the whole order, the other farmer's goat included
+    assert client.patch('/api/orders/1/status', json={'status': 'rejected'}, headers=farmer_headers).status_code == 200
+    assert available() == [True, True, True]
+    
+    # Bessie is then ordered by someone else; re-rejecting the old order must not release her
+    second = Order(customer_id=2, total_amount=1500, status='pending', created_at=datetime(2020, 1, 1))
+    db.session.add(second)
+    db.session.flush()
+    db.session.add(OrderItem(order_id=second.id, animal_id=1, quantity=1, price=1500))
+    db.session.get(Animal, 1).is_available = False
+    db.session.commit()
+    assert client.patch('/api/orders/1/status', json={'status': 'rejected'}, headers=farmer_headers).status_code == 200
+    assert available() == [False, True, True]
+    
+    # Nor can the old order be confirmed again: 409 and nothing changes
+    response = client.patch('/api/orders/1/status', json={'status': 'confirmed'}, headers=farmer_headers)
+    assert response.status_code == 409
+    assert json.loads(client.get('/api/orders/1').data)['order']['status'] == 'rejected'
+    assert available() == [False, True, True]
+    
+    # The second order was never acted on: expiring it puts Bessie back on the market
+    result = app.test_cli_runner().invoke(expire_pending_orders_command)
+    assert 'Expired pending orders: 1, animals released: 1' in result.output
+    assert json.loads(client.get(f'/api/orders/{second.id}').data)['order']['status'] == 'rejected'
+    assert FarmerOrder.query.filter_by(order_id=second.id).one().status == 'rejected'
+    assert available() == [True, True, True]
+
+@pytest.mark.skipif(orjson is None, reason='orjson not installed')
+def test_orjson_provider_matches_stdlib(app, client):
+    """Test that the orjson provider produces the same documents as the stdlib one"""
+    assert isinstance(app.json, OrjsonProvider)
+    fast = client.get('/api/orders/').data
+    
+    app.json = DefaultJSONProvider(app)
+    assert json.loads(fast) == json.loads(client.get('/api/orders/').data)
+
+def test_large_responses_are_gzipped(app, client):
+    """Test that bodies over the threshold are compressed and still revalidate"""
+    app.config['COMPRESS_MIN_SIZE'] = 0
+    response = client.get('/api/animals/', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert len(json.loads(gzip.decompress(response.data))['animals']) == 3
+    
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+    response = client.get('/api/animals/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert (response.status_code, response.headers['ETag']) == (304, etag)
+    assert 'Accept-Encoding' in response.headers['Vary']
+    # Without compression both the 200 and the 304 keep the strong validator
+    strong = client.get('/api/animals/').headers['ETag']
+    assert strong == etag[2:]
+    assert client.get('/api/animals/', headers={'If-None-Match': strong}).headers['ETag'] == strong
+
+def test_small_responses_are_not_compressed(client):
+    """Test that bodies under COMPRESS_MIN_SIZE go out uncompressed"""
+    response = client.get('/api/animals/1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+def captured_statements(url, client):
+    """Return (response, SQL statements) for a GET of url"""
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+    
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return response, statements
+
+def test_sparse_fields_prune_output_and_sql(client):
+    """Test that fields= narrows both the payload and the SELECT"""
+    response, statements = captured_statements('/api/orders/?fields=id,status,total_amount', client)
+    orders = json.loads(response.data)['orders']
+    assert orders == [{'id': 1, 'status': 'pending', 'total_amount': 1700}]
+    
+    select = [s for s in statements if 'FROM orders' in s][0]
+    assert 'orders.farmer_notes' not in select
+    assert 'users' not in ' '.join(statements)
+    assert 'order_items' not in ' '.join(statements)
+
+def test_include_loads_only_requested_relations(client):
+    """Test that include= adds relation fields and their eager loads"""
+    response, statements = captured_statements('/api/orders/?fields=id&include=items', client)
+    order = json.loads(response.data)['orders'][0]
+    assert set(order) == {'id', 'items', 'items_count'}
+    assert [item['animal']['name'] for item in order['items']] == ['Bessie', 'Woolly']
+    assert 'FROM users' not in ' '.join(statements)
+    
+    animal = json.loads(client.get('/api/animals/?include=farmer').data)['animals'][0]
+    assert animal['farmer_name'] == 'testfarmer'
+    assert 'description' in animal
+
+def test_summary_view_matches_to_summary_dict(app, client):
+    """Test that view=summary reproduces to_summary_dict()"""
+    orders = json.loads(client.get('/api/orders/?view=summary').data)['orders']
+    assert orders == [db.session.get(Order, 1).to_summary_dict()]
+    animals = json.loads(client.get('/api/animals/?view=summary&sort=price_asc').data)['animals']
+    assert animals[0] == db.session.get(Animal, 2).to_summary_dict()
+
+def test_sparse_fields_on_detail_and_errors(client):
+    """Test detail projection, per-representation ETags and unknown fields"""
+    full = client.get('/api/animals/1')
+    sparse = client.get('/api/animals/1?fields=id,price')
+    assert json.loads(sparse.data)['animal'] == {'id': 1, 'price': 1500}
+    assert sparse.headers['ETag'] != full.headers['ETag']
+    
+    response = client.get('/api/orders/?fields=id,secret')
+    assert response.status_code == 400
+    assert 'secret' in json.loads(response.data)['error']
+    assert client.get('/api/animals/1?include=owner').status_code == 400
+
+def test_animals_batch_single_query(client):
+    """Test that a batch resolves every id with one IN query and marks misses"""
+    response, statements = captured_statements('/api/animals/batch?ids=3,1,42,1', client)
+    data = json.loads(response.data)
+    assert set(data['animals']) == {'3', '1', '42'}
+    assert data['animals']['3']['name'] == 'Porky'
+    assert data['animals']['42'] is None
+    assert data['not_found'] == [42]
+    assert len([s for s in statements if 'FROM animals' in s]) == 1
+    
+    # Now served from the entity cache
+    _, statements = captured_statements('/api/animals/batch?ids=3,1', client)
+    assert statements == []
+
+def test_animals_batch_rejects_bad_ids(app, client):
+    """Test that malformed or oversized id lists are rejected"""
+    assert client.get('/api/animals/batch').status_code == 400
+    assert client.get('/api/animals/batch?ids=1,two').status_code == 400
+    ids = ','.join(str(i) for i in range(app.config['BATCH_MAX_IDS'] + 1))
+    assert client.get(f'/api/animals/batch?ids={ids}').status_code == 400
+    # Repeats count against the limit too, and are then collapsed
+    assert client.get('/api/animals/batch?ids=' + ','.join(['1'] * (app.config['BATCH_MAX_IDS'] + 1))).status_code \
+        == 400
+    assert sorted(json.loads(client.get('/api/animals/batch?ids=3,1,3, ,2').data)['animals']) == ['1', '2', '3']
+
+def test_server_timing_reports_sql(client):
+    """Test that each response carries its SQL count and DB time"""
+    response, statements = captured_statements('/api/orders/1/items', client)
+    timing = response.headers['Server-Timing']
+    assert f'desc="{len(statements)} queries' in timing
+    assert re.search(r'db;dur=\d+\.\d+', timing)
+    assert 'db-slowest;dur=' in timing and 'pool;dur=' in timing and 'app;dur=' in timing
+
+def test_metrics_endpoint_histograms(client):
+    """Test that /metrics exposes per-endpoint histograms in Prometheus text format"""
+    client.get('/api/animals/')
+    client.get('/api/animals/')
+    client.get('/api/orders/1')
+    
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert '# TYPE db_queries_per_request histogram' in body
+    assert 'http_requests_total{endpoint="animals.get_all_animals",status="200"} 2' in body
+    assert 'db_time_seconds_count{endpoint="orders.get_order_by_id"} 1' in body
+    assert 'db_pool_wait_seconds_bucket{endpoint="animals.get_all_animals",le="+Inf"} 2' in body
+    assert 'endpoint="metrics"' not in body
+    assert re.search(r'^db_pool_saturation \d', body, re.M)
+
 def test_farmer_dashboard_requires_auth(client):
     """Test that farmer dashboard endpoints require authentication"""
     response = client.get('/api/orders/farmer/orders')
@@ -208,5 +807,283 @@ def test_many_to_many_relationship(client):
         assert item['animal'] is not None
         assert 'id' in item['animal']
 
+SNAPSHOT_QUERIES = ['', '?type=COW', '?breed=ers', '?min_price=300&max_price=2000', '?min_age=13&max_age=24',
+                    '?sort=price_asc', '?sort=price_desc&include_total=true', '?fields=id,name,price',
+                    '?view=summary&sort=price_asc', '?sort=bogus']
+
+def catalog_pages(app, client, query, snapshot):
+    """Every page of /api/animals/<query> one animal at a time, from the snapshot or SQL"""
+    app.config['CATALOG_SNAPSHOT'] = snapshot
+    pages, cursor = [], None
+    while True:
+        separator = '&' if query else '?'
+        url = f'/api/animals/{query}' + (f'{separator}per_page=1&cursor={cursor}' if cursor else f'{separator}per_page=1')
+        response = client.get(url)
+        pages.append((response.status_code, response.headers.get('ETag'), json.loads(response.data)))
+        cursor = pages[-1][2].get('pagination', {}).get('next_cursor')
+        if not cursor:
+            return pages
+
+@pytest.mark.skipif(np is None, reason='numpy not installed')
+def test_catalog_snapshot_matches_sql_and_refreshes(app, client):
+    """Test that snapshot pages, cursors and ETags match the SQL path, before and after writes"""
+    def assert_same():
+        for query in SNAPSHOT_QUERIES:
+            assert catalog_pages(app, client, query, True) == catalog_pages(app, client, query, False), query
+    
+    assert_same()
+    assert snapshot_store().snapshot.size == 3
+    
+    # An ORM update, a new animal, and a Core update that bypasses updated_at
+    porky = db.session.get(Animal, 3)
+    porky.price = 1600
+    db.session.add(Animal(name='Nanny', type='goat', breed='Boer', age=30, weight=60, price=450, farmer_id=1))
+    db.session.commit()
+    db.session.execute(Animal.__table__.update().where(Animal.id == 2).values(is_available=False))
+    db.session.execute(text("UPDATE collection_versions SET version = version + 1 WHERE name = 'animals'"))
+    db.session.commit()
+    
+    snapshot_store().checked_at = 0
+    assert_same()
+    snapshot = snapshot_store().snapshot
+    assert sorted(snapshot.columns['name']) == ['Bessie', 'Nanny', 'Porky']
+    
+    # Search requests always take the SQL path
+    app.config['CATALOG_SNAPSHOT'] = True
+    snapshot_store().snapshot = None
+    client.get('/api/animals/?search=bessie')
+    assert snapshot_store().snapshot is None
+
+
+def test_query_cache_normalizes_filters_and_follows_generation(app, client, farmer_headers):
+    """Test that equivalent catalog URLs share a cache entry that animal writes and confirmations drop"""
+    first = client.get('/api/animals/?type=Sheep&min_price=100')
+    assert count_queries(app, '/api/animals/?min_price=100.0&type=sheep&per_page=20&sort=newest', client) == 1
+    assert json.loads(first.data)['animals'][0]['name'] == 'Woolly'
+    
+    # A Core update that does not bump the generation is not seen yet
+    db.session.execute(Animal.__table__.update().where(Animal.id == 2).values(name='Dolly'))
+    db.session.commit()
+    assert json.loads(client.get('/api/animals/?type=sheep&min_price=100').data)['animals'][0]['name'] == 'Woolly'
+    
+    # Confirming the order reserves Woolly and advances the generation
+    response = client.patch('/api/orders/1/status', json={'status': 'confirmed'}, headers=farmer_headers)
+    assert response.status_code == 200
+    assert json.loads(client.get('/api/animals/?type=sheep&min_price=100').data)['animals'] == []
+    
+    stats = json.loads(client.get('/api/cache/stats').data)['queries']
+    assert stats['hits'] == 2
+    assert stats['misses'] == 2
+
+def test_query_cache_coalesces_misses_and_serves_stale():
+    """Test that concurrent misses compute once and stale entries are served while one request refreshes"""
+    cache = QueryCache(ttl=0, stale_ttl=60)
+    calls = []
+    
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return len(calls)
+    
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('k', 1, compute)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [1] * 8
+    assert len(calls) == 1
+    
+    # Past its TTL: one request recomputes, the others get the stale value meanwhile
+    refresher = threading.Thread(target=lambda: results.append(cache.get_or_compute('k', 1, compute)))
+    refresher.start()
+    time.sleep(0.05)
+    assert cache.get_or_compute('k', 1, compute) == 1
+    refresher.join()
+    assert results[-1] == 2
+    
+    # A new generation never sees the old entry
+    assert cache.get_or_compute('k', 2, lambda: 'fresh') == 'fresh'
+    stats = cache.stats()
+    assert (stats['misses'], stats['coalesced'], stats['refreshes'], stats['stale_hits']) == (2, 7, 1, 1)
+
+
+def test_farmer_order_events_stream_and_resume(app, client, farmer_headers):
+    """Test that status changes reach the farmer's event stream live and on reconnect"""
+    app.config['ORDER_EVENTS_STREAM_SECONDS'] = 0.2
+    app.config['ORDER_EVENTS_HEARTBEAT'] = 0.05
+    
+    # Live: a subscribed stream receives the change as it is published
+    stream = farmer_event_stream(1)
+    assert next(stream).startswith('retry:')
+    response = client.patch('/api/orders/1/status', json={'status': 'confirmed'}, headers=farmer_headers)
+    assert response.status_code == 200
+    frame = next(stream)
+    assert 'event: order.status_changed' in frame
+    data = json.loads(frame.split('data: ', 1)[1])
+    assert (data['order']['id'], data['order']['status'], data['previous_status']) == (1, 'confirmed', 'pending')
+    first_id = re.search(r'^id: (\S+)', frame, re.M).group(1)
+    stream.close()
+    
+    # Reconnect: events after Last-Event-ID are replayed, the token may ride in the query string
+    client.patch('/api/orders/1/status', json={'status': 'completed'}, headers=farmer_headers)
+    token = farmer_headers['Authorization'].split()[1]
+    response = client.get(f'/api/orders/farmer/events?jwt={token}', headers={'Last-Event-ID': first_id})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    body = response.get_data(as_text=True)
+    assert body.count('event: order.status_changed') == 1
+    assert '"status": "completed"' in body
+    assert ': keep-alive' in body
+    
+    # An id this process cannot replay from asks the client to reload
+    response = client.get('/api/orders/farmer/events', headers={**farmer_headers, 'Last-Event-ID': 'old:5'})
+    assert 'event: reset' in response.get_data(as_text=True)
+    
+    customer = {'Authorization': f'Bearer {create_access_token(identity="2")}'}
+    assert client.get('/api/orders/farmer/events', headers=customer).status_code == 403
+
+def test_farmer_order_events_stream_cap(app, client, farmer_headers):
+    """Test that streams beyond ORDER_EVENTS_MAX_STREAMS get a 503 with Retry-After until one closes"""
+    app.config['ORDER_EVENTS_MAX_STREAMS'] = 1
+    app.config['ORDER_EVENTS_STREAM_SECONDS'] = 0.2
+    app.config['ORDER_EVENTS_HEARTBEAT'] = 0.05
+    
+    stream = farmer_event_stream(1)
+    assert next(stream).startswith('retry:')
+    response = client.get('/api/orders/farmer/events', headers=farmer_headers)
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+    
+    stream.close()
+    response = client.get('/api/orders/farmer/events', headers=farmer_headers)
+    assert response.status_code == 200
+    response.get_data()
+    # A stream that was never read lapses at its deadline instead of holding its slot
+    farmer_event_stream(1)
+    time.sleep(0.3)
+    assert client.get('/api/orders/farmer/events', headers=farmer_headers).status_code == 200
+
+def test_animal_changes_delta_sync(app, client, farmer_headers):
+    """Test that delta sync pages through the catalog, then returns only upserts and tombstones"""
+    app.config['CHANGES_SETTLE_SECONDS'] = 0
+    
+    # Full sync, two animals per page
+    first = json.loads(client.get('/api/animals/changes?per_page=2').data)
+    assert (len(first['animals']), first['tombstones'], first['has_more']) == (2, [], True)
+    second = json.loads(client.get(f'/api/animals/changes?per_page=2&since={first["next_since"]}').data)
+    assert (len(second['animals']), second['has_more']) == (1, False)
+    assert {a['name'] for a in first['animals'] + second['animals']} == {'Bessie', 'Woolly', 'Porky'}
+    since = second['next_since']
+    assert json.loads(client.get(f'/api/animals/changes?since={since}').data)['animals'] == []
+    
+    # An update, a new animal, a sale and a delete
+    db.session.get(Animal, 1).price = 1400
+    db.session.get(Animal, 2).is_available = False
+    db.session.add(Animal(name='Nanny', type='goat', breed='Boer', age=30, weight=60, price=450, farmer_id=1))
+    db.session.commit()
+    assert client.delete('/api/animals/3', headers=farmer_headers).status_code == 200
+    
+    delta = json.loads(client.get(f'/api/animals/changes?since={since}&view=summary').data)
+    assert sorted((a['name'], a['price']) for a in delta['animals']) == [('Bessie', 1400), ('Nanny', 450)]
+    assert sorted((t['id'], t['reason']) for t in delta['tombstones']) == [(2, 'unavailable'), (3, 'deleted')]
+    assert json.loads(client.get(f'/api/animals/changes?since={delta["next_since"]}').data)['tombstones'] == []
+    
+    assert client.get('/api/animals/changes?since=bogus').status_code == 400
+    stale = encode_cursor('changes', [datetime(2000, 1, 1), 0, datetime(2000, 1, 1), 0])
+    assert client.get(f'/api/animals/changes?since={stale}').status_code == 410
+
+def test_bulk_order_status_update(app, client, farmer_headers):
+    """Test that one request confirms and rejects many orders with per-order results and a fixed query count"""
+    db.session.get(Animal, 3).is_available = False  # reserved by a second order
+    order = Order(customer_id=2, total_amount=0, status='pending')
+    db.session.add(order)
+    db.session.flush()
+    db.session.add(OrderItem(order_id=order.id, animal_id=3, quantity=1, price=800))
+    db.session.commit()
+    
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+    
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.patch('/api/orders/status', headers=farmer_headers, json={'orders': [
+            {'order_id': 1, 'status': 'confirmed', 'farmer_notes': 'Ready Friday'},
+            {'order_id': order.id, 'status': 'rejected'},
+            {'order_id': 999, 'status': 'confirmed'},
+            {'order_id': 1, 'status': 'rejected'},
+            {'order_id': 'x', 'status': 'shipped'}
+        ]})
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert (data['updated'], data['failed']) == (2, 3)
+    assert [(r['order_id'], r['ok'], r.get('code')) for r in data['results']] == [
+        (1, True, None), (order.id, True, None), (999, False, 404), (1, False, 400), ('x', False, 400)]
+    assert data['results'][0]['previous_status'] == 'pending'
+    # One UPDATE for the orders and one per availability change, however many orders
+    updates = [s.split()[1] for s in statements if s.lstrip().upper().startswith('UPDATE')]
+    assert (updates.count('orders'), updates.count('animals')) == (1, 2)
+    
+    first = json.loads(client.get('/api/orders/1').data)['order']
+    assert (first['status'], first['farmer_notes'], first['total_amount']) == ('confirmed', 'Ready Friday', 1700)
+    assert [json.loads(client.get(f'/api/animals/{i}').data)['animal']['is_available'] for i in (1, 2, 3)] == \
+        [False, False, True]
+    assert FarmerOrder.query.filter_by(order_id=order.id).one().status == 'rejected'
+    
+    # Facet counters were kept up to date by the set-based UPDATEs
+    expected = json.loads(client.get('/api/animals/facets').data)['facets']
+    assert facet_counts(expected, 'type') == {'pig': 1}
+    with db.engine.begin() as connection:
+        rebuild_facet_counts(connection)
+    assert json.loads(client.get('/api/animals/facets').data)['facets'] == expected
+    
+    other = {'Authorization': f'Bearer {create_access_token(identity="2", additional_claims={"user_type": "farmer"})}'}
+    response = client.patch('/api/orders/status', headers=other,
+                            json={'orders': [{'order_id': 1, 'status': 'completed'}]})
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert (data['updated'], data['results'][0]['code']) == (0, 403)
+    assert client.patch('/api/orders/status', headers=farmer_headers, json={'orders': []}).status_code == 400
+    assert client.patch('/api/orders/status', headers=farmer_headers, json=[{'order_id': 1}]).status_code == 400
+
+def test_bulk_order_status_guards_reservations(client, farmer_headers):
+    """Test that re-rejecting an old order keeps a resold animal sold and reopening it is a per-order 409"""
+    for animal_id in (1, 2):
+        db.session.get(Animal, animal_id).is_available = False  # reserved at checkout
+    db.session.commit()
+    response = client.patch('/api/orders/status', headers=farmer_headers,
+                            json={'orders': [{'order_id': 1, 'status': 'rejected'}]})
+    assert json.loads(response.data)['updated'] == 1
+    
+    # Bessie is resold to a second order
+    second = Order(customer_id=2, total_amount=1500, status='pending')
+    db.session.add(second)
+    db.session.flush()
+    db.session.add(OrderItem(order_id=second.id, animal_id=1, quantity=1, price=1500))
+    db.session.get(Animal, 1).is_available = False
+    db.session.commit()
+    
+    response = client.patch('/api/orders/status', headers=farmer_headers,
+                            json={'orders': [{'order_id': 1, 'status': 'rejected'}]})
+    assert json.loads(response.data)['updated'] == 1
+    db.session.expire_all()
+    assert [db.session.get(Animal, i).is_available for i in (1, 2)] == [False, True]
+    
+    response = client.patch('/api/orders/status', headers=farmer_headers, json={'orders': [
+        {'order_id': 1, 'status': 'confirmed'},
+        {'order_id': second.id, 'status': 'confirmed'}
+    ]})
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert [(r['order_id'], r['ok'], r.get('code')) for r in data['results']] == [
+        (1, False, 409), (second.id, True, None)]
+    db.session.expire_all()
+    assert db.session.get(Order, 1).status == 'rejected'
+    assert [db.session.get(Animal, i).is_available for i in (1, 2)] == [False, True]
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
@@ -0,0 +1,45 @@
+"""
+Batch lookups by id list (?ids=1,2,3) for the animal and order endpoints.
+
+Responses are keyed by id. Every requested id appears in the result, and
+ids that could not be returned map to null and are listed under not_found
+(or forbidden, for orders the caller may not see), so clients never have
+to diff the request against the response.
+"""
+from flask import current_app
+
+
+class BatchError(ValueError):
+    """Raised for a missing, malformed or oversized ids= parameter"""
+
+
+def parse_ids(value):
+    """Parse '3,1,3,2' into [3, 1, 2]: distinct, in request order"""
+    if not value:
+        raise BatchError('ids is required, e.g. ?ids=1,2,3')
+    limit = current_app.config.get('BATCH_MAX_IDS', 200)
+    # Bound the work by the raw list, before any parsing or deduplication
+    parts = [part for part in (part.strip() for part in value.split(',')) if part]
+    if not parts:
+        raise BatchError('ids is required, e.g. ?ids=1,2,3')
+    if len(parts) > limit:
+        raise BatchError(f'Too many ids; at most {limit} per request')
+    ids = []
+    for part in parts:
+        try:
+            ids.append(int(part))
+        except ValueError:
+            raise BatchError(f'Invalid id: {part}')
+    return list(dict.fromkeys(ids))
+
+
+def keyed(payloads, view=None):
+    """{id: payload} -> ({'id': payload or None}, [missing ids]) with ids as JSON keys"""
+    results, missing = {}, []
+    for entity_id, payload in payloads.items():
+        if payload is None:
+            missing.append(entity_id)
+            results[str(entity_id)] = None
+        else:
+            results[str(entity_id)] = view.project(payload) if view else payload
+    return results, missing
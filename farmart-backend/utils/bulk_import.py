@@ -0,0 +1,218 @@
+"""
+Streaming bulk import of animals from CSV or NDJSON uploads.
+
+Rows are parsed and validated one at a time as the upload is read, and
+valid rows are inserted in batches: one executemany per batch on SQLite,
+one COPY per batch on PostgreSQL. A batch the database refuses is retried
+row by row, so only the offending rows are reported. Only the current
+batch and the (capped) error report are held in memory.
+"""
+import csv
+import io
+import json
+import math
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from models import db, Animal, bump_after_commit, facet_deltas_after_commit
+from models.facet_model import animal_facets
+
+FORMATS = ('csv', 'ndjson')
+CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonl': 'ndjson'
+}
+
+REQUIRED_FIELDS = ('name', 'type', 'breed', 'age', 'weight', 'price')
+COPY_COLUMNS = ('name', 'type', 'breed', 'age', 'weight', 'price', 'description', 'image_url',
+                'is_available', 'farmer_id', 'created_at', 'updated_at')
+
+
+def detect_format(requested, content_type, filename=None):
+    """Pick the upload format from ?format=, the file extension or the Content-Type"""
+    if requested:
+        return requested.lower() if requested.lower() in FORMATS else None
+    if filename:
+        extension = filename.rsplit('.', 1)[-1].lower()
+        if extension == 'csv':
+            return 'csv'
+        if extension in ('ndjson', 'jsonl'):
+            return 'ndjson'
+    return CONTENT_TYPES.get((content_type or '').split(';')[0].strip().lower())
+
+
+def _text_lines(stream):
+    first = True
+    for line in stream:
+        yield line.decode('utf-8-sig' if first else 'utf-8', errors='replace')
+        first = False
+
+
+def iter_records(stream, fmt):
+    """
+    Yield (row_number, record, error) for each row of the upload, where
+    record is a dict of raw values or None when the row could not be parsed
+    """
+    lines = _text_lines(stream)
+    if fmt == 'csv':
+        for row_number, record in enumerate(csv.DictReader(lines), start=1):
+            yield row_number, record, None
+        return
+    
+    for row_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield row_number, None, f'Invalid JSON: {e}'
+            continue
+        if not isinstance(record, dict):
+            yield row_number, None, 'Each line must be a JSON object'
+            continue
+        yield row_number, record, None
+
+
+def _number(record, field, minimum, integral=False):
+    value = record.get(field)
+    if isinstance(value, bool):  # JSON true/false are ints to Python
+        raise ValueError(f'{field} must be a number')
+    if not (integral and isinstance(value, int)):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{field} must be a number')
+        if not math.isfinite(value):
+            raise ValueError(f'{field} must be a finite number')
+        if integral:
+            if not value.is_integer():
+                raise ValueError(f'{field} must be a whole number')
+            value = int(value)
+    if value < minimum:
+        raise ValueError(f'{field} must be at least {minimum}')
+    return value
+
+
+def _text(record, field):
+    value = record.get(field) or ''
+    if not isinstance(value, str):
+        raise ValueError(f'{field} must be a string')
+    length = getattr(Animal.__table__.c[field].type, 'length', None)
+    if length and len(value) > length:
+        raise ValueError(f'{field} is too long')
+    return value
+
+
+def validate_record(record, farmer_id, now):
+    """Return the column values for a valid animal row; raise ValueError otherwise"""
+    for field in REQUIRED_FIELDS:
+        if record.get(field) in (None, ''):
+            raise ValueError(f'{field} is required')
+    for field in ('name', 'type', 'breed'):
+        if len(str(record[field])) > Animal.__table__.c[field].type.length:
+            raise ValueError(f'{field} is too long')
+    return {
+        'name': str(record['name']).strip(),
+        'type': str(record['type']).strip(),
+        'breed': str(record['breed']).strip(),
+        'age': _number(record, 'age', 0, integral=True),
+        'weight': _number(record, 'weight', 0),
+        'price': _number(record, 'price', 0),
+        'description': _text(record, 'description'),
+        'image_url': _text(record, 'image_url'),
+        'is_available': True,
+        'farmer_id': farmer_id,
+        'created_at': now,
+        'updated_at': now
+    }
+
+
+def _copy_batch(rows):
+    """Load a batch with PostgreSQL COPY through the session's connection"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[column] for column in COPY_COLUMNS])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY animals ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+    finally:
+        cursor.close()
+
+
+def insert_batch(rows):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        _copy_batch(rows)
+    else:
+        db.session.execute(insert(Animal.__table__), rows)
+    bump_after_commit(db.session, 'animals')
+    facet_deltas_after_commit(db.session, Counter(pair for row in rows for pair in animal_facets(row)))
+    db.session.commit()
+
+
+def import_animals(stream, fmt, farmer_id, batch_size=1000, max_errors=1000):
+    """
+    Import every valid row of the upload for farmer_id and return a report
+    with the inserted count and per-row errors
+    """
+    started = time.perf_counter()
+    batch, batch_rows = [], []
+    inserted = failed = 0
+    errors = []
+    
+    def record_error(row_number, message):
+        nonlocal failed
+        failed += 1
+        if len(errors) < max_errors:
+            errors.append({'row': row_number, 'error': message})
+    
+    def flush():
+        nonlocal inserted
+        try:
+            insert_batch(batch)
+            inserted += len(batch)
+        except Exception:
+            db.session.rollback()
+            # Retry row by row so only the rows the database refuses are reported
+            for row, row_number in zip(batch, batch_rows):
+                try:
+                    insert_batch([row])
+                    inserted += 1
+                except Exception as e:
+                    db.session.rollback()
+                    record_error(row_number, f'Insert failed: {e}')
+        batch.clear()
+        batch_rows.clear()
+    
+    for row_number, record, error in iter_records(stream, fmt):
+        if error:
+            record_error(row_number, error)
+            continue
+        try:
+            batch.append(validate_record(record, farmer_id, datetime.utcnow()))
+            batch_rows.append(row_number)
+        except ValueError as e:
+            record_error(row_number, str(e))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    
+    elapsed = time.perf_counter() - started
+    return {
+        'inserted': inserted,
+        'failed': failed,
+        'errors': errors,
+        'errors_truncated': failed > len(errors),
+        'elapsed_ms': round(elapsed * 1000, 1),
+        'rows_per_second': round((inserted + failed) / elapsed) if elapsed else None
+    }
@@ -0,0 +1,320 @@
+"""
+Entity cache for the Animal, Order and User detail payloads.
+
+Two backends are available, selected with ENTITY_CACHE_BACKEND:
+
+- 'memory': an in-process LRU bounded by entry count and TTL
+- 'file': a SQLite file shared by every worker process on the box
+
+Writes go through: routes that mutate an entity store the fresh payload (or
+drop the stale one) after their commit, together with any cached payloads
+that embed it, such as orders embedding an animal summary.
+
+Misses are filled only from the primary. A replica may still hold a row
+that a write has just invalidated, and caching it would serve the old copy
+to every client, the writer included, until the TTL runs out.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, jsonify
+
+from models import db, Animal, Order, OrderItem, User
+from utils.query_cache import query_cache
+from utils.serialization import load_plan
+
+KINDS = ('animal', 'order', 'user')
+
+
+class LRUCache:
+    """Thread-safe in-process LRU with a per-entry TTL"""
+    
+    def __init__(self, max_entries=10000, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+    
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+    
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def __len__(self):
+        return len(self._data)
+
+
+class FileCache:
+    """
+    Cache stored in a SQLite file so several worker processes on one machine
+    share entries and invalidations. Values are stored as JSON.
+    """
+    
+    PRUNE_EVERY = 256
+    
+    def __init__(self, path, max_entries=10000, ttl=30):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS entity_cache ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+        )
+    
+    def _connection(self):
+        # sqlite3 connections cannot be shared across threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+    
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value, expires_at FROM entity_cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] < time.time():
+            self.delete(key)
+            return None
+        return json.loads(row[0])
+    
+    def set(self, key, value):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO entity_cache (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, json.dumps(value), time.time() + self.ttl)
+        )
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self._prune()
+    
+    def _prune(self):
+        connection = self._connection()
+        connection.execute('DELETE FROM entity_cache WHERE expires_at < ?', (time.time(),))
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            connection.execute(
+                'DELETE FROM entity_cache WHERE key IN '
+                '(SELECT key FROM entity_cache ORDER BY expires_at LIMIT ?)', (excess,)
+            )
+    
+    def delete(self, key):
+        self._connection().execute('DELETE FROM entity_cache WHERE key = ?', (key,))
+    
+    def clear(self):
+        self._connection().execute('DELETE FROM entity_cache')
+    
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM entity_cache').fetchone()[0]
+
+
+class NullCache:
+    """Backend that stores nothing, for ENTITY_CACHE_BACKEND = 'none'"""
+    
+    def get(self, key):
+        return None
+    
+    def set(self, key, value):
+        pass
+    
+    def delete(self, key):
+        pass
+    
+    def clear(self):
+        pass
+    
+    def __len__(self):
+        return 0
+
+
+class EntityCache:
+    """Keys payloads by entity kind and id, and counts hits and misses per kind"""
+    
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._counters = {kind: {'hits': 0, 'misses': 0, 'sets': 0, 'invalidations': 0}
+                          for kind in KINDS}
+    
+    def _count(self, kind, counter, amount=1):
+        with self._lock:
+            self._counters[kind][counter] += amount
+    
+    def get(self, kind, entity_id):
+        value = self.backend.get(f'{kind}:{entity_id}')
+        self._count(kind, 'misses' if value is None else 'hits')
+        return value
+    
+    def peek(self, kind, entity_id):
+        """Look up a payload without touching the hit/miss counters"""
+        return self.backend.get(f'{kind}:{entity_id}')
+    
+    def set(self, kind, entity_id, payload):
+        self.backend.set(f'{kind}:{entity_id}', payload)
+        self._count(kind, 'sets')
+    
+    def invalidate(self, kind, *entity_ids):
+        for entity_id in entity_ids:
+            self.backend.delete(f'{kind}:{entity_id}')
+        self._count(kind, 'invalidations', len(entity_ids))
+    
+    def stats(self):
+        with self._lock:
+            counters = {kind: dict(values) for kind, values in self._counters.items()}
+        for values in counters.values():
+            lookups = values['hits'] + values['misses']
+            values['hit_ratio'] = round(values['hits'] / lookups, 4) if lookups else None
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'kinds': counters
+        }
+
+
+def _load_animal(animal_id):
+    animal = load_plan(Animal.query, 'animal').filter_by(id=animal_id).first()
+    return animal.to_dict() if animal else None
+
+
+def _load_order(order_id):
+    order = load_plan(Order.query, 'order').filter_by(id=order_id).first()
+    return order.to_dict() if order else None
+
+
+def _load_user(user_id):
+    user = db.session.get(User, user_id)
+    return user.to_dict() if user else None
+
+
+LOADERS = {
+    'animal': _load_animal,
+    'order': _load_order,
+    'user': _load_user
+}
+
+
+def _load_many(model, plan):
+    def load(entity_ids):
+        rows = load_plan(model.query, plan).filter(model.id.in_(entity_ids)).all()
+        return {row.id: row.to_dict() for row in rows}
+    return load
+
+
+# One IN query per batch instead of one query per id
+BATCH_LOADERS = {
+    'animal': _load_many(Animal, 'animal'),
+    'order': _load_many(Order, 'order')
+}
+
+
+def create_backend(config, instance_path):
+    backend = config.get('ENTITY_CACHE_BACKEND', 'memory')
+    max_entries = config.get('ENTITY_CACHE_MAX_ENTRIES', 10000)
+    ttl = config.get('ENTITY_CACHE_TTL', 30)
+    if backend == 'memory':
+        return LRUCache(max_entries, ttl)
+    if backend == 'file':
+        path = config.get('ENTITY_CACHE_PATH') or os.path.join(instance_path, 'entity_cache.sqlite3')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return FileCache(path, max_entries, ttl)
+    if backend == 'none':
+        return NullCache()
+    raise ValueError(f'Unknown ENTITY_CACHE_BACKEND: {backend}')
+
+
+def init_cache(app):
+    """Attach an EntityCache to the app and expose its counters"""
+    app.extensions['entity_cache'] = EntityCache(create_backend(app.config, app.instance_path))
+    
+    def cache_stats():
+        return jsonify({**entity_cache().stats(), 'queries': query_cache().stats()}), 200
+    
+    app.add_url_rule('/api/cache/stats', 'cache_stats', cache_stats, methods=['GET'])
+
+
+def entity_cache():
+    return current_app.extensions['entity_cache']
+
+
+def _fills_cache():
+    """Whether loads in this request may be cached: only when they hit the primary"""
+    return db.session.info.get('replica') is None
+
+
+def cached_entity(kind, entity_id):
+    """Return the detail payload for an entity, loading it on a miss"""
+    cache = entity_cache()
+    payload = cache.get(kind, entity_id)
+    if payload is None:
+        payload = LOADERS[kind](entity_id)
+        if payload is not None and _fills_cache():
+            cache.set(kind, entity_id, payload)
+    return payload
+
+
+def cached_entities(kind, entity_ids):
+    """
+    Return {id: payload or None} for many entities, serving what the cache
+    holds and loading every miss with a single query
+    """
+    cache = entity_cache()
+    payloads = {entity_id: cache.get(kind, entity_id) for entity_id in entity_ids}
+    missing = [entity_id for entity_id, payload in payloads.items() if payload is None]
+    if missing:
+        loaded = BATCH_LOADERS[kind](missing)
+        if _fills_cache():
+            for entity_id, payload in loaded.items():
+                cache.set(kind, entity_id, payload)
+        payloads.update(loaded)
+    return payloads
+
+
+def cache_entity(kind, entity_id, payload):
+    """Write-through: store a payload the caller just built after a commit"""
+    entity_cache().set(kind, entity_id, payload)
+
+
+def invalidate_orders(*order_ids):
+    entity_cache().invalidate('order', *order_ids)
+
+
+def invalidate_animals(*animal_ids):
+    """Drop animal payloads and the order payloads that embed them"""
+    if not animal_ids:
+        return
+    entity_cache().invalidate('animal', *animal_ids)
+    order_ids = [row[0] for row in db.session.query(OrderItem.order_id).filter(
+        OrderItem.animal_id.in_(animal_ids)
+    ).distinct()]
+    invalidate_orders(*order_ids)
@@ -0,0 +1,108 @@
+"""
+Delta sync for offline copies of the animal catalog.
+
+GET /api/animals/changes?since=<token> returns what changed after the
+watermark in the token: animals created or updated (upserts), and
+tombstones for animals that were deleted or are no longer available. Both
+come from index range scans, animals on (updated_at, id) and the
+animal_deletions log on (deleted_at, id), merged in time order, so a
+catch-up costs the size of the delta rather than the catalog.
+
+The response's next_since is the watermark to send next time; while
+has_more is true the client keeps calling with it. Without since the first
+call starts from the beginning, which is a full sync.
+
+The watermark is a position in (updated_at, id) order, and updated_at is
+stamped by the app server's clock when the row is flushed, not when it
+commits. A row can therefore become visible with an updated_at behind a
+watermark already handed out: its transaction committed late, another
+server's clock runs behind, or a replica was lagging. To avoid skipping
+such rows, nothing newer than CHANGES_SETTLE_SECONDS is returned until a
+later call. The window must exceed clock skew between app servers plus the
+longest write transaction plus replica lag. The default is 60 seconds, so
+changes reach offline clients up to a minute late.
+Watermarks older than ANIMAL_DELETIONS_RETENTION_DAYS may have lost
+tombstones to pruning; those clients are told to resync from scratch.
+"""
+from datetime import datetime, timedelta
+
+from flask import current_app, request
+from sqlalchemy import tuple_
+
+from models import db, Animal, AnimalDeletion
+from utils.pagination import PaginationError, decode_cursor, encode_cursor
+
+EPOCH = datetime(1970, 1, 1)
+TOKEN_SORT = 'changes'
+
+
+class ResyncRequired(Exception):
+    """The watermark is older than the retained deletion log"""
+
+
+def _tombstone(animal_id, reason, at):
+    return {'id': animal_id, 'reason': reason, 'at': at.isoformat()}
+
+
+def changes_limit():
+    """Changes per response from ?per_page=, capped at CHANGES_MAX_PER_PAGE"""
+    max_per_page = current_app.config.get('CHANGES_MAX_PER_PAGE', 1000)
+    per_page = request.args.get('per_page', current_app.config.get('CHANGES_PER_PAGE', 500), type=int)
+    return max(1, min(per_page, max_per_page))
+
+
+def catalog_changes(view, since=None, limit=500):
+    """
+    {'animals', 'tombstones', 'next_since', 'has_more'} for the changes
+    after the since token. Raises PaginationError for a token we did not
+    issue and ResyncRequired when it is too old.
+    """
+    now = datetime.utcnow()
+    upper = now - timedelta(seconds=current_app.config.get('CHANGES_SETTLE_SECONDS', 60))
+    if since:
+        try:
+            animal_at, animal_id, deleted_at, deletion_id = decode_cursor(TOKEN_SORT, since)
+        except ValueError as e:
+            raise PaginationError('Invalid since token') from e
+        if not isinstance(animal_at, datetime) or not isinstance(deleted_at, datetime):
+            raise PaginationError('Invalid since token')
+        retention = current_app.config.get('ANIMAL_DELETIONS_RETENTION_DAYS', 90)
+        if retention and deleted_at < now - timedelta(days=retention):
+            raise ResyncRequired('since token is older than the retained change log; sync again without it')
+    else:
+        # A fresh client has nothing to delete; start its log position at the settled horizon
+        animal_at, animal_id, deleted_at, deletion_id = EPOCH, 0, upper, 0
+    
+    updated = view.apply(Animal.query).add_columns(Animal.updated_at, Animal.id, Animal.is_available).filter(
+        tuple_(Animal.updated_at, Animal.id) > tuple_(animal_at, animal_id),
+        Animal.updated_at <= upper
+    ).order_by(Animal.updated_at, Animal.id).limit(limit + 1).all()
+    deleted = db.session.query(AnimalDeletion.deleted_at, AnimalDeletion.id, AnimalDeletion.animal_id).filter(
+        tuple_(AnimalDeletion.deleted_at, AnimalDeletion.id) > tuple_(deleted_at, deletion_id),
+        AnimalDeletion.deleted_at <= upper
+    ).order_by(AnimalDeletion.deleted_at, AnimalDeletion.id).limit(limit + 1).all()
+    
+    # One time-ordered stream, so the latest change to an id wins within and across pages
+    merged = [(row.updated_at, 0, row.id, row) for row in updated]
+    merged += [(row.deleted_at, 1, row.id, row) for row in deleted]
+    merged.sort(key=lambda change: change[:3])
+    has_more = len(merged) > limit
+    latest = {}
+    for at, kind, key, row in merged[:limit]:
+        if kind == 0:
+            animal_at, animal_id = at, key
+            latest[key] = ('animal', view.dump(row[0])) if row.is_available else \
+                ('tombstone', _tombstone(key, 'unavailable', at))
+        else:
+            deleted_at, deletion_id = at, key
+            latest[row.animal_id] = ('tombstone', _tombstone(row.animal_id, 'deleted', at))
+    
+    # Everything up to the horizon has been read; later calls start from there
+    if not has_more:
+        deleted_at, deletion_id = max((deleted_at, deletion_id), (upper, 0))
+    return {
+        'animals': [change for kind, change in latest.values() if kind == 'animal'],
+        'tombstones': [change for kind, change in latest.values() if kind == 'tombstone'],
+        'next_since': encode_cursor(TOKEN_SORT, [animal_at, animal_id, deleted_at, deletion_id]),
+        'has_more': has_more
+    }
@@ -0,0 +1,100 @@
+"""
+Cart checkout that cannot oversell an animal.
+
+The cart and its animals are read in one query. Each animal is then claimed
+with a single conditional UPDATE that only matches rows which are still
+available and still at the version that was read, so two checkouts racing
+for the same animal cannot both win: the loser's UPDATE matches fewer rows
+than it needs and the whole checkout rolls back. On PostgreSQL the animal
+rows are also locked with SELECT ... FOR UPDATE, so concurrent checkouts
+queue instead of failing. Order items are written with one bulk INSERT.
+"""
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import and_, insert, or_, update
+from sqlalchemy.orm import contains_eager
+
+from models import (db, Animal, CartItem, Order, OrderItem, bump_after_commit, facet_deltas_after_commit,
+                    sync_farmer_orders)
+from models.facet_model import animal_facets
+
+
+class CheckoutError(Exception):
+    """The cart cannot be checked out; the message is safe to show the customer"""
+
+
+class CheckoutConflict(CheckoutError):
+    """An animal in the cart was claimed or changed by a concurrent request"""
+
+
+def _load_cart(customer_id):
+    query = (
+        CartItem.query.join(CartItem.animal)
+        .options(contains_eager(CartItem.animal))
+        .filter(CartItem.user_id == customer_id)
+        .order_by(CartItem.animal_id)
+    )
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # Rows locked in id order, so concurrent checkouts cannot deadlock
+        query = query.with_for_update(of=Animal)
+    return query.all()
+
+
+def _claim_animals(animals):
+    """Mark animals unavailable if none changed since they were read"""
+    table = Animal.__table__
+    result = db.session.execute(
+        update(table)
+        .where(table.c.is_available.is_(True))
+        .where(or_(*[and_(table.c.id == animal.id, table.c.version == animal.version)
+                     for animal in animals]))
+        .values(is_available=False, version=table.c.version + 1, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(animals):
+        raise CheckoutConflict('One or more animals in your cart were just ordered by someone else')
+
+
+def checkout(customer_id):
+    """
+    Turn the customer's cart into a pending order and reserve its animals.
+    Returns (order_id, animal_ids). The caller commits.
+    """
+    cart_items = _load_cart(customer_id)
+    if not cart_items:
+        raise CheckoutError('Cart is empty')
+    
+    animals = {item.animal_id: item.animal for item in cart_items}
+    for animal in animals.values():
+        if not animal.is_available:
+            raise CheckoutConflict(f'Animal {animal.name} is no longer available')
+    
+    total_amount = sum(item.animal.price * item.quantity for item in cart_items)
+    order = Order(customer_id=customer_id, total_amount=total_amount, status='pending')
+    db.session.add(order)
+    db.session.flush()  # Get order ID
+    
+    _claim_animals(list(animals.values()))
+    
+    db.session.execute(insert(OrderItem.__table__), [
+        {'order_id': order.id, 'animal_id': item.animal_id,
+         'quantity': item.quantity, 'price': item.animal.price}
+        for item in cart_items
+    ])
+    CartItem.query.filter_by(user_id=customer_id).delete(synchronize_session=False)
+    
+    # The claim and item INSERT bypass the ORM listeners
+    connection = db.session.connection()
+    bump_after_commit(db.session, 'animals', 'orders')
+    sync_farmer_orders(connection, [order.id])
+    deltas = Counter()
+    for animal in animals.values():
+        deltas.subtract(animal_facets({'type': animal.type, 'breed': animal.breed,
+                                       'age': animal.age, 'price': animal.price}))
+    facet_deltas_after_commit(db.session, deltas)
+    # Identity-map copies of the claimed animals are now stale
+    for animal in animals.values():
+        db.session.expire(animal)
+    
+    return order.id, list(animals)
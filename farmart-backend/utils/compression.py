@@ -0,0 +1,82 @@
+"""
+Response compression for large JSON, CSV and NDJSON bodies.
+
+Responses at least COMPRESS_MIN_SIZE bytes long are compressed with the
+best encoding the client accepts: brotli when the optional brotli package is
+installed, otherwise gzip. Streamed responses (the order export) are left
+alone, since compressing them here would buffer the whole stream.
+"""
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+COMPRESSIBLE = ('application/json', 'application/x-ndjson', 'text/csv', 'text/plain', 'text/html')
+
+
+# Brotli quality 5 compresses better than gzip level 6 at similar speed
+BROTLI_QUALITY = 5
+
+
+def _encoders(level):
+    encoders = {'gzip': lambda data: gzip.compress(data, compresslevel=level, mtime=0)}
+    if brotli is not None:
+        encoders['br'] = lambda data: brotli.compress(data, quality=BROTLI_QUALITY)
+    return encoders
+
+
+def choose_encoding(accept_encodings, available):
+    """Pick 'br' or 'gzip' from the request's Accept-Encoding, or None"""
+    for encoding in ('br', 'gzip'):
+        if encoding in available and accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def _weaken_etag(response):
+    # The compressed bytes differ from the identity ones, so a strong
+    # validator would be wrong; weak ETags still match If-None-Match
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def init_compression(app):
+    encoders = _encoders(app.config.get('COMPRESS_LEVEL', 6))
+    
+    @app.after_request
+    def compress_response(response):
+        min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+        if response.status_code == 304:
+            # A 304 has no body to measure; send the validator the 200 would
+            # have carried for this Accept-Encoding, so caches see one ETag
+            if choose_encoding(request.accept_encodings, encoders) is not None:
+                response.vary.add('Accept-Encoding')
+                _weaken_etag(response)
+            return response
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code >= 300
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE):
+            return response
+        
+        response.vary.add('Accept-Encoding')
+        if response.content_length is not None and response.content_length < min_size:
+            return response
+        encoding = choose_encoding(request.accept_encodings, encoders)
+        if encoding is None:
+            return response
+        
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(encoders[encoding](data))
+        response.headers['Content-Encoding'] = encoding
+        _weaken_etag(response)
+        return response
+    
+    return compress_response
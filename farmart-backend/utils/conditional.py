@@ -0,0 +1,107 @@
+"""
+Conditional GET support (ETag / Last-Modified / 304 Not Modified).
+
+Detail routes derive a strong ETag from (kind, id, updated_at). Listings
+derive it from the version counters in collection_versions plus the query
+string (and the caller's identity for per-user listings). The validators are
+checked before anything is serialized, and computing them only reads
+updated_at columns, never the full rows.
+"""
+import hashlib
+from datetime import datetime, timezone
+
+from flask import current_app, request
+from sqlalchemy import func
+
+from models import db, Animal, CollectionVersion, Order, OrderItem
+from utils.cache import entity_cache
+
+
+# Query parameters that change a detail response's representation
+VARIANT_ARGS = ('fields', 'include', 'view')
+
+
+def _etag(*parts):
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()[:24]
+
+
+def _as_datetime(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _animal_stamps(animal_id):
+    payload = entity_cache().peek('animal', animal_id)
+    if payload is not None:
+        return [_as_datetime(payload['updated_at'])]
+    updated_at = db.session.query(Animal.updated_at).filter(Animal.id == animal_id).scalar()
+    return [updated_at] if updated_at else None
+
+
+def _order_stamps(order_id):
+    # Order payloads embed animal summaries, so the newest of the order's
+    # animals counts too
+    row = db.session.query(Order.updated_at, func.max(Animal.updated_at)).outerjoin(
+        OrderItem, OrderItem.order_id == Order.id
+    ).outerjoin(Animal, Animal.id == OrderItem.animal_id).filter(
+        Order.id == order_id
+    ).group_by(Order.id).first()
+    return [stamp for stamp in row if stamp] if row else None
+
+
+STAMPS = {
+    'animal': _animal_stamps,
+    'order': _order_stamps
+}
+
+
+def entity_validators(kind, entity_id):
+    """
+    (etag, last_modified) for one entity without loading or serializing it,
+    or None if it does not exist
+    """
+    stamps = STAMPS[kind](entity_id)
+    if not stamps:
+        return None
+    # Each sparse fieldset is its own representation with its own ETag
+    variant = [f'{name}={request.args[name]}' for name in VARIANT_ARGS if request.args.get(name)]
+    etag = _etag(kind, entity_id, *(stamp.isoformat() for stamp in stamps), *variant)
+    return etag, max(stamps)
+
+
+def collection_validators(*names, identity=None, versions=None):
+    """
+    Validators for a listing over the named collections. versions, a list of
+    (name, version, updated_at) sorted by name, replaces the lookup when the
+    listing was served from data captured at known versions.
+    """
+    rows = versions if versions is not None else db.session.query(
+        CollectionVersion.name, CollectionVersion.version, CollectionVersion.updated_at
+    ).filter(CollectionVersion.name.in_(names)).order_by(CollectionVersion.name).all()
+    args = sorted(request.args.items(multi=True))
+    etag = _etag(request.path, identity, args, *(f'{name}={version}' for name, version, _ in rows))
+    last_modified = max((updated_at for _, _, updated_at in rows), default=None)
+    return etag, last_modified
+
+
+def not_modified(etag, last_modified):
+    """Return a 304 response if the request's validators match, else None"""
+    if request.if_none_match:
+        # If-None-Match takes precedence over If-Modified-Since
+        matched = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since is not None and last_modified is not None:
+        matched = last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= request.if_modified_since
+    else:
+        matched = False
+    if not matched:
+        return None
+    return set_validators(current_app.response_class(status=304), etag, last_modified)
+
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+    # Let clients keep the body but revalidate it on every use
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Authorization')
+    return response
@@ -0,0 +1,274 @@
+"""
+Order events for the farmer dashboard, delivered as Server-Sent Events.
+
+Instead of polling GET /api/orders/farmer/orders, a farmer's dashboard keeps
+GET /api/orders/farmer/events open and receives 'order.created' and
+'order.status_changed' events for orders holding the farmer's animals. The
+routes that create orders and change their status publish after their
+commit, on one channel per farmer.
+
+Events go through a broker selected with ORDER_EVENTS_BROKER. 'memory' is an
+in-process pub/sub that keeps the last ORDER_EVENTS_HISTORY events per
+channel; it only connects publishers and subscribers in the same process.
+For several workers, or the two apps deployed apart, set it to the import
+path of a factory taking the app config and returning an object with the
+same publish/subscribe/since methods (Redis pub/sub, PostgreSQL
+LISTEN/NOTIFY...).
+
+Event ids are '<broker epoch>:<sequence>'. A client reconnecting with
+Last-Event-ID gets the events it missed replayed. If the id is from another
+broker epoch (a restart) or older than the retained history, it gets a
+single 'reset' event instead, telling it to reload the dashboard once.
+
+Each open stream holds a server thread for up to ORDER_EVENTS_STREAM_SECONDS,
+a thread of the small a2wsgi pool under ASGI. A process therefore serves
+at most ORDER_EVENTS_MAX_STREAMS at once, well below that pool, so the
+other endpoints keep their threads. Streams beyond the cap get a 503 with
+Retry-After, and EventSource retries on its own.
+"""
+import math
+import itertools
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+from werkzeug.utils import import_string
+
+from models import db, FarmerOrder
+
+
+class Event:
+    __slots__ = ('id', 'seq', 'type', 'data')
+    
+    def __init__(self, event_id, seq, event_type, data):
+        self.id = event_id
+        self.seq = seq
+        self.type = event_type
+        self.data = data
+
+
+class Subscription:
+    """Events published on one channel since subscribing, in order"""
+    
+    def __init__(self, broker, channel, max_queued=1000):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue(max_queued)
+        self.overflowed = False
+    
+    def deliver(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # A reader this far behind reloads instead of stalling publishers
+            self.overflowed = True
+    
+    def get(self, timeout):
+        """The next event, or None if none arrived within timeout seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+    
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class MemoryBroker:
+    """In-process pub/sub with a bounded per-channel history for resuming"""
+    
+    def __init__(self, history=1000):
+        self.epoch = format(time.time_ns(), 'x')
+        self.history = history
+        self._seq = itertools.count(1)
+        self._channels = {}  # channel -> deque of recent events
+        self._floors = {}  # channel -> seq of the newest event evicted from its history
+        self._subscribers = {}  # channel -> set of Subscriptions
+        self._lock = threading.Lock()
+    
+    def publish(self, channel, event_type, data):
+        with self._lock:
+            seq = next(self._seq)
+            event = Event(f'{self.epoch}:{seq}', seq, event_type, data)
+            events = self._channels.setdefault(channel, deque(maxlen=self.history))
+            if len(events) == self.history:
+                self._floors[channel] = events[0].seq
+            events.append(event)
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+        return event
+    
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+    
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+    
+    def since(self, channel, last_event_id):
+        """
+        Events on channel after last_event_id, or None when they cannot all
+        be replayed (unknown epoch, or older than the retained history)
+        """
+        epoch, _, seq = (last_event_id or '').partition(':')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        with self._lock:
+            if seq < self._floors.get(channel, 0):
+                return None
+            events = list(self._channels.get(channel, ()))
+        return [event for event in events if event.seq > seq]
+
+
+def create_broker(config):
+    broker = config.get('ORDER_EVENTS_BROKER', 'memory')
+    if broker == 'memory':
+        return MemoryBroker(config.get('ORDER_EVENTS_HISTORY', 1000))
+    return import_string(broker)(config)
+
+
+def order_events():
+    broker = current_app.extensions.get('order_events')
+    if broker is None:
+        broker = current_app.extensions['order_events'] = create_broker(current_app.config)
+    return broker
+
+
+class StreamLimitReached(Exception):
+    """Raised when this process already serves ORDER_EVENTS_MAX_STREAMS streams"""
+    
+    def __init__(self, retry_after):
+        super().__init__('Too many open event streams; retry later')
+        self.retry_after = retry_after
+
+
+class StreamSlots:
+    """
+    Open streams of this process, by deadline. A slot also lapses once its
+    stream's deadline has passed, so one never closed cannot leak it.
+    """
+    
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._deadlines = {}
+        self._ids = itertools.count(1)
+    
+    def acquire(self, deadline):
+        with self._lock:
+            now = time.monotonic()
+            for slot, until in list(self._deadlines.items()):
+                if until <= now:
+                    del self._deadlines[slot]
+            if len(self._deadlines) >= self.limit:
+                raise StreamLimitReached(max(1, math.ceil(min(self._deadlines.values()) - now)))
+            slot = next(self._ids)
+            self._deadlines[slot] = deadline
+            return slot
+    
+    def release(self, slot):
+        with self._lock:
+            self._deadlines.pop(slot, None)
+
+
+def stream_slots():
+    slots = current_app.extensions.get('order_event_streams')
+    if slots is None:
+        slots = current_app.extensions['order_event_streams'] = StreamSlots(
+            current_app.config.get('ORDER_EVENTS_MAX_STREAMS', 4))
+    return slots
+
+
+def _channel(farmer_id):
+    return f'farmer:{farmer_id}'
+
+
+def publish_order_events(event_type, changes):
+    """
+    Publish one event per (order_payload, extra fields) to every farmer with
+    animals in that order, looking the farmers up with one query; call after commit
+    """
+    if not changes:
+        return
+    farmers = {}
+    for farmer_id, order_id in db.session.query(FarmerOrder.farmer_id, FarmerOrder.order_id).filter(
+            FarmerOrder.order_id.in_([payload['id'] for payload, _ in changes])):
+        farmers.setdefault(order_id, []).append(farmer_id)
+    broker = order_events()
+    for payload, extra in changes:
+        for farmer_id in farmers.get(payload['id'], ()):
+            broker.publish(_channel(farmer_id), event_type, {'order': payload, **extra})
+
+
+def publish_order_event(event_type, order_payload, **extra):
+    """Publish an event about one order to every farmer with animals in it; call after commit"""
+    publish_order_events(event_type, [(order_payload, extra)])
+
+
+def _frame(event_type, data, event_id=None):
+    lines = [f'id: {event_id}'] if event_id else []
+    lines.append(f'event: {event_type}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def farmer_event_stream(farmer_id, last_event_id=None):
+    """
+    SSE frames for one farmer: missed events first (or a reset), then live
+    events as they are published, with comment heartbeats in between. The
+    stream ends after ORDER_EVENTS_STREAM_SECONDS; EventSource reconnects
+    with Last-Event-ID and resumes where it left off. Raises
+    StreamLimitReached when ORDER_EVENTS_MAX_STREAMS are already open.
+    """
+    config = current_app.config
+    heartbeat = config.get('ORDER_EVENTS_HEARTBEAT', 15)
+    deadline = time.monotonic() + config.get('ORDER_EVENTS_STREAM_SECONDS', 300)
+    slots = stream_slots()
+    # The last wait may overrun the deadline by up to one heartbeat
+    slot = slots.acquire(deadline + heartbeat)
+    broker = order_events()
+    channel = _channel(farmer_id)
+    # The stream holds no database connection while it waits
+    db.session.close()
+    
+    def generate():
+        # Subscribe before reading the history so nothing falls in between
+        subscription = broker.subscribe(channel)
+        try:
+            yield f'retry: {config.get("ORDER_EVENTS_RETRY_MS", 3000)}\n\n'
+            last_seq = 0
+            if last_event_id:
+                missed = broker.since(channel, last_event_id)
+                if missed is None:
+                    yield _frame('reset', {'reason': 'Missed events are no longer available; reload'})
+                else:
+                    for event in missed:
+                        last_seq = event.seq
+                        yield _frame(event.type, event.data, event.id)
+            
+            while time.monotonic() < deadline:
+                event = subscription.get(min(heartbeat, max(deadline - time.monotonic(), 0)))
+                if subscription.overflowed:
+                    yield _frame('reset', {'reason': 'Too far behind; reload'})
+                    return
+                if event is None:
+                    yield ': keep-alive\n\n'
+                elif event.seq > last_seq:
+                    yield _frame(event.type, event.data, event.id)
+        finally:
+            subscription.close()
+            slots.release(slot)
+    
+    return generate()
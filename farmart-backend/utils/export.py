@@ -0,0 +1,149 @@
+"""
+Streaming export of a farmer's orders and order items as NDJSON or CSV.
+
+Rows come from one flat SELECT read through a server-side cursor
+(yield_per), are encoded one at a time and flushed to the client in chunks,
+so memory stays constant however long the farmer's order history is.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+
+from models import db, Animal, Order, OrderItem, User
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+CSV_COLUMNS = ('order_id', 'order_created_at', 'order_updated_at', 'status', 'customer_id',
+               'customer_name', 'total_amount', 'farmer_notes', 'item_id', 'animal_id',
+               'animal_name', 'animal_type', 'quantity', 'price', 'subtotal')
+
+YIELD_PER = 1000
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_date(value, field):
+    """Parse an ISO date or datetime query parameter; raise ValueError if bad"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{field} must be an ISO date or datetime')
+
+
+def farmer_export_query(farmer_id, status=None, since=None, until=None):
+    """One row per order item of farmer_id, grouped by order in creation order"""
+    customer = aliased(User)
+    stmt = select(
+        Order.id.label('order_id'),
+        Order.created_at.label('order_created_at'),
+        Order.updated_at.label('order_updated_at'),
+        Order.status,
+        Order.customer_id,
+        customer.username.label('customer_name'),
+        Order.total_amount,
+        Order.farmer_notes,
+        OrderItem.id.label('item_id'),
+        OrderItem.animal_id,
+        Animal.name.label('animal_name'),
+        Animal.type.label('animal_type'),
+        OrderItem.quantity,
+        OrderItem.price
+    ).select_from(OrderItem).join(
+        Order, Order.id == OrderItem.order_id
+    ).join(
+        Animal, Animal.id == OrderItem.animal_id
+    ).outerjoin(
+        customer, customer.id == Order.customer_id
+    ).where(Animal.farmer_id == farmer_id)
+    
+    if status:
+        stmt = stmt.where(Order.status == status)
+    if since:
+        stmt = stmt.where(Order.created_at >= since)
+    if until:
+        stmt = stmt.where(Order.created_at < until)
+    return stmt.order_by(Order.created_at, Order.id, OrderItem.id)
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _stream_rows(stmt):
+    result = db.session.execute(stmt, execution_options={'yield_per': YIELD_PER})
+    try:
+        for row in result:
+            yield row._mapping
+    finally:
+        result.close()
+
+
+def _ndjson_lines(rows):
+    """One JSON object per order, carrying this farmer's items"""
+    current = None
+    for row in rows:
+        if current is None or current['id'] != row['order_id']:
+            if current is not None:
+                yield json.dumps(current) + '\n'
+            current = {
+                'id': row['order_id'],
+                'status': row['status'],
+                'customer_id': row['customer_id'],
+                'customer_name': row['customer_name'],
+                'total_amount': row['total_amount'],
+                'farmer_notes': row['farmer_notes'],
+                'created_at': _iso(row['order_created_at']),
+                'updated_at': _iso(row['order_updated_at']),
+                'items': []
+            }
+        current['items'].append({
+            'id': row['item_id'],
+            'animal_id': row['animal_id'],
+            'animal_name': row['animal_name'],
+            'animal_type': row['animal_type'],
+            'quantity': row['quantity'],
+            'price': row['price'],
+            'subtotal': row['price'] * row['quantity']
+        })
+    if current is not None:
+        yield json.dumps(current) + '\n'
+
+
+def _csv_lines(rows):
+    """One CSV row per order item"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for row in rows:
+        writer.writerow([
+            row['order_id'], _iso(row['order_created_at']), _iso(row['order_updated_at']),
+            row['status'], row['customer_id'], row['customer_name'], row['total_amount'],
+            row['farmer_notes'], row['item_id'], row['animal_id'], row['animal_name'],
+            row['animal_type'], row['quantity'], row['price'], row['price'] * row['quantity']
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_chunks(stmt, fmt, chunk_size=CHUNK_SIZE):
+    """Encode the export and yield it in chunks of roughly chunk_size bytes"""
+    lines = _ndjson_lines(_stream_rows(stmt)) if fmt == 'ndjson' else _csv_lines(_stream_rows(stmt))
+    chunk, size = [], 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield ''.join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield ''.join(chunk)
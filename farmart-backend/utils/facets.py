@@ -0,0 +1,58 @@
+"""
+Facet counts (type, breed, age bucket, price bucket) for the animal catalog.
+
+The unfiltered counts are read straight from facet_counts, which the models
+keep current on every write, so the common storefront request is a single
+small SELECT. Filtered counts fall back to one GROUP BY per facet over the
+filtered query.
+"""
+from sqlalchemy import func
+
+from models import Animal, FacetCount
+from models.facet_model import AGE_BUCKETS, FACETS, PRICE_BUCKETS, bucket_expression
+
+_BUCKET_ORDER = {
+    'age': [label for label, _, _ in AGE_BUCKETS],
+    'price': [label for label, _, _ in PRICE_BUCKETS]
+}
+
+
+def _facet_columns():
+    return {
+        'type': Animal.type,
+        'breed': Animal.breed,
+        'age': bucket_expression(AGE_BUCKETS, Animal.age),
+        'price': bucket_expression(PRICE_BUCKETS, Animal.price)
+    }
+
+
+def _as_facets(rows):
+    """[(facet, value, count)] -> {facet: [{'value', 'count'}]}, buckets in range order"""
+    facets = {facet: [] for facet in FACETS}
+    for facet, value, count in rows:
+        if value is not None and count > 0:
+            facets[facet].append({'value': value, 'count': count})
+    for facet, values in facets.items():
+        if facet in _BUCKET_ORDER:
+            values.sort(key=lambda entry: _BUCKET_ORDER[facet].index(entry['value']))
+        else:
+            values.sort(key=lambda entry: (-entry['count'], entry['value']))
+    return facets
+
+
+def catalog_facets(query=None):
+    """
+    Counts for every facet over the available animals matched by query, or
+    over the whole catalog from the counters table when query is None
+    """
+    if query is None:
+        return _as_facets(FacetCount.query.with_entities(
+            FacetCount.facet, FacetCount.value, FacetCount.count
+        ).all())
+    
+    rows = []
+    query = query.order_by(None)
+    for facet, column in _facet_columns().items():
+        grouped = query.with_entities(column, func.count(Animal.id)).group_by(column)
+        rows.extend((facet, value, count) for value, count in grouped)
+    return _as_facets(rows)
@@ -0,0 +1,159 @@
+"""
+Sparse fieldsets for animal and order responses.
+
+?fields=id,status,total_amount picks output fields, ?include=items,customer
+adds relation-backed fields, and ?view=summary selects a preset. Only the
+columns behind the chosen fields are loaded (load_only) and only the
+relationships they need are eager-loaded, so a narrow list view costs a
+narrow SELECT. Without any of these parameters routes serialize with the
+model's to_dict() and load plan exactly as before.
+"""
+from collections import namedtuple
+
+from flask import request
+from sqlalchemy.orm import joinedload, load_only, selectinload
+
+from models import Animal, Order, OrderItem
+from utils.serialization import load_plan
+
+# columns: mapped attributes the getter reads; loader: key into LOADERS or None
+Field = namedtuple('Field', 'name columns loader getter')
+
+
+class FieldsetError(ValueError):
+    """Raised for unknown fields, includes or views"""
+
+
+def _column(name):
+    return Field(name, (name,), None, lambda obj: getattr(obj, name))
+
+
+def _timestamp(name):
+    return Field(name, (name,), None, lambda obj: getattr(obj, name).isoformat())
+
+
+ANIMAL_FIELDS = (
+    _column('id'), _column('name'), _column('type'), _column('breed'), _column('age'),
+    _column('weight'), _column('price'), _column('min_price'), _column('description'),
+    _column('image_url'), _column('is_available'), _column('farmer_id'),
+    Field('farmer_name', ('farmer_id',), 'farmer',
+          lambda animal: animal.farmer.username if animal.farmer else None),
+    _timestamp('created_at'), _timestamp('updated_at')
+)
+
+ORDER_FIELDS = (
+    _column('id'), _column('customer_id'),
+    Field('customer_name', ('customer_id',), 'customer',
+          lambda order: order.customer.username if order.customer else None),
+    Field('customer_email', ('customer_id',), 'customer',
+          lambda order: order.customer.email if order.customer else None),
+    _column('status'), _column('total_amount'), _column('farmer_notes'),
+    _timestamp('created_at'), _timestamp('updated_at'),
+    Field('items', (), 'items', lambda order: [item.to_dict() for item in order.order_items]),
+    Field('items_count', (), 'order_items', lambda order: len(order.order_items))
+)
+
+# Built lazily, like LOAD_PLANS, because backrefs exist only once mappers are configured
+LOADERS = {
+    'farmer': lambda: joinedload(Animal.farmer),
+    'customer': lambda: joinedload(Order.customer),
+    'order_items': lambda: selectinload(Order.order_items),
+    'items': lambda: selectinload(Order.order_items).joinedload(OrderItem.animal)
+}
+
+FIELDSETS = {
+    'animal': {
+        'model': Animal,
+        'fields': ANIMAL_FIELDS,
+        'includes': {'farmer': ('farmer_name',)},
+        # to_summary_dict()
+        'views': {'summary': ('id', 'name', 'type', 'breed', 'price', 'is_available', 'farmer_id')}
+    },
+    'order': {
+        'model': Order,
+        'fields': ORDER_FIELDS,
+        'includes': {'customer': ('customer_name', 'customer_email'), 'items': ('items', 'items_count')},
+        # to_summary_dict()
+        'views': {'summary': ('id', 'customer_id', 'customer_name', 'status', 'total_amount',
+                              'items_count', 'created_at')}
+    }
+}
+
+
+def _split(value):
+    return [part.strip() for part in value.split(',') if part.strip()] if value else []
+
+
+class FieldView:
+    """The fields one request asked for, for one kind of entity"""
+    
+    def __init__(self, kind, names=None):
+        spec = FIELDSETS[kind]
+        self.kind = kind
+        self.model = spec['model']
+        by_name = {field.name: field for field in spec['fields']}
+        # None means the full to_dict() output
+        self.fields = [by_name[name] for name in names] if names is not None else None
+    
+    @property
+    def names(self):
+        return [field.name for field in self.fields] if self.fields is not None else None
+    
+    def apply(self, query):
+        """Restrict the query to the needed columns and eager loads"""
+        if self.fields is None:
+            return load_plan(query, self.kind)
+        columns = {'id'}
+        loaders = []
+        for field in self.fields:
+            columns.update(field.columns)
+            if field.loader and field.loader not in loaders:
+                loaders.append(field.loader)
+        options = [load_only(*(getattr(self.model, name) for name in sorted(columns)), raiseload=True)]
+        options += [LOADERS[loader]() for loader in loaders]
+        return query.options(*options)
+    
+    def dump(self, obj):
+        if self.fields is None:
+            return obj.to_dict()
+        return {field.name: field.getter(obj) for field in self.fields}
+    
+    def project(self, payload):
+        """Prune an already serialized to_dict() payload, e.g. from the entity cache"""
+        if self.fields is None:
+            return payload
+        return {field.name: payload[field.name] for field in self.fields}
+
+
+def field_view(kind, args=None):
+    """Build the FieldView for the fields=, include= and view= query parameters"""
+    args = request.args if args is None else args
+    spec = FIELDSETS[kind]
+    fields, includes, view = _split(args.get('fields')), _split(args.get('include')), args.get('view')
+    if not fields and not includes and not view:
+        return FieldView(kind)
+    
+    known = [field.name for field in spec['fields']]
+    unknown = [name for name in fields if name not in known]
+    if unknown:
+        raise FieldsetError(f'Unknown fields: {", ".join(unknown)}. Must be among: {", ".join(known)}')
+    unknown = [name for name in includes if name not in spec['includes']]
+    if unknown:
+        raise FieldsetError(f'Unknown include: {", ".join(unknown)}. Must be among: {", ".join(spec["includes"])}')
+    if view and view not in spec['views'] and view != 'full':
+        raise FieldsetError(f'Unknown view. Must be one of: full, {", ".join(spec["views"])}')
+    
+    if view == 'full':
+        return FieldView(kind)
+    
+    if view:
+        selected = set(spec['views'][view])
+    elif fields:
+        selected = set(fields)
+    else:
+        # include= alone: every plain column plus the included relations
+        relation_fields = {name for names in spec['includes'].values() for name in names}
+        selected = set(known) - relation_fields
+    selected.update(name for include in includes for name in spec['includes'][include])
+    # Keep the to_dict() key order
+    return FieldView(kind, [name for name in known if name in selected])
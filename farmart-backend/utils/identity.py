@@ -0,0 +1,56 @@
+"""
+Request-scoped identity for JWT-protected routes.
+
+Access tokens carry the user's role as a 'user_type' claim, so role checks
+read the already-decoded token instead of SELECTing the user. Tokens issued
+before the claim existed fall back to a short-TTL identity cache, and the
+full User row is only loaded when a handler asks for it, at most once per
+request.
+"""
+from flask import current_app, g
+from flask_jwt_extended import get_jwt, get_jwt_identity
+
+from models import db, User
+from utils.cache import LRUCache
+
+
+def identity_claims(user):
+    """Additional claims embedded in every token issued for user"""
+    return {'user_type': user.user_type}
+
+
+def identity_cache():
+    cache = current_app.extensions.get('identity_cache')
+    if cache is None:
+        cache = current_app.extensions['identity_cache'] = LRUCache(
+            max_entries=current_app.config.get('IDENTITY_CACHE_MAX_ENTRIES', 10000),
+            ttl=current_app.config.get('IDENTITY_CACHE_TTL', 60)
+        )
+    return cache
+
+
+def current_identity():
+    """The authenticated user's id as an int"""
+    return int(get_jwt_identity())
+
+
+def current_user_type():
+    """The authenticated user's role, without a database round trip when possible"""
+    user_type = get_jwt().get('user_type')
+    if user_type:
+        return user_type
+    
+    user_id = current_identity()
+    user_type = identity_cache().get(user_id)
+    if user_type is None:
+        user_type = db.session.query(User.user_type).filter(User.id == user_id).scalar()
+        if user_type is not None:
+            identity_cache().set(user_id, user_type)
+    return user_type
+
+
+def current_user():
+    """The authenticated User row, loaded lazily and once per request"""
+    if 'current_user' not in g:
+        g.current_user = db.session.get(User, current_identity())
+    return g.current_user
@@ -0,0 +1,61 @@
+"""
+Fast JSON encoding for responses.
+
+OrjsonProvider is a drop-in replacement for Flask's default JSON provider
+that encodes with orjson, which serializes dicts, lists and datetimes in C.
+orjson is optional: init_json() keeps Flask's stdlib provider when it is not
+installed or when JSON_PROVIDER is 'stdlib'.
+
+orjson writes naive datetimes the same way datetime.isoformat() does, so
+payloads are byte-for-byte compatible with the to_dict() output whether a
+route passes datetimes or pre-formatted strings.
+"""
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson"""
+    
+    def _options(self, indent=False):
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+    
+    def _dumps_bytes(self, obj, indent=False):
+        # default() handles what orjson does not: Decimal, date-likes with __html__, ...
+        return orjson.dumps(obj, default=self.default, option=self._options(indent))
+    
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # Callers asking for stdlib-only options (cls=, separators=, ...)
+            return super().dumps(obj, **kwargs)
+        return self._dumps_bytes(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        body = self._dumps_bytes(obj, indent=indent)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+
+def init_json(app):
+    """Install the fastest available JSON provider (config JSON_PROVIDER: auto, orjson, stdlib)"""
+    choice = app.config.get('JSON_PROVIDER', 'auto')
+    if choice == 'orjson' and orjson is None:
+        raise RuntimeError("JSON_PROVIDER is 'orjson' but orjson is not installed")
+    if choice in ('auto', 'orjson') and orjson is not None:
+        app.json = OrjsonProvider(app)
+    return app.json
@@ -0,0 +1,245 @@
+"""
+Per-request SQL instrumentation, the Server-Timing header and /metrics.
+
+Engine events time every statement the request issues; an ORM load event
+counts the rows materialized into objects (SELECT cursors report no row
+count, so rows returned means entities loaded plus rows touched by DML).
+Connection-pool checkout is timed by wrapping the pool's _do_get, and the
+pool's occupancy is sampled at each scrape.
+
+Each request gets a Server-Timing header, e.g.
+
+    Server-Timing: db;dur=3.41;desc="4 queries, 12 rows", db-slowest;dur=1.92, pool;dur=0.02, app;dur=9.87
+
+and its figures are folded into per-endpoint Prometheus histograms served
+as text at /metrics. Recording a statement costs two perf_counter() calls
+and a few additions, so it is meant to stay on in production. Metrics are
+per process: scrape each worker, or aggregate upstream.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+
+from models import db
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+ROW_BUCKETS = (1, 10, 100, 1000, 10000, 100000)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'slowest', 'rows', 'pool_wait', 'started')
+    
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest = 0.0
+        self.rows = 0
+        self.pool_wait = 0.0
+        self.started = time.perf_counter()
+    
+    def server_timing(self, total):
+        return (f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries, {self.rows} rows", '
+                f'db-slowest;dur={self.slowest * 1000:.2f}, '
+                f'pool;dur={self.pool_wait * 1000:.2f}, '
+                f'app;dur={total * 1000:.2f}')
+
+
+def request_stats():
+    """The current request's RequestStats, or None outside a request"""
+    if not has_request_context():
+        return None
+    return g.get('_sql_stats')
+
+
+class Histogram:
+    """Prometheus histogram with one series per label value"""
+    
+    def __init__(self, name, help_text, buckets, label='endpoint'):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label = label
+        self._series = defaultdict(lambda: [[0] * (len(buckets) + 1), 0.0])
+        self._lock = threading.Lock()
+    
+    def observe(self, label_value, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series[label_value]
+            series[0][index] += 1
+            series[1] += value
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        for label_value, (counts, total) in sorted(series.items()):
+            labels = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = defaultdict(int)
+        self._lock = threading.Lock()
+    
+    def inc(self, *label_values):
+        with self._lock:
+            self._values[label_values] += 1
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            labels = ','.join(f'{name}="{v}"' for name, v in zip(self.labels, label_values))
+            lines.append(f'{self.name}_total{{{labels}}} {value}')
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        self.requests = Counter('http_requests', 'Requests served', ('endpoint', 'status'))
+        self.duration = Histogram('http_request_duration_seconds', 'Request wall time', DURATION_BUCKETS)
+        self.queries = Histogram('db_queries_per_request', 'SQL statements per request', COUNT_BUCKETS)
+        self.db_time = Histogram('db_time_seconds', 'Time spent executing SQL per request', DURATION_BUCKETS)
+        self.slowest = Histogram('db_slowest_query_seconds', 'Slowest statement per request', DURATION_BUCKETS)
+        self.rows = Histogram('db_rows_per_request', 'Rows loaded or modified per request', ROW_BUCKETS)
+        self.pool_wait = Histogram('db_pool_wait_seconds', 'Connection pool checkout wait per request',
+                                   DURATION_BUCKETS)
+    
+    def record(self, endpoint, status, stats, total):
+        self.requests.inc(endpoint, str(status))
+        self.duration.observe(endpoint, total)
+        self.queries.observe(endpoint, stats.queries)
+        self.db_time.observe(endpoint, stats.db_time)
+        self.slowest.observe(endpoint, stats.slowest)
+        self.rows.observe(endpoint, stats.rows)
+        self.pool_wait.observe(endpoint, stats.pool_wait)
+    
+    def render(self, pool):
+        lines = []
+        for metric in (self.requests, self.duration, self.queries, self.db_time, self.slowest,
+                       self.rows, self.pool_wait):
+            lines.extend(metric.render())
+        lines.extend(_pool_gauges(pool))
+        return '\n'.join(lines) + '\n'
+
+
+def _pool_gauges(pool):
+    if not hasattr(pool, 'checkedout') or not hasattr(pool, 'size'):
+        return []  # SingletonThreadPool / StaticPool have no capacity to saturate
+    checked_out = pool.checkedout()
+    capacity = pool.size() + max(getattr(pool, '_max_overflow', 0), 0)
+    gauges = [
+        ('db_pool_checked_out', 'Connections currently checked out', checked_out),
+        ('db_pool_capacity', 'Pool size plus max overflow', capacity),
+        ('db_pool_saturation', 'Checked out connections / capacity',
+         round(checked_out / capacity, 4) if capacity else 0)
+    ]
+    lines = []
+    for name, help_text, value in gauges:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+    return lines
+
+
+def _time_pool_checkout(pool):
+    """Wrap pool._do_get once so checkout waits are charged to the request"""
+    if getattr(pool, '_metrics_timed', False) or not hasattr(pool, '_do_get'):
+        return
+    do_get = pool._do_get
+    
+    def timed_do_get():
+        started = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            stats = request_stats()
+            if stats is not None:
+                stats.pool_wait += time.perf_counter() - started
+    
+    pool._do_get = timed_do_get
+    pool._metrics_timed = True
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = request_stats()
+    if stats is None:
+        return
+    elapsed = time.perf_counter() - context._metrics_started
+    stats.queries += 1
+    stats.db_time += elapsed
+    if elapsed > stats.slowest:
+        stats.slowest = elapsed
+    if (context.isinsert or context.isupdate or context.isdelete) and cursor.rowcount > 0:
+        stats.rows += cursor.rowcount
+
+
+def _on_load(target, context):
+    stats = request_stats()
+    if stats is not None:
+        stats.rows += 1
+
+
+def instrument_engine(engine):
+    """Charge the statements engine runs to the current request"""
+    if not event.contains(engine, 'after_cursor_execute', _after_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def init_metrics(app):
+    """Hook SQL timing into the app's engine and expose /metrics"""
+    if not app.config.get('METRICS_ENABLED', True):
+        return None
+    
+    metrics = app.extensions['metrics'] = Metrics()
+    with app.app_context():
+        engine = db.engine
+    instrument_engine(engine)
+    if not event.contains(db.Model, 'load', _on_load):
+        event.listen(db.Model, 'load', _on_load, propagate=True)
+    
+    @app.before_request
+    def start_sql_stats():
+        # Re-wrap after engine.dispose() replaced the pool
+        _time_pool_checkout(engine.pool)
+        g._sql_stats = RequestStats()
+    
+    @app.after_request
+    def report_sql_stats(response):
+        stats = request_stats()
+        if stats is None:
+            return response
+        total = time.perf_counter() - stats.started
+        if app.config.get('SERVER_TIMING', True):
+            response.headers['Server-Timing'] = stats.server_timing(total)
+        if request.endpoint != 'metrics':
+            metrics.record(request.endpoint or 'unmatched', response.status_code, stats, total)
+        return response
+    
+    def metrics_endpoint():
+        return Response(metrics.render(engine.pool), mimetype='text/plain; version=0.0.4')
+    
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint, methods=['GET'])
+    return metrics
@@ -0,0 +1,167 @@
+"""
+Versioned schema migrations.
+
+db.create_all() creates missing tables but never changes existing ones, so
+columns and indexes added to the models after a database was created need a
+migration. Each migration has a version number and runs once, in order, in
+its own transaction; applied versions are recorded in schema_migrations.
+Migrations must be idempotent: on a fresh database create_all() has already
+built the current schema and they run as no-ops. A migration spells out the
+indexes it creates instead of reading them off the models, so what a
+version does never changes after it ships.
+
+Every worker runs the migrations as it boots. Each migration takes a lock
+first (an advisory lock on PostgreSQL, BEGIN IMMEDIATE on SQLite) and
+re-reads the applied versions under it, so workers starting together apply
+each version once and the others wait, then skip it.
+"""
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, delete, inspect, select, text
+
+from models import db, AnimalDeletion, sync_farmer_orders
+from utils.reservations import expire_pending_orders_command
+
+_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+# Key for pg_advisory_xact_lock, shared by every process migrating this database
+MIGRATION_LOCK_ID = 0x6661726D
+
+
+def _index(table, name, *columns, **kwargs):
+    """An index as a migration created it, independent of the current models"""
+    stub = Table(table, MetaData(), *(Column(column, Integer) for column in columns))
+    return Index(name, *(stub.c[column] for column in columns), **kwargs)
+
+
+_AVAILABLE = {'sqlite_where': text('is_available = 1'), 'postgresql_where': text('is_available')}
+HOT_FILTER_INDEXES = [
+    _index('animals', 'ix_animals_available_created', 'created_at', 'id', **_AVAILABLE),
+    _index('animals', 'ix_animals_available_price', 'price', 'id', **_AVAILABLE),
+    _index('animals', 'ix_animals_available_type_price', 'type', 'price', **_AVAILABLE),
+    _index('animals', 'ix_animals_farmer_created', 'farmer_id', 'created_at', 'id'),
+    _index('orders', 'ix_orders_created', 'created_at', 'id'),
+    _index('orders', 'ix_orders_customer_created', 'customer_id', 'created_at', 'id'),
+    _index('orders', 'ix_orders_status_created', 'status', 'created_at', 'id'),
+    _index('order_items', 'ix_order_items_order_id', 'order_id'),
+    _index('order_items', 'ix_order_items_animal_order', 'animal_id', 'order_id'),
+    _index('cart_items', 'ix_cart_items_user_animal', 'user_id', 'animal_id'),
+]
+DELTA_SYNC_INDEXES = [
+    _index('animals', 'ix_animals_updated', 'updated_at', 'id'),
+]
+
+
+def _add_animal_version(connection):
+    columns = {column['name'] for column in inspect(connection).get_columns('animals')}
+    if 'version' not in columns:
+        connection.execute(text('ALTER TABLE animals ADD COLUMN version INTEGER NOT NULL DEFAULT 1'))
+
+
+def _hot_filter_indexes(connection):
+    for index in HOT_FILTER_INDEXES:
+        index.create(connection, checkfirst=True)
+
+
+def _backfill_farmer_orders(connection):
+    sync_farmer_orders(connection)
+
+
+def _delta_sync_index(connection):
+    # The animal_deletions table itself is new, so create_all() builds it
+    for index in DELTA_SYNC_INDEXES:
+        index.create(connection, checkfirst=True)
+
+
+MIGRATIONS = [
+    (1, 'animal_version_column', _add_animal_version),
+    (2, 'hot_filter_indexes', _hot_filter_indexes),
+    (3, 'farmer_orders_backfill', _backfill_farmer_orders),
+    (4, 'delta_sync_index', _delta_sync_index),
+]
+
+
+def applied_versions(connection):
+    if not inspect(connection).has_table(schema_migrations.name):
+        return set()
+    return set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+
+def _lock(connection):
+    """Hold the migration lock until this transaction ends"""
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': MIGRATION_LOCK_ID})
+    elif connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def run_migrations(engine=None):
+    """
+    Apply every pending migration and return the versions applied. Must be
+    called inside an app context after db.create_all().
+    """
+    engine = engine or db.engine
+    with engine.connect() as connection:
+        done = applied_versions(connection)
+    
+    applied = []
+    for version, name, migrate in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as connection:
+            _lock(connection)
+            # Another worker may have applied it while we waited for the lock
+            _metadata.create_all(connection)
+            if version in applied_versions(connection):
+                continue
+            migrate(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=version, name=name, applied_at=datetime.utcnow()
+            ))
+        applied.append(version)
+    return applied
+
+
+@click.command('migrate')
+@with_appcontext
+def migrate_command():
+    """Apply pending schema migrations."""
+    applied = run_migrations()
+    click.echo(f'Applied migrations: {applied}' if applied else 'Schema is up to date')
+
+
+@click.command('backfill-farmer-orders')
+@with_appcontext
+def backfill_farmer_orders_command():
+    """Rebuild the farmer_orders table from orders, order items and animals."""
+    with db.engine.begin() as connection:
+        sync_farmer_orders(connection)
+        count = connection.execute(text('SELECT COUNT(*) FROM farmer_orders')).scalar()
+    click.echo(f'farmer_orders rebuilt: {count} rows')
+
+
+@click.command('prune-animal-deletions')
+@with_appcontext
+def prune_animal_deletions_command():
+    """Drop animal tombstones older than ANIMAL_DELETIONS_RETENTION_DAYS."""
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config.get('ANIMAL_DELETIONS_RETENTION_DAYS', 90))
+    table = AnimalDeletion.__table__
+    with db.engine.begin() as connection:
+        pruned = connection.execute(delete(table).where(table.c.deleted_at < cutoff)).rowcount
+    click.echo(f'animal_deletions pruned: {pruned} rows')
+
+
+def init_commands(app):
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(backfill_farmer_orders_command)
+    app.cli.add_command(prune_animal_deletions_command)
+    app.cli.add_command(expire_pending_orders_command)
@@ -0,0 +1,129 @@
+"""
+Bulk order status transitions for the farmer dashboard.
+
+A farmer confirming a morning's orders sends them in one request instead of
+one PATCH each. Ownership and existence of every order are checked with a
+single query, then the valid entries are applied with set-based UPDATEs in
+the caller's transaction:
+
+- orders: status, farmer_notes and the recomputed total_amount, one CASE
+  expression keyed by order id
+- animals: moved with each order's reservation by utils.reservations, from
+  its previous status: rejecting releases all of the order's animals, and
+  reopening a rejected order claims them back, one UPDATE per kind of move
+
+Because these statements bypass the ORM, the collection versions, facet
+counters and farmer_orders rows are maintained here, as checkout does.
+Entries that fail validation or access checks, and rejected orders that
+cannot be reopened because another order holds their animals, are reported
+per order and do not stop the others.
+"""
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import and_, case, func, select, update
+
+from models import db, FarmerOrder, Order, OrderItem, bump_after_commit, sync_farmer_orders
+from utils.reservations import claim_conflicts, move_reservations, reservation_action
+
+ORDER_STATUSES = ('pending', 'confirmed', 'rejected', 'completed')
+
+
+class BulkStatusError(ValueError):
+    """Raised for a missing, malformed or oversized orders list"""
+
+
+def _failure(order_id, code, error):
+    return {'order_id': order_id, 'ok': False, 'code': code, 'error': error}
+
+
+def _entry_error(entry, seen):
+    """Why one {order_id, status, farmer_notes?} entry is unusable, or None"""
+    order_id = entry.get('order_id') if isinstance(entry, dict) else None
+    if not isinstance(order_id, int) or isinstance(order_id, bool):
+        return 'order_id must be an integer'
+    if order_id in seen:
+        return 'Duplicate order_id in this request'
+    if entry.get('status') not in ORDER_STATUSES:
+        return 'Invalid status. Must be: pending, confirmed, rejected, or completed'
+    if not isinstance(entry.get('farmer_notes', ''), (str, type(None))):
+        return 'farmer_notes must be a string'
+    return None
+
+
+def bulk_update_order_status(farmer_id, entries):
+    """
+    Apply [{'order_id', 'status', 'farmer_notes'?}, ...] for farmer_id.
+    Returns (results, applied, changed_animal_ids): one result per entry in
+    request order, (order_id, previous_status) for each order updated, and
+    the animals whose availability flipped. The caller commits; a
+    ReservationConflict means another transaction took an animal meanwhile.
+    """
+    if not isinstance(entries, list) or not entries:
+        raise BulkStatusError('orders is required: a list of {order_id, status, farmer_notes}')
+    limit = current_app.config.get('BULK_STATUS_MAX_ORDERS', 500)
+    if len(entries) > limit:
+        raise BulkStatusError(f'Too many orders; at most {limit} per request')
+    
+    results, valid, seen = [None] * len(entries), [], set()
+    for i, entry in enumerate(entries):
+        error = _entry_error(entry, seen)
+        if error:
+            results[i] = _failure(entry.get('order_id') if isinstance(entry, dict) else None, 400, error)
+        else:
+            valid.append((i, entry))
+            seen.add(entry['order_id'])
+    if not valid:
+        return results, [], []
+    
+    # One query for existence, current status and ownership of every order
+    rows = db.session.query(Order.id, Order.status, FarmerOrder.farmer_id).outerjoin(
+        FarmerOrder, and_(FarmerOrder.order_id == Order.id, FarmerOrder.farmer_id == farmer_id)
+    ).filter(Order.id.in_([entry['order_id'] for _, entry in valid])).all()
+    found = {order_id: (status, owner) for order_id, status, owner in rows}
+    
+    # Rejected orders being reopened must still be able to claim their animals
+    reopening = [entry['order_id'] for _, entry in valid if found.get(entry['order_id'], (None, None))[1] is not None
+                 and reservation_action(found[entry['order_id']][0], entry['status']) == 'claim']
+    conflicts = claim_conflicts(reopening)
+    
+    accepted = []
+    for i, entry in valid:
+        order_id = entry['order_id']
+        if order_id not in found:
+            results[i] = _failure(order_id, 404, 'Order not found')
+        elif found[order_id][1] is None:
+            results[i] = _failure(order_id, 403, 'You can only update orders containing your animals')
+        elif order_id in conflicts:
+            results[i] = _failure(order_id, 409, 'Animals in this order have been ordered by someone else')
+        else:
+            accepted.append(entry)
+            results[i] = {'order_id': order_id, 'ok': True, 'previous_status': found[order_id][0],
+                          'status': entry['status']}
+    if not accepted:
+        return results, [], []
+    
+    orders = Order.__table__
+    accepted_ids = [entry['order_id'] for entry in accepted]
+    notes = {entry['order_id']: entry['farmer_notes'] for entry in accepted if 'farmer_notes' in entry}
+    total = select(func.coalesce(func.sum(OrderItem.price * OrderItem.quantity), 0)).where(
+        OrderItem.order_id == orders.c.id).scalar_subquery()
+    db.session.execute(
+        update(orders).where(orders.c.id.in_(accepted_ids)).values(
+            status=case({entry['order_id']: entry['status'] for entry in accepted}, value=orders.c.id),
+            farmer_notes=case(notes, value=orders.c.id, else_=orders.c.farmer_notes) if notes
+            else orders.c.farmer_notes,
+            total_amount=total,
+            updated_at=datetime.utcnow()
+        ).execution_options(synchronize_session=False)
+    )
+    
+    changed = move_reservations({entry['order_id']: (found[entry['order_id']][0], entry['status'])
+                                 for entry in accepted})
+    bump_after_commit(db.session, 'orders')
+    sync_farmer_orders(db.session.connection(), accepted_ids)
+    # Identity-map copies of the updated orders are now stale
+    db.session.expire_all()
+    
+    applied = [(entry['order_id'], found[entry['order_id']][0]) for entry in accepted]
+    return results, applied, changed
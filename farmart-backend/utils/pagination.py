@@ -0,0 +1,137 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are addressed by an opaque cursor holding the sort key of the last row
+served, so every page is a single index range scan of per_page + 1 rows no
+matter how deep the client has scrolled. The exact total is only counted
+when the client asks for it with include_total=true.
+"""
+import base64
+import json
+from datetime import datetime
+
+from flask import current_app, request
+from sqlalchemy import tuple_
+
+from models import Animal, FarmerOrder, Order, OrderItem
+
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 100
+
+# sort name -> (key columns, descending)
+ANIMAL_SORTS = {
+    'newest': ((Animal.created_at, Animal.id), True),
+    'price_asc': ((Animal.price, Animal.id), False),
+    'price_desc': ((Animal.price, Animal.id), True)
+}
+
+
+class PaginationError(ValueError):
+    """Raised for a cursor we did not issue or an unknown sort order"""
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value['dt'])
+    return value
+
+
+def encode_cursor(sort, values):
+    payload = json.dumps({'s': sort, 'v': [_encode_value(v) for v in values]}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(sort, cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = [_decode_value(v) for v in payload['v']]
+    except (ValueError, KeyError, TypeError) as e:
+        raise PaginationError('Invalid cursor') from e
+    if payload.get('s') != sort:
+        raise PaginationError('Cursor does not match the requested sort order')
+    return values
+
+
+def page_params():
+    """Read cursor, per_page and include_total from the query string"""
+    max_per_page = current_app.config.get('MAX_PER_PAGE', MAX_PER_PAGE)
+    per_page = request.args.get('per_page', DEFAULT_PER_PAGE, type=int)
+    per_page = max(1, min(per_page, max_per_page))
+    include_total = request.args.get('include_total', 'false').lower() in ('1', 'true', 'yes')
+    return request.args.get('cursor'), per_page, include_total
+
+# Keys for the order and order item listings, newest first
+ORDER_KEYS = (Order.created_at, Order.id)
+# Farmer dashboards page through farmer_orders; same cursor values as ORDER_KEYS
+FARMER_ORDER_KEYS = (FarmerOrder.created_at, FarmerOrder.order_id)
+ORDER_ITEM_KEYS = (OrderItem.id,)
+
+
+def animal_ordering(sort, rank=None):
+    """
+    Resolve an animal listing sort name to (key columns, descending).
+    'relevance' is only available when a search rank expression is given.
+    """
+    if sort == 'relevance' and rank is not None:
+        return (rank, Animal.id), False
+    if sort in ANIMAL_SORTS:
+        return ANIMAL_SORTS[sort]
+    raise PaginationError(f'Invalid sort. Must be one of: {", ".join(ANIMAL_SORTS)}'
+                          + (', relevance' if rank is not None else ''))
+
+
+class KeysetPage:
+    def __init__(self, items, per_page, next_cursor, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.has_next = next_cursor is not None
+        self.total = total
+    
+    def to_dict(self):
+        pagination = {
+            'per_page': self.per_page,
+            'has_next': self.has_next,
+            'next_cursor': self.next_cursor
+        }
+        if self.total is not None:
+            pagination['total'] = self.total
+        return pagination
+
+
+def keyset_paginate(query, keys, sort, cursor=None, per_page=DEFAULT_PER_PAGE,
+                    descending=True, include_total=False):
+    """
+    Paginate a single-entity query on the tuple of key expressions; the last
+    key must be unique, normally the primary key. sort names the ordering
+    and is baked into the cursor so it cannot be replayed against another.
+    """
+    total = query.order_by(None).count() if include_total else None
+
+    if cursor:
+        values = decode_cursor(sort, cursor)
+        if len(values) != len(keys):
+            raise PaginationError('Invalid cursor')
+        if descending:
+            query = query.filter(tuple_(*keys) < tuple_(*values))
+        else:
+            query = query.filter(tuple_(*keys) > tuple_(*values))
+
+    order = [key.desc() if descending else key.asc() for key in keys]
+    # Fetch the key values with each row so any expression (e.g. a search
+    # rank) can be a key, and one extra row to learn whether a next page exists
+    rows = query.add_columns(*keys).order_by(*order).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(sort, list(rows[-1][1:]))
+
+    return KeysetPage([row[0] for row in rows], per_page, next_cursor, total)
@@ -0,0 +1,83 @@
+"""
+Password hashing on a bounded worker pool.
+
+PBKDF2 and scrypt hold a CPU for the whole hash. Running them on a small
+dedicated pool caps how many hashes run at once, so a burst of logins or
+registrations queues behind the pool instead of taking over every request
+worker. When the queue is full the caller gets HasherBusy straight away and
+the route answers 503.
+
+The algorithm and cost come from PASSWORD_HASH_METHOD, in Werkzeug's
+format: 'pbkdf2:sha256:600000' or 'scrypt:32768:8:1'. Stored hashes made
+with other parameters report needs_rehash() so login can upgrade them.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask import current_app, has_app_context
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = 'pbkdf2:sha256:600000'
+
+
+class HasherBusy(RuntimeError):
+    """Raised when the hashing queue is full or a hash timed out"""
+
+
+class PasswordHasher:
+    def __init__(self, method=DEFAULT_METHOD, max_workers=2, max_pending=32, timeout=10):
+        # Canonical 'name:params' prefix, e.g. 'pbkdf2' -> 'pbkdf2:sha256:600000'
+        self.method = generate_password_hash('', method).split('$', 1)[0]
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+    
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy('Too many password operations in progress')
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HasherBusy('Password hashing timed out')
+    
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+    
+    def verify(self, stored_hash, password):
+        return self._run(check_password_hash, stored_hash, password)
+    
+    def needs_rehash(self, stored_hash):
+        return stored_hash.split('$', 1)[0] != self.method
+    
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+_default_hasher = None
+
+
+def password_hasher():
+    """The app's hasher, built from its config on first use"""
+    global _default_hasher
+    if not has_app_context():
+        if _default_hasher is None:
+            _default_hasher = PasswordHasher()
+        return _default_hasher
+    
+    hasher = current_app.extensions.get('password_hasher')
+    if hasher is None:
+        config = current_app.config
+        hasher = current_app.extensions['password_hasher'] = PasswordHasher(
+            method=config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD),
+            max_workers=config.get('PASSWORD_HASH_WORKERS', 2),
+            max_pending=config.get('PASSWORD_HASH_MAX_PENDING', 32),
+            timeout=config.get('PASSWORD_HASH_TIMEOUT', 10)
+        )
+    return hasher
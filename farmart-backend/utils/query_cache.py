@@ -0,0 +1,197 @@
+"""
+Result cache for catalog listings, keyed on the normalized filter set.
+
+Most GET /api/animals/ traffic is a handful of filter combinations (the bare
+first page, ?type=cow, ?type=sheep&min_price=100...). Pages are cached per
+normalized parameter set: filters lowercased, defaults filled in, falsy
+values dropped and everything sorted, so ?type=Cow&per_page=20 and ?type=cow
+share an entry.
+
+Entries are tagged with the catalog generation, the animals version in
+collection_versions. Every animal write advances it as it commits (the ORM
+flush listener or bump_after_commit), and so do order confirmations, so an
+entry from an older generation is never served.
+
+Within a generation an entry is fresh for QUERY_CACHE_TTL seconds and then
+stale for QUERY_CACHE_STALE_SECONDS more: the first request to find it
+stale recomputes it while every other request keeps getting the stale page
+(stale-while-revalidate). Concurrent misses for one key are coalesced: one
+request computes, the others wait for its result instead of all querying
+the database at once. Under the ASGI server the wait yields to the event
+loop rather than blocking it. Coalescing is per process.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy.util import await_only
+from sqlalchemy.util.concurrency import in_greenlet
+
+from models import db, CollectionVersion
+from utils.search import search_tokens
+
+# How often a waiting request on the event loop checks for the result
+POLL_SECONDS = 0.005
+
+
+class _Entry:
+    __slots__ = ('value', 'generation', 'fresh_until', 'stale_until')
+    
+    def __init__(self, value, generation, fresh_until, stale_until):
+        self.value = value
+        self.generation = generation
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+def _wait(event, timeout):
+    """Wait for another request's result without blocking the event loop"""
+    if not in_greenlet():
+        return event.wait(timeout)
+    # A view dispatched by asgi.py runs in a greenlet on the event loop thread,
+    # next to the request computing the result; let the loop run it
+    deadline = time.monotonic() + timeout
+    while not event.is_set() and time.monotonic() < deadline:
+        await_only(asyncio.sleep(POLL_SECONDS))
+    return event.is_set()
+
+
+class QueryCache:
+    """In-process LRU of computed results with stale-while-revalidate and miss coalescing"""
+    
+    def __init__(self, max_entries=1000, ttl=30, stale_ttl=30, wait_seconds=5):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.wait_seconds = wait_seconds
+        self._data = OrderedDict()
+        self._flights = {}  # (key, generation) -> Event set when its computation ends
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'coalesced': 0, 'refreshes': 0}
+    
+    def _usable(self, key, generation, now):
+        """The entry for key if it belongs to this generation and is not past its stale window"""
+        entry = self._data.get(key)
+        if entry is None or entry.generation != generation or entry.stale_until < now:
+            return None
+        self._data.move_to_end(key)
+        return entry
+    
+    def _store(self, key, generation, value):
+        now = time.monotonic()
+        with self._lock:
+            current = self._data.get(key)
+            # A slow computation must not replace a newer generation's entry
+            if current is None or current.generation <= generation:
+                self._data[key] = _Entry(value, generation, now + self.ttl, now + self.ttl + self.stale_ttl)
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+    
+    def _compute(self, key, generation, compute, event):
+        try:
+            value = compute()
+            self._store(key, generation, value)
+            return value
+        finally:
+            with self._lock:
+                self._flights.pop((key, generation), None)
+            event.set()
+    
+    def get_or_compute(self, key, generation, compute):
+        """
+        The cached result for key in this generation, calling compute() on a
+        miss or once the entry goes stale. Errors from compute() propagate and
+        are not cached.
+        """
+        flight = (key, generation)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._usable(key, generation, now)
+            if entry is not None and entry.fresh_until >= now:
+                self._counters['hits'] += 1
+                return entry.value
+            event = self._flights.get(flight)
+            if entry is not None:
+                if event is not None:
+                    # Someone is already refreshing it; keep serving the stale value
+                    self._counters['stale_hits'] += 1
+                    return entry.value
+                self._counters['refreshes'] += 1
+            elif event is not None:
+                self._counters['coalesced'] += 1
+            else:
+                self._counters['misses'] += 1
+            leader = event is None
+            if leader:
+                event = self._flights[flight] = threading.Event()
+        
+        if leader:
+            return self._compute(key, generation, compute, event)
+        
+        # Another request is computing this key; take its result when it lands
+        if _wait(event, self.wait_seconds):
+            with self._lock:
+                entry = self._usable(key, generation, time.monotonic())
+            if entry is not None:
+                return entry.value
+        # It failed or timed out: compute our own copy rather than fail the request
+        return compute()
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            counters['entries'] = len(self._data)
+            counters['in_flight'] = len(self._flights)
+        lookups = counters['hits'] + counters['stale_hits'] + counters['misses'] + counters['coalesced'] \
+            + counters['refreshes']
+        served = counters['hits'] + counters['stale_hits'] + counters['coalesced']
+        counters['hit_ratio'] = round(served / lookups, 4) if lookups else None
+        return counters
+
+
+def query_cache():
+    cache = current_app.extensions.get('query_cache')
+    if cache is None:
+        cache = current_app.extensions['query_cache'] = QueryCache(
+            max_entries=current_app.config.get('QUERY_CACHE_MAX_ENTRIES', 1000),
+            ttl=current_app.config.get('QUERY_CACHE_TTL', 30),
+            stale_ttl=current_app.config.get('QUERY_CACHE_STALE_SECONDS', 30),
+            wait_seconds=current_app.config.get('QUERY_CACHE_WAIT_SECONDS', 5)
+        )
+    return cache
+
+
+def catalog_generation():
+    """(name, version, updated_at) of the animals collection, the cache's generation"""
+    return db.session.query(
+        CollectionVersion.name, CollectionVersion.version, CollectionVersion.updated_at
+    ).filter_by(name='animals').one()
+
+
+def catalog_key(filters, view, sort, cursor, per_page, include_total, search=None, **extra):
+    """
+    Normalized cache key for one catalog page: string filters lowercased
+    (the catalog filters are case-insensitive), search reduced to its tokens,
+    empty values dropped (the query ignores them too) and items sorted
+    """
+    parts = {name: value.lower() if isinstance(value, str) else value
+             for name, value in {**filters, **extra}.items() if value}
+    if search:
+        parts['search'] = ' '.join(search_tokens(search))
+    parts.update(fields=','.join(view.names) if view.names is not None else None, sort=sort,
+                 cursor=cursor, per_page=per_page, include_total=include_total)
+    return tuple(sorted(parts.items()))
+
+
+def cached_catalog_page(generation, key, compute):
+    """compute() through the query cache, or directly when QUERY_CACHE is off"""
+    if not current_app.config.get('QUERY_CACHE', True):
+        return compute()
+    return query_cache().get_or_compute(key, (generation.version, generation.updated_at), compute)
@@ -0,0 +1,146 @@
+"""
+Read replicas and read-only sessions for GET requests.
+
+GET and HEAD requests run in a read-only session: autoflush off,
+expire_on_commit off, and any attempted flush raises ReadOnlySessionError.
+When SQLALCHEMY_REPLICA_URIS lists replicas, those requests are also routed
+(round robin) to a replica by RoutingSession. Replica connections are
+read-only themselves: PRAGMA query_only on SQLite, READ ONLY transactions
+on PostgreSQL.
+
+Read-your-writes: after a successful write, the writing client (its JWT
+identity, or its address for anonymous writes such as register) reads
+from the primary for REPLICA_STICKY_SECONDS, long enough for replication
+lag to catch up. The sticky window is tracked per process.
+"""
+import os
+import threading
+import time
+from itertools import count
+
+from flask import current_app, g, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+from models import db
+from utils.metrics import instrument_engine
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReplicaSet:
+    """Replica engines plus the clients currently pinned to the primary"""
+    
+    def __init__(self, engines=(), sticky_seconds=5):
+        self.engines = list(engines)
+        self.sticky_seconds = sticky_seconds
+        self._counter = count()
+        self._sticky = {}
+        self._lock = threading.Lock()
+    
+    def choose(self):
+        return self.engines[next(self._counter) % len(self.engines)]
+    
+    def mark_write(self, key):
+        if self.sticky_seconds <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if len(self._sticky) > 10000:
+                self._sticky = {k: until for k, until in self._sticky.items() if until > now}
+            self._sticky[key] = now + self.sticky_seconds
+    
+    def is_sticky(self, *keys):
+        if not self._sticky:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            return any(self._sticky.get(key, 0) > now for key in keys)
+
+
+def _sqlite_query_only(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA query_only = ON')
+    cursor.close()
+
+
+def replica_engine(uri, app):
+    """Engine for a replica URI, read-only at the connection level"""
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite':
+        # Relative SQLite paths are resolved like the primary's
+        if url.database and url.database != ':memory:' and not os.path.isabs(url.database):
+            url = url.set(database=os.path.join(app.instance_path, url.database))
+        engine = create_engine(url)
+        event.listen(engine, 'connect', _sqlite_query_only)
+        return engine
+    if url.get_backend_name() == 'postgresql':
+        return create_engine(url, pool_pre_ping=True).execution_options(postgresql_readonly=True)
+    return create_engine(url)
+
+
+def _reader_keys():
+    keys = [f'addr:{request.remote_addr}']
+    try:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+    except Exception:
+        identity = None  # the view reports bad tokens itself
+    if identity is not None:
+        keys.append(f'user:{identity}')
+    return keys
+
+
+def _writer_key():
+    try:
+        identity = get_jwt_identity()
+    except RuntimeError:
+        identity = None  # view without @jwt_required
+    return f'user:{identity}' if identity is not None else f'addr:{request.remote_addr}'
+
+
+def replicas():
+    return current_app.extensions['replicas']
+
+
+def init_replicas(app):
+    """Read-only sessions for safe methods, routed to replicas when configured"""
+    engines = [replica_engine(uri, app) for uri in app.config.get('SQLALCHEMY_REPLICA_URIS') or ()]
+    if 'metrics' in app.extensions:
+        # Replica statements count in /metrics and Server-Timing like the primary's
+        for engine in engines:
+            instrument_engine(engine)
+    app.extensions['replicas'] = ReplicaSet(engines, sticky_seconds=app.config.get('REPLICA_STICKY_SECONDS', 5))
+    
+    @app.before_request
+    def use_read_only_session():
+        if request.method not in SAFE_METHODS:
+            return
+        session = db.session()
+        g._read_only_session = (session, session.autoflush, session.expire_on_commit)
+        session.info['read_only'] = True
+        session.autoflush = False
+        session.expire_on_commit = False
+        
+        replica_set = replicas()
+        if replica_set.engines and not replica_set.is_sticky(*_reader_keys()):
+            session.info['replica'] = replica_set.choose()
+    
+    @app.after_request
+    def stick_to_primary(response):
+        replica_set = replicas()
+        if replica_set.engines and request.method not in SAFE_METHODS and response.status_code < 400:
+            replica_set.mark_write(_writer_key())
+        return response
+    
+    @app.teardown_request
+    def restore_session(exc):
+        state = g.pop('_read_only_session', None)
+        if state is None:
+            return
+        session, autoflush, expire_on_commit = state
+        session.info.pop('read_only', None)
+        session.info.pop('replica', None)
+        session.autoflush = autoflush
+        session.expire_on_commit = expire_on_commit
@@ -0,0 +1,156 @@
+"""
+Animal reservations held by orders.
+
+Checkout reserves an order's animals (is_available=False). An order holds
+them while its status is pending, confirmed or completed; a rejected order
+holds nothing. Status changes move the reservation with the order:
+
+- holding -> rejected releases every animal in the order, whichever farmer
+  it belongs to: the whole order is rejected, so none of it stays reserved
+- rejected -> holding claims them back with a guarded UPDATE like
+  checkout's, matching only rows that are still available; if another
+  order took any of them the change fails with ReservationConflict
+- pending -> confirmed or completed also claims any animal of the order
+  that is still on the market (orders placed before checkout reserved)
+- anything else, re-rejecting included, leaves the animals alone
+
+Pending orders nobody acts on are rejected, and their animals released,
+by `flask expire-pending-orders` once older than ORDER_RESERVATION_HOURS.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func, select, update
+
+from models import (db, Animal, Order, OrderItem, bump_after_commit, facet_deltas_after_commit,
+                    sync_farmer_orders)
+from models.facet_model import animal_facets
+from utils.cache import invalidate_animals, invalidate_orders
+from utils.events import publish_order_events
+from utils.serialization import load_plan
+
+HOLDING_STATUSES = ('pending', 'confirmed', 'completed')
+
+
+class ReservationConflict(Exception):
+    """A rejected order cannot be reopened: another order holds its animals"""
+
+
+def reservation_action(previous_status, new_status):
+    """'release', 'claim', 'top_up' or None for one status change"""
+    holding_before, holding_after = previous_status in HOLDING_STATUSES, new_status in HOLDING_STATUSES
+    if holding_before and not holding_after:
+        return 'release'
+    if holding_after and not holding_before:
+        return 'claim'
+    if previous_status == 'pending' and new_status in ('confirmed', 'completed'):
+        return 'top_up'
+    return None
+
+
+def claim_conflicts(order_ids):
+    """
+    Which of these orders cannot be reopened, in one query: one of their
+    animals is off the market, or an earlier order in the list needs it too
+    """
+    if not order_ids:
+        return set()
+    position = {order_id: i for i, order_id in enumerate(order_ids)}
+    rows = db.session.query(OrderItem.order_id, OrderItem.animal_id, Animal.is_available).join(
+        Animal, Animal.id == OrderItem.animal_id
+    ).filter(OrderItem.order_id.in_(order_ids)).all()
+    conflicts, taken = set(), {}
+    for order_id, animal_id, is_available in sorted(rows, key=lambda row: position[row[0]]):
+        if not is_available or taken.setdefault(animal_id, order_id) != order_id:
+            conflicts.add(order_id)
+    return conflicts
+
+
+def _set_available(order_ids, available):
+    """Flip the animals of these orders that are not already so; returns the changed rows"""
+    if not order_ids:
+        return []
+    table = Animal.__table__
+    in_orders = select(OrderItem.animal_id).where(OrderItem.order_id.in_(order_ids))
+    return db.session.execute(
+        update(table)
+        .where(table.c.id.in_(in_orders), table.c.is_available.is_(not available))
+        .values(is_available=available, version=table.c.version + 1, updated_at=datetime.utcnow())
+        .returning(table.c.id, table.c.type, table.c.breed, table.c.age, table.c.price)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+
+def move_reservations(transitions):
+    """
+    Apply {order_id: (previous_status, new_status)} to the orders' animals
+    in the caller's transaction and return the ids of the animals changed.
+    Raises ReservationConflict when an order being reopened lost an animal.
+    """
+    actions = {}
+    for order_id, (previous_status, new_status) in transitions.items():
+        actions.setdefault(reservation_action(previous_status, new_status), []).append(order_id)
+    
+    released = _set_available(actions.get('release'), True)
+    topped_up = _set_available(actions.get('top_up'), False)
+    claimed = _set_available(actions.get('claim'), False)
+    if actions.get('claim'):
+        needed = db.session.query(func.count(func.distinct(OrderItem.animal_id))).filter(
+            OrderItem.order_id.in_(actions['claim'])).scalar()
+        if len(claimed) != needed:
+            raise ReservationConflict('Animals in this order have been ordered by someone else')
+    
+    changed = released + topped_up + claimed
+    if changed:
+        # Core UPDATEs: the ORM listeners do not see them
+        deltas = Counter()
+        for rows, sign in ((released, 1), (topped_up, -1), (claimed, -1)):
+            for row in rows:
+                for pair in animal_facets(row._mapping):
+                    deltas[pair] += sign
+        bump_after_commit(db.session, 'animals')
+        facet_deltas_after_commit(db.session, deltas)
+        # Identity-map copies of the updated rows are now stale
+        db.session.expire_all()
+    return [row.id for row in changed]
+
+
+def expire_pending_orders(cutoff):
+    """
+    Reject pending orders created before cutoff and release their animals.
+    Returns (order_ids, changed_animal_ids). The caller commits.
+    """
+    orders = Order.__table__
+    # Guarded on status, so an order confirmed meanwhile is left alone
+    order_ids = db.session.execute(
+        update(orders).where(orders.c.status == 'pending', orders.c.created_at < cutoff)
+        .values(status='rejected', updated_at=datetime.utcnow())
+        .returning(orders.c.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    if not order_ids:
+        return [], []
+    changed = move_reservations({order_id: ('pending', 'rejected') for order_id in order_ids})
+    bump_after_commit(db.session, 'orders')
+    sync_farmer_orders(db.session.connection(), order_ids)
+    return order_ids, changed
+
+
+@click.command('expire-pending-orders')
+@with_appcontext
+def expire_pending_orders_command():
+    """Reject pending orders older than ORDER_RESERVATION_HOURS, releasing their animals."""
+    cutoff = datetime.utcnow() - timedelta(hours=current_app.config.get('ORDER_RESERVATION_HOURS', 72))
+    order_ids, changed = expire_pending_orders(cutoff)
+    db.session.commit()
+    
+    invalidate_animals(*changed)
+    invalidate_orders(*order_ids)
+    if order_ids:
+        orders = load_plan(Order.query, 'order').filter(Order.id.in_(order_ids)).all()
+        publish_order_events('order.status_changed',
+                             [(order.to_dict(), {'previous_status': 'pending'}) for order in orders])
+    click.echo(f'Expired pending orders: {len(order_ids)}, animals released: {len(changed)}')
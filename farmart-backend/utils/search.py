@@ -0,0 +1,128 @@
+"""
+Full-text search for the animal catalog.
+
+SQLite uses an external-content FTS5 table kept in sync by triggers and ranks
+with bm25(). PostgreSQL uses a weighted tsvector expression with a GIN index
+and ranks with ts_rank_cd(). Any other backend falls back to ILIKE matching.
+"""
+import re
+
+from sqlalchemy import column, event, false, func, inspect, literal_column, or_, table, text
+
+from models import db, Animal
+
+FTS_TABLE = 'animals_fts'
+PG_INDEX = 'ix_animals_search'
+
+# Column weights used for ranking: name > type/breed > description
+BM25_WEIGHTS = (10.0, 5.0, 5.0, 1.0)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+SQLITE_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "name, type, breed, description, "
+    "content='animals', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    f"CREATE TRIGGER IF NOT EXISTS animals_fts_ai AFTER INSERT ON animals BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, name, type, breed, description) "
+    "VALUES (new.id, new.name, new.type, new.breed, new.description); END",
+    f"CREATE TRIGGER IF NOT EXISTS animals_fts_ad AFTER DELETE ON animals BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, type, breed, description) "
+    "VALUES ('delete', old.id, old.name, old.type, old.breed, old.description); END",
+    f"CREATE TRIGGER IF NOT EXISTS animals_fts_au AFTER UPDATE OF name, type, breed, description ON animals BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, type, breed, description) "
+    "VALUES ('delete', old.id, old.name, old.type, old.breed, old.description); "
+    f"INSERT INTO {FTS_TABLE}(rowid, name, type, breed, description) "
+    "VALUES (new.id, new.name, new.type, new.breed, new.description); END",
+]
+
+SQLITE_DROP = f"DROP TABLE IF EXISTS {FTS_TABLE}"
+
+# Every function here is IMMUTABLE so PostgreSQL accepts it as an index expression
+PG_VECTOR = (
+    "setweight(to_tsvector('simple', coalesce({t}name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce({t}type, '') || ' ' || coalesce({t}breed, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce({t}description, '')), 'C')"
+)
+
+PG_DDL = f"CREATE INDEX IF NOT EXISTS {PG_INDEX} ON animals USING GIN (({PG_VECTOR.format(t='')}))"
+
+
+def _create_sqlite_index(connection, rebuild=False):
+    for statement in SQLITE_DDL:
+        connection.exec_driver_sql(statement)
+    if rebuild:
+        connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+@event.listens_for(Animal.__table__, 'after_create')
+def _after_animals_create(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        _create_sqlite_index(connection)
+    elif connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql(PG_DDL)
+
+
+@event.listens_for(Animal.__table__, 'before_drop')
+def _before_animals_drop(target, connection, **kw):
+    # The GIN index goes away with the table; the FTS5 table does not
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql(SQLITE_DROP)
+
+
+def ensure_search_index():
+    """
+    Create the search index for databases whose animals table predates it.
+    Must be called inside an app context after db.create_all().
+    """
+    engine = db.engine
+    with engine.begin() as connection:
+        if engine.dialect.name == 'sqlite':
+            exists = inspect(connection).has_table(FTS_TABLE)
+            if not exists:
+                _create_sqlite_index(connection, rebuild=True)
+        elif engine.dialect.name == 'postgresql':
+            connection.exec_driver_sql(PG_DDL)
+
+
+def search_tokens(search):
+    """Split raw user input into plain word tokens"""
+    return _TOKEN_RE.findall(search.lower())
+
+
+def apply_search(query, search):
+    """
+    Restrict an Animal query to rows matching the search text. Each word is a
+    prefix match and all words must match. Returns the filtered query and a
+    rank expression where lower is more relevant, or None when the backend
+    has no full-text ranking.
+    """
+    tokens = search_tokens(search)
+    if not tokens:
+        return query.filter(false()), None
+
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == 'sqlite':
+        fts = table(FTS_TABLE, column('rowid'))
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        rank = func.bm25(literal_column(FTS_TABLE), *BM25_WEIGHTS)
+        query = query.join(fts, fts.c.rowid == Animal.id).filter(
+            text(f'{FTS_TABLE} MATCH :search_match').bindparams(search_match=match)
+        )
+        return query, rank
+
+    if dialect == 'postgresql':
+        vector = literal_column(f"({PG_VECTOR.format(t='animals.')})")
+        tsquery = func.to_tsquery('simple', ' & '.join(f'{token}:*' for token in tokens))
+        return query.filter(vector.op('@@')(tsquery)), -func.ts_rank_cd(vector, tsquery)
+
+    for token in tokens:
+        query = query.filter(or_(
+            Animal.name.ilike(f'%{token}%'),
+            Animal.type.ilike(f'%{token}%'),
+            Animal.breed.ilike(f'%{token}%'),
+            Animal.description.ilike(f'%{token}%')
+        ))
+    return query, None
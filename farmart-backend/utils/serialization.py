@@ -0,0 +1,46 @@
+"""
+Eager-loading plans for the model serializers.
+
+Each plan lists the relationships the matching to_dict() walks, so a page of
+results costs a fixed number of SELECTs instead of one per row and relation.
+Many-to-one relations are joined into the main query; collections are
+fetched with one extra IN query per level.
+"""
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import Animal, CartItem, Order, OrderItem
+
+
+# Plans are built lazily because the backref attributes (Animal.farmer,
+# Order.customer, ...) only exist once the mappers are configured
+LOAD_PLANS = {
+    # Animal.to_dict() -> farmer
+    'animal': lambda: (
+        joinedload(Animal.farmer),
+    ),
+    # Animal.to_summary_dict() touches no relationships
+    'animal_summary': lambda: (),
+    # Order.to_dict() -> customer, order_items -> animal (summary)
+    'order': lambda: (
+        joinedload(Order.customer),
+        selectinload(Order.order_items).joinedload(OrderItem.animal)
+    ),
+    # Order.to_summary_dict() -> customer, len(order_items)
+    'order_summary': lambda: (
+        joinedload(Order.customer),
+        selectinload(Order.order_items)
+    ),
+    # OrderItem.to_dict() -> animal (summary)
+    'order_item': lambda: (
+        joinedload(OrderItem.animal),
+    ),
+    # CartItem.to_dict() -> animal -> farmer
+    'cart_item': lambda: (
+        joinedload(CartItem.animal).joinedload(Animal.farmer),
+    )
+}
+
+
+def load_plan(query, plan):
+    """Apply the eager-loading options a serializer needs to a query"""
+    return query.options(*LOAD_PLANS[plan]())
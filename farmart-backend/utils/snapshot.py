@@ -0,0 +1,263 @@
+"""
+In-memory columnar snapshot of available animals for anonymous browsing.
+
+With CATALOG_SNAPSHOT on (and NumPy installed), anonymous GET /api/animals/
+requests without search= or facets= are answered from an immutable
+snapshot instead of SQL. The numeric columns (id, price, age, weight,
+farmer_id, created_at) are NumPy arrays and type and breed are dictionary
+encoded, so the catalog filters become vectorized masks. Each sort order is
+presorted once per snapshot, and a page is the first per_page + 1 masked
+positions of it. Items, cursors and ETags are the same as the SQL path's,
+so a client can page across both.
+
+A snapshot is trusted for CATALOG_SNAPSHOT_MAX_AGE seconds. The first
+request after that reads the animals collection version and, if it moved,
+merges the rows updated since the previous refresh (minus a small overlap
+for transactions still in flight) into a new snapshot, published with a
+single reference swap. Readers never wait: while one request refreshes,
+the others keep serving the previous snapshot. Removals that do not touch
+updated_at show up as a mismatch in the available count and force a full
+rebuild, as does CATALOG_SNAPSHOT_REBUILD_SECONDS.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, request
+from sqlalchemy import func, select
+
+from models import db, Animal, CollectionVersion, User
+from utils.conditional import collection_validators
+from utils.pagination import ANIMAL_SORTS, KeysetPage, PaginationError, decode_cursor, encode_cursor
+
+try:
+    import numpy as np
+except ImportError:  # optional: without NumPy every request takes the SQL path
+    np = None
+
+EPOCH = datetime(1970, 1, 1)
+# Re-read rows updated this long before the last refresh, for commits that
+# landed after the refresh with an earlier updated_at
+OVERLAP = timedelta(seconds=5)
+COLUMNS = ('id', 'name', 'type', 'breed', 'age', 'weight', 'price', 'min_price', 'description',
+           'image_url', 'farmer_id', 'created_at', 'updated_at')
+
+
+def _micros(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def _rows(since=None):
+    animals = Animal.__table__
+    stmt = select(*(animals.c[name] for name in COLUMNS), animals.c.is_available,
+                  User.__table__.c.username).outerjoin(User.__table__, User.__table__.c.id == animals.c.farmer_id)
+    if since is None:
+        stmt = stmt.where(animals.c.is_available.is_(True))
+    else:
+        stmt = stmt.where(animals.c.updated_at >= since)
+    return db.session.execute(stmt).all()
+
+
+def _columns(rows):
+    """Column arrays for (COLUMNS...) tuples"""
+    values = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+    columns = {}
+    for name, column in zip(COLUMNS, values):
+        if name in ('id', 'farmer_id', 'age'):
+            columns[name] = np.array(column, dtype=np.int64)
+        elif name in ('price', 'weight'):
+            columns[name] = np.array(column, dtype=np.float64)
+        else:
+            columns[name] = np.array(column, dtype=object)
+    return columns
+
+
+class CatalogSnapshot:
+    """Immutable column arrays for every available animal"""
+    
+    def __init__(self, columns, farmer_names, version, version_updated_at, synced_to, rebuilt_at):
+        self.columns = columns
+        self.farmer_names = farmer_names
+        self.version = version
+        self.version_updated_at = version_updated_at
+        self.synced_to = synced_to
+        self.rebuilt_at = rebuilt_at
+        self.size = len(columns['id'])
+        
+        # Dictionary encoding: type/breed become small ints, decoded per page
+        self.types, type_codes = np.unique(columns['type'].astype(str), return_inverse=True)
+        self.breeds, breed_codes = np.unique(columns['breed'].astype(str), return_inverse=True)
+        self.type_codes, self.breed_codes = type_codes.ravel(), breed_codes.ravel()
+        self.created = np.array([_micros(value) for value in columns['created_at']], dtype=np.int64)
+        
+        # Positions in each sort order; ids break ties like the SQL keys do
+        self.orders = {
+            'newest': np.lexsort((-columns['id'], -self.created)),
+            'price_asc': np.lexsort((columns['id'], columns['price'])),
+            'price_desc': np.lexsort((-columns['id'], -columns['price']))
+        }
+    
+    def merged(self, rows, version, version_updated_at):
+        """A new snapshot with rows (changed since the last refresh) applied"""
+        changed = np.array([row.id for row in rows], dtype=np.int64)
+        keep = ~np.isin(self.columns['id'], changed)
+        added = [row for row in rows if row.is_available]
+        farmer_names = dict(self.farmer_names)
+        farmer_names.update({row.farmer_id: row.username for row in added})
+        
+        fresh = _columns([tuple(row)[:len(COLUMNS)] for row in added])
+        columns = {name: np.concatenate([self.columns[name][keep], fresh[name]]) for name in COLUMNS}
+        synced_to = max([self.synced_to] + [row.updated_at for row in rows if row.updated_at])
+        return CatalogSnapshot(columns, farmer_names, version, version_updated_at, synced_to, self.rebuilt_at)
+    
+    def validators(self):
+        """ETag / Last-Modified for the listing as of this snapshot's version"""
+        return collection_validators('animals', versions=[('animals', self.version, self.version_updated_at)])
+    
+    def mask(self, animal_type=None, breed=None, min_age=None, max_age=None, min_price=None, max_price=None):
+        """Same filters as the SQL catalog query (type/breed are case-insensitive substrings)"""
+        mask = np.ones(self.size, dtype=bool)
+        if animal_type:
+            codes = [code for code, value in enumerate(self.types) if animal_type.lower() in value.lower()]
+            mask &= np.isin(self.type_codes, codes)
+        if breed:
+            codes = [code for code, value in enumerate(self.breeds) if breed.lower() in value.lower()]
+            mask &= np.isin(self.breed_codes, codes)
+        if min_age:
+            mask &= self.columns['age'] >= min_age
+        if max_age:
+            mask &= self.columns['age'] <= max_age
+        if min_price:
+            mask &= self.columns['price'] >= min_price
+        if max_price:
+            mask &= self.columns['price'] <= max_price
+        return mask
+    
+    def _after_cursor(self, sort, cursor):
+        values = decode_cursor(sort, cursor)
+        try:
+            value, last_id = values
+            if sort == 'newest':
+                column, value = self.created, _micros(value)
+            else:
+                column, value = self.columns['price'], float(value)
+        except (TypeError, ValueError) as e:
+            raise PaginationError('Invalid cursor') from e
+        ids = self.columns['id']
+        if sort != 'price_asc':
+            return (column < value) | ((column == value) & (ids < last_id))
+        return (column > value) | ((column == value) & (ids > last_id))
+    
+    def payload(self, i):
+        """Row i in Animal.to_dict() form"""
+        c = self.columns
+        return {
+            'id': int(c['id'][i]),
+            'name': c['name'][i],
+            'type': c['type'][i],
+            'breed': c['breed'][i],
+            'age': int(c['age'][i]),
+            'weight': float(c['weight'][i]),
+            'price': float(c['price'][i]),
+            'min_price': c['min_price'][i],
+            'description': c['description'][i],
+            'image_url': c['image_url'][i],
+            'is_available': True,
+            'farmer_id': int(c['farmer_id'][i]),
+            'farmer_name': self.farmer_names.get(int(c['farmer_id'][i])),
+            'created_at': c['created_at'][i].isoformat(),
+            'updated_at': c['updated_at'][i].isoformat()
+        }
+    
+    def page(self, view, sort, cursor=None, per_page=20, include_total=False, **filters):
+        """One keyset page of projected payloads, as keyset_paginate would return"""
+        if sort not in ANIMAL_SORTS:
+            raise PaginationError(f'Invalid sort. Must be one of: {", ".join(ANIMAL_SORTS)}')
+        mask = self.mask(**filters)
+        total = int(mask.sum()) if include_total else None
+        if cursor:
+            mask &= self._after_cursor(sort, cursor)
+        order = self.orders[sort]
+        positions = order[mask[order]][:per_page + 1]
+        
+        next_cursor = None
+        if len(positions) > per_page:
+            positions = positions[:per_page]
+            last = positions[-1]
+            key = self.columns['created_at'][last] if sort == 'newest' else float(self.columns['price'][last])
+            next_cursor = encode_cursor(sort, [key, int(self.columns['id'][last])])
+        return KeysetPage([view.project(self.payload(i)) for i in positions], per_page, next_cursor, total)
+
+
+def _collection_version():
+    return db.session.query(CollectionVersion.version, CollectionVersion.updated_at).filter_by(
+        name='animals').one()
+
+
+class SnapshotStore:
+    """Holds the current snapshot and refreshes it without blocking readers"""
+    
+    def __init__(self, max_age=2, rebuild_seconds=300):
+        self.max_age = max_age
+        self.rebuild_seconds = rebuild_seconds
+        self.snapshot = None
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+    
+    def build(self):
+        version, version_updated_at = _collection_version()
+        rows = _rows()
+        farmer_names = {row.farmer_id: row.username for row in rows}
+        synced_to = max((row.updated_at for row in rows if row.updated_at), default=EPOCH)
+        return CatalogSnapshot(_columns([tuple(row)[:len(COLUMNS)] for row in rows]), farmer_names,
+                               version, version_updated_at, synced_to, time.monotonic())
+    
+    def refresh(self, snapshot):
+        version, version_updated_at = _collection_version()
+        if version == snapshot.version:
+            return snapshot
+        fresh = snapshot.merged(_rows(since=snapshot.synced_to - OVERLAP), version, version_updated_at)
+        available = db.session.query(func.count(Animal.id)).filter_by(is_available=True).scalar()
+        if fresh.size != available:
+            return self.build()  # a change that did not touch updated_at
+        return fresh
+    
+    def get(self):
+        """The current snapshot, refreshed if stale; None until the first build"""
+        snapshot = self.snapshot
+        if snapshot is not None and time.monotonic() - self.checked_at < self.max_age:
+            return snapshot
+        if not self._lock.acquire(blocking=False):
+            return snapshot  # another request is refreshing
+        try:
+            if self.snapshot is None or time.monotonic() - self.snapshot.rebuilt_at > self.rebuild_seconds:
+                self.snapshot = self.build()
+            else:
+                self.snapshot = self.refresh(self.snapshot)
+            self.checked_at = time.monotonic()
+            return self.snapshot
+        finally:
+            self._lock.release()
+
+
+def snapshot_store():
+    store = current_app.extensions.get('catalog_snapshot')
+    if store is None:
+        store = current_app.extensions['catalog_snapshot'] = SnapshotStore(
+            max_age=current_app.config.get('CATALOG_SNAPSHOT_MAX_AGE', 2),
+            rebuild_seconds=current_app.config.get('CATALOG_SNAPSHOT_REBUILD_SECONDS', 300)
+        )
+    return store
+
+
+def catalog_snapshot():
+    """
+    The snapshot to answer this catalog request from, or None when the SQL
+    path must serve it: snapshot off or NumPy missing, an authenticated
+    caller, a search or facet request, or no snapshot built yet.
+    """
+    if np is None or not current_app.config.get('CATALOG_SNAPSHOT'):
+        return None
+    if 'Authorization' in request.headers or request.args.get('search') or request.args.get('facets'):
+        return None
+    return snapshot_store().get()